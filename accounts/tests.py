@@ -1,3 +1,49 @@
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from core.cache import get_cache
+from core.testing import QueryBudgetMixin
+from items.models import Item
+
+from .models import CustomUser
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(email='student@example.com', password='pass12345')
+
+    def setUp(self):
+        get_cache().clear()
+
+    def add_users(self, count):
+        # Other accounts, each with an item in the feed the pages link to
+        start = CustomUser.objects.count()
+        users = CustomUser.objects.bulk_create([
+            CustomUser(email=f'user{i}@example.com', password='!') for i in range(start, start + count)
+        ])
+        Item.objects.bulk_create([Item(poster=user, item_type='found', title='Keys') for user in users])
+
+    def logged_out(self, count):
+        self.add_users(count)
+        self.client.logout()
+
+    def test_login(self):
+        self.assertConstantQueries(self.add_users, lambda: self.client.get(reverse('login')), budget=0)
+        self.assertConstantQueries(self.logged_out, lambda: self.client.post(reverse('login'), {
+            'username': 'student@example.com', 'password': 'pass12345',
+        }), budget=9)
+
+    def test_register(self):
+        self.assertConstantQueries(self.add_users, lambda: self.client.get(reverse('register')), budget=0)
+        self.assertConstantQueries(self.logged_out, lambda: self.client.post(reverse('register'), {
+            'email': f'new{CustomUser.objects.count()}@example.com',
+            'password1': 'pass12345', 'password2': 'pass12345', 'full_name': 'New Student',
+        }), budget=11)
+
+    def test_logout(self):
+        def logged_in(count):
+            self.add_users(count)
+            self.client.force_login(self.user)
+
+        self.assertConstantQueries(logged_in, lambda: self.client.get(reverse('logout')), budget=4)
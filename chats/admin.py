@@ -7,13 +7,13 @@ class ConversationAdmin(admin.ModelAdmin):
     list_display = ['item', 'sender', 'receiver', 'created_at', 'updated_at']
     list_filter = ['created_at', 'updated_at']
     search_fields = ['item__title', 'sender__email', 'receiver__email']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['created_at', 'updated_at', 'sender_last_read_id', 'receiver_last_read_id']
 
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ['conversation', 'sender', 'content_preview', 'is_read', 'created_at']
-    list_filter = ['is_read', 'created_at']
+    list_display = ['conversation', 'sender', 'content_preview', 'created_at']
+    list_filter = ['created_at']
     search_fields = ['content', 'sender__email']
     readonly_fields = ['created_at']
     
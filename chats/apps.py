@@ -1,6 +1,23 @@
 from django.apps import AppConfig
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save, pre_delete
 
 
 class ChatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chats'
+
+    def ready(self):
+        from . import signals
+        from items.models import Item
+        from .models import Conversation, Message
+
+        post_save.connect(signals.add_participants, sender=Conversation)
+        post_save.connect(signals.invalidate_conversation, sender=Conversation)
+        post_delete.connect(signals.invalidate_conversation, sender=Conversation)
+        # Deleting an item deletes its conversations, which invalidates them
+        post_save.connect(signals.invalidate_item_conversations, sender=Item)
+        post_save.connect(signals.record_new_message, sender=Message)
+        post_delete.connect(signals.forget_deleted_message, sender=Message)
+        for model in (Conversation, Item, get_user_model()):
+            pre_delete.connect(signals.forget_deleted_conversations, sender=model)
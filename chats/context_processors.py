@@ -1,5 +1,4 @@
-from django.db.models import Q
-from .models import Message, Conversation
+from .models import UnreadCounter
 
 
 def unread_messages(request):
@@ -7,17 +6,8 @@ def unread_messages(request):
     Add unread message count to all templates
     """
     if request.user.is_authenticated:
-        # Get all conversations where user is involved
-        conversations = Conversation.objects.filter(
-            Q(sender=request.user) | Q(receiver=request.user)
-        )
-        
-        # Count unread messages (not sent by current user)
-        unread_count = Message.objects.filter(
-            conversation__in=conversations,
-            is_read=False
-        ).exclude(sender=request.user).count()
-        
-        return {'unread_messages_count': unread_count}
+        # Templates call this only if they actually show the count, and
+        # then it's a single primary-key lookup on the user's counter
+        return {'unread_messages_count': lambda: UnreadCounter.objects.count_for(request.user)}
     
-    return {'unread_messages_count': 0}
\ No newline at end of file
+    return {'unread_messages_count': 0}
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import random
+import statistics
+import time
+from importlib import import_module
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+
+from chats.models import Conversation, Participant
+from core.asgi import application
+from items.models import Item
+
+User = get_user_model()
+
+EMAIL_DOMAIN = 'loadtest.invalid'
+
+
+class FakeSocket:
+    """Drives the ASGI application the way a server would for one WebSocket"""
+
+    def __init__(self, path, cookie, origin):
+        self.scope = {
+            'type': 'websocket',
+            'path': path,
+            'headers': [(b'cookie', cookie.encode()), (b'origin', origin.encode())],
+        }
+        self.inbound = asyncio.Queue()
+        self.outbound = asyncio.Queue()
+        self.task = None
+
+    async def connect(self):
+        self.task = asyncio.create_task(application(self.scope, self.inbound.get, self.outbound.put))
+        await self.inbound.put({'type': 'websocket.connect'})
+        reply = await self.outbound.get()
+        if reply['type'] != 'websocket.accept':
+            raise RuntimeError(f'Socket rejected with {reply}')
+
+    async def send_json(self, data):
+        await self.inbound.put({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def receive_json(self):
+        return json.loads((await self.outbound.get())['text'])
+
+    async def close(self):
+        await self.inbound.put({'type': 'websocket.disconnect', 'code': 1000})
+        await self.task
+
+
+class Command(BaseCommand):
+    """
+    Measure how many concurrent conversations one ASGI worker sustains.
+
+    Each conversation gets two sockets that take turns sending a message
+    every --interval seconds, so every message goes through the INSERT,
+    the signal handlers and broker fan-out. Latency is measured from send
+    to delivery on the other socket; a level is sustained while its p95
+    stays under --target-ms. --interval 0 sends back to back, which
+    measures the worker's raw throughput instead.
+
+    Users, items and conversations are created for the run and deleted
+    afterwards; run it against a scratch database.
+    """
+
+    help = 'Load test live chat delivery over WebSockets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', default='50,100,200,400,800',
+                            help='Comma-separated numbers of concurrent conversations to try')
+        parser.add_argument('--messages', type=int, default=10, help='Messages per conversation')
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Seconds between messages within one conversation')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--target-ms', type=float, default=100,
+                            help='p95 delivery latency a level must stay under to count as sustained')
+
+    def handle(self, *args, **options):
+        levels = [int(n) for n in options['conversations'].split(',')]
+        origin = f'http://{settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else "localhost"}'
+        sustained = 0
+
+        self.stdout.write(f'{"convs":>6} {"msgs/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+        for count in levels:
+            pairs, session_keys = self.create_conversations(count)
+            try:
+                elapsed, latencies = async_to_sync(self.run_level)(pairs, origin, options)
+            finally:
+                User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}').delete()
+                Session.objects.filter(session_key__in=session_keys).delete()
+
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            self.stdout.write(
+                f'{count:>6} {len(latencies) / elapsed:>8.0f} '
+                f'{statistics.median(latencies):>8.1f} {p95:>8.1f} '
+                f'{latencies[int(len(latencies) * 0.99) - 1]:>8.1f}'
+            )
+            if p95 <= options['target_ms']:
+                sustained = count
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Sustained {sustained} concurrent conversations with p95 under {options["target_ms"]:.0f}ms'
+        ))
+
+    def create_conversations(self, count):
+        """
+        [(conversation_id, cookie_a, cookie_b)] for ``count`` fresh user
+        pairs, and the session keys behind the cookies
+        """
+        users = User.objects.bulk_create([
+            User(email=f'user{i}@{EMAIL_DOMAIN}', password='!') for i in range(count * 2)
+        ])
+        items = Item.objects.bulk_create([
+            Item(poster=users[i * 2], item_type='found', title=f'Load test item {i}') for i in range(count)
+        ])
+        conversations = [
+            Conversation(item=items[i], sender=users[i * 2 + 1], receiver=users[i * 2]) for i in range(count)
+        ]
+        for conversation in conversations:
+            conversation.assign_pair()
+        Conversation.objects.bulk_create(conversations)
+        Participant.objects.create_for(conversations)
+        session_keys = [self.login(user) for user in users]
+        cookies = [f'{settings.SESSION_COOKIE_NAME}={key}' for key in session_keys]
+        pairs = [(conversations[i].id, cookies[i * 2 + 1], cookies[i * 2]) for i in range(count)]
+        return pairs, session_keys
+
+    @staticmethod
+    def login(user):
+        """Key of a new authenticated session for ``user``"""
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return session.session_key
+
+    async def run_level(self, pairs, origin, options):
+        sockets = []
+        for conversation_id, cookie_a, cookie_b in pairs:
+            path = f'/ws/chats/{conversation_id}/'
+            pair = (FakeSocket(path, cookie_a, origin), FakeSocket(path, cookie_b, origin))
+            for socket in pair:
+                await socket.connect()
+            sockets.append(pair)
+
+        rng = random.Random(options['seed'])
+        latencies = []
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            # Stagger the conversations so their messages don't all land at once
+            self.converse(a, b, options['messages'], options['interval'],
+                          rng.uniform(0, options['interval']), latencies)
+            for a, b in sockets
+        ))
+        elapsed = time.perf_counter() - start
+
+        for pair in sockets:
+            for socket in pair:
+                await socket.close()
+        return elapsed, latencies
+
+    @staticmethod
+    async def converse(a, b, messages, interval, offset, latencies):
+        """Alternate senders; each message is also echoed back to its own sender"""
+        start = time.perf_counter() + offset
+        for n in range(messages):
+            sender, recipient = (a, b) if n % 2 == 0 else (b, a)
+            await asyncio.sleep(max(0, start + n * interval - time.perf_counter()))
+            sent = time.perf_counter()
+            await sender.send_json({'type': 'message', 'content': f'Message {n}'})
+            while (await recipient.receive_json())['type'] != 'message':
+                pass
+            latencies.append((time.perf_counter() - sent) * 1000)
+            while (await sender.receive_json())['type'] != 'message':
+                pass
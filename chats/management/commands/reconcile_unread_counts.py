@@ -0,0 +1,94 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F
+
+from chats.models import Message, UnreadCounter
+
+
+class Command(BaseCommand):
+    """
+    Recount unread messages from scratch and repair drifted counters.
+
+    The recount is one grouped aggregate. Each drifted counter is then
+    written only if it still holds the value it was compared at. A message
+    sent or read in between changes the counter (in the same transaction
+    as the message), so that user is recounted and the write tried again.
+    This keeps the command safe to run on a live database.
+    """
+
+    help = 'Repair denormalized unread message counters'
+
+    retries = 3
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without fixing it')
+
+    def handle(self, *args, **options):
+        actual = self.actual_counts()
+        batch_size = options['batch_size']
+
+        drifted, seen = [], set()
+        for counter in UnreadCounter.objects.order_by('user_id').iterator(chunk_size=batch_size):
+            seen.add(counter.user_id)
+            expected = actual.get(counter.user_id, 0)
+            if counter.count != expected:
+                drifted.append((counter.user_id, counter.count, expected))
+        missing = [(user_id, None, count) for user_id, count in actual.items() if user_id not in seen]
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f'Would repair {len(drifted)} drifted and {len(missing)} missing counters'
+            ))
+            return
+
+        busy = [user_id for user_id, old, expected in drifted + missing if not self.repair(user_id, old, expected)]
+        self.stdout.write(self.style.SUCCESS(
+            f'Repaired {len(drifted) + len(missing) - len(busy)} of {len(drifted)} drifted '
+            f'and {len(missing)} missing counters'
+        ))
+        if busy:
+            self.stdout.write(self.style.WARNING(
+                f'{len(busy)} counters kept changing and were left alone; run again to retry them'
+            ))
+
+    def repair(self, user_id, old, expected):
+        """
+        Set ``user_id``'s counter to ``expected`` if it still holds ``old``
+        (None: no row). Recounts and retries when a concurrent message or
+        read got there first; False if it never settled.
+        """
+        for attempt in range(self.retries):
+            if attempt:
+                old = UnreadCounter.objects.filter(user_id=user_id).values_list('count', flat=True).first()
+                expected = self.actual_counts(user_id).get(user_id, 0)
+            if old == expected:
+                return True
+            if old is None:
+                if UnreadCounter.objects.get_or_create(user_id=user_id, defaults={'count': expected})[1]:
+                    return True
+            elif UnreadCounter.objects.filter(user_id=user_id, count=old).update(count=expected):
+                return True
+        return False
+
+    @staticmethod
+    def actual_counts(user_id=None):
+        """{user_id: unread messages addressed to that user}, for everyone or just ``user_id``"""
+        counts = Counter()
+        # One grouped range count per side of the conversation: messages
+        # from the other participant above this participant's watermark
+        for side in ('sender', 'receiver'):
+            messages = Message.objects.all()
+            if user_id is not None:
+                messages = messages.filter(**{f'conversation__{side}_id': user_id})
+            rows = (
+                messages.filter(id__gt=F(f'conversation__{side}_last_read_id'))
+                .exclude(sender_id=F(f'conversation__{side}_id'))
+                .values(f'conversation__{side}_id')
+                .annotate(unread=Count('id'))
+                .order_by()
+            )
+            for row in rows:
+                counts[row[f'conversation__{side}_id']] += row['unread']
+        return counts
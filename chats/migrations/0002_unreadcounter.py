@@ -0,0 +1,44 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, Count, F, When
+
+
+def count_existing_unread(apps, schema_editor):
+    Message = apps.get_model('chats', 'Message')
+    UnreadCounter = apps.get_model('chats', 'UnreadCounter')
+    totals = (
+        Message.objects.filter(is_read=False)
+        .annotate(recipient=Case(
+            When(sender_id=F('conversation__sender_id'), then=F('conversation__receiver_id')),
+            default=F('conversation__sender_id'),
+        ))
+        .values('recipient')
+        .annotate(unread=Count('id'))
+        .order_by()
+    )
+    UnreadCounter.objects.bulk_create(
+        [UnreadCounter(user_id=row['recipient'], count=row['unread']) for row in totals],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_alter_customuser_managers_alter_customuser_email'),
+        ('chats', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='unread_counter', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_existing_unread, migrations.RunPython.noop),
+    ]
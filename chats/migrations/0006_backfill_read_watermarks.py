@@ -0,0 +1,61 @@
+from django.db import migrations, models, transaction
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 500
+
+
+def watermark(Message, reader):
+    """
+    Just below the first unread message from the other participant, or
+    the latest message if everything they sent has been read.
+    """
+    messages = Message.objects.filter(conversation=OuterRef('pk'))
+    first_unread = (
+        messages.filter(is_read=False)
+        .exclude(sender_id=OuterRef(f'{reader}_id'))
+        .order_by('id')
+        .values('id')[:1]
+    )
+    latest = messages.order_by('-id').values('id')[:1]
+    return Coalesce(
+        Subquery(first_unread) - Value(1),
+        Subquery(latest),
+        Value(0),
+        output_field=models.PositiveBigIntegerField(),
+    )
+
+
+def backfill_watermarks(apps, schema_editor):
+    """
+    Derive each participant's watermark from is_read, one committed batch
+    of conversations at a time so no lock is held for the whole table.
+    """
+    Conversation = apps.get_model('chats', 'Conversation')
+    Message = apps.get_model('chats', 'Message')
+    last_id = 0
+    while True:
+        batch = list(
+            Conversation.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        with transaction.atomic():
+            Conversation.objects.filter(pk__in=batch).update(
+                sender_last_read_id=watermark(Message, 'sender'),
+                receiver_last_read_id=watermark(Message, 'receiver'),
+            )
+        last_id = batch[-1]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('chats', '0005_conversation_read_watermarks'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_watermarks, migrations.RunPython.noop),
+    ]
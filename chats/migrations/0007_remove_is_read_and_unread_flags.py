@@ -0,0 +1,25 @@
+# Generated by Django 5.1.6 on 2026-10-18 09:58
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0006_backfill_read_watermarks'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='conversation',
+            name='receiver_has_unread',
+        ),
+        migrations.RemoveField(
+            model_name='conversation',
+            name='sender_has_unread',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
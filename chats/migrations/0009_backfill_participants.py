@@ -0,0 +1,41 @@
+from django.db import migrations, transaction
+
+BATCH_SIZE = 500
+
+
+def create_participants(apps, schema_editor):
+    """Inbox rows for existing conversations, one committed batch at a time"""
+    Conversation = apps.get_model('chats', 'Conversation')
+    Participant = apps.get_model('chats', 'Participant')
+    last_id = 0
+    while True:
+        batch = list(
+            Conversation.objects.filter(pk__gt=last_id).order_by('pk')
+            .only('pk', 'sender_id', 'receiver_id', 'last_message_at', 'updated_at')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        with transaction.atomic():
+            Participant.objects.bulk_create(
+                [
+                    Participant(conversation_id=conversation.pk, user_id=user_id,
+                                updated_at=conversation.last_message_at or conversation.updated_at)
+                    for conversation in batch
+                    for user_id in (conversation.sender_id, conversation.receiver_id)
+                ],
+                ignore_conflicts=True,
+            )
+        last_id = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('chats', '0008_participant'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_participants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+from django.db import migrations, transaction
+from django.db.models import Count, F, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest, Least, Substr
+
+BATCH_SIZE = 500
+
+
+def assign_pairs(apps, schema_editor):
+    """Fill user_low/user_high, one committed batch of conversations at a time"""
+    Conversation = apps.get_model('chats', 'Conversation')
+    last_id = 0
+    while True:
+        batch = list(
+            Conversation.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        with transaction.atomic():
+            Conversation.objects.filter(pk__in=batch).update(
+                user_low=Least(F('sender'), F('receiver')),
+                user_high=Greatest(F('sender'), F('receiver')),
+            )
+        last_id = batch[-1]
+
+
+def merge_duplicate_threads(apps, schema_editor):
+    """
+    Fold conversations that the old (item, sender, receiver) constraint
+    allowed twice -- once in each direction -- into the older one, so the
+    pair constraint can be added. The kept thread's inbox rows move up to
+    its newest message, which may have come from a merged one. Run reconcile_unread_counts afterwards
+    if any were merged.
+    """
+    Conversation = apps.get_model('chats', 'Conversation')
+    Message = apps.get_model('chats', 'Message')
+    Participant = apps.get_model('chats', 'Participant')
+    duplicates = (
+        Conversation.objects.values('item', 'user_low', 'user_high')
+        .annotate(threads=Count('id'), keep=Min('id'))
+        .filter(threads__gt=1)
+        .order_by()
+    )
+    for group in duplicates:
+        with transaction.atomic():
+            extra = Conversation.objects.filter(
+                item=group['item'], user_low=group['user_low'], user_high=group['user_high']
+            ).exclude(pk=group['keep'])
+            Message.objects.filter(conversation__in=extra).update(conversation_id=group['keep'])
+            extra.delete()
+
+            latest = Message.objects.filter(conversation=OuterRef('pk')).order_by('-id')
+            Conversation.objects.filter(pk=group['keep']).update(
+                last_message_id=Subquery(latest.values('id')[:1]),
+                last_message_preview=Subquery(latest.annotate(preview=Substr('content', 1, 140)).values('preview')[:1]),
+                last_message_sender_id=Subquery(latest.values('sender_id')[:1]),
+                last_message_at=Subquery(latest.values('created_at')[:1]),
+            )
+            newest = Message.objects.filter(conversation=OuterRef('conversation')).order_by('-id')
+            Participant.objects.filter(conversation=group['keep']).update(
+                updated_at=Coalesce(Subquery(newest.values('created_at')[:1]), F('updated_at')),
+            )
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('chats', '0010_conversation_participant_pair'),
+    ]
+
+    operations = [
+        migrations.RunPython(assign_pairs, migrations.RunPython.noop),
+        migrations.RunPython(merge_duplicate_threads, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,42 @@
 from django.db import models
+from django.db.models import Exists, F, Func, OuterRef, Q, Subquery
+from django.db.models.functions import Greatest
 from django.contrib.auth import get_user_model
+from core.cache import invalidate_tags
 from items.models import Item
 
+from .realtime import publish_after_commit
+
 User = get_user_model()
 
+PREVIEW_LENGTH = 140
+
+
+class ConversationManager(models.Manager):
+    def get_or_start_id(self, item_id, starter_id, other_id):
+        """
+        Id of the conversation between two users about an item, starting
+        one with ``starter_id`` as sender if there is none.
+        
+        The lookup and the insert are one INSERT ... ON CONFLICT DO UPDATE
+        ... RETURNING against the (item, user_low, user_high) constraint,
+        so users starting the same thread at once all get the same row and
+        nobody sees an IntegrityError. The no-op update is only there to
+        make the conflicting row's id come back.
+        """
+        conversation = Conversation(item_id=item_id, sender_id=starter_id, receiver_id=other_id)
+        conversation.assign_pair()
+        self.bulk_create(
+            [conversation],
+            update_conflicts=True,
+            unique_fields=['item', 'user_low', 'user_high'],
+            update_fields=['user_low'],
+        )
+        # bulk_create skips post_save, so add the inbox rows here
+        Participant.objects.create_for([conversation])
+        invalidate_tags(*conversation.cache_tags())
+        return conversation.pk
+
 
 class Conversation(models.Model):
     """
@@ -12,23 +45,136 @@ class Conversation(models.Model):
     item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='conversations')
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='initiated_conversations')
     receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_conversations')
+    
+    # The same two users in id order, whoever started the thread, so there
+    # is at most one conversation per item and unordered pair
+    user_low = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    user_high = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    # Snapshot of the latest message, written with each new message so
+    # conversation lists never have to touch the messages table
+    last_message = models.ForeignKey(
+        'Message',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    last_message_preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True)
+    last_message_sender = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    
+    # Read watermarks: the id of the newest message each participant has
+    # read. Everything above a participant's watermark from the other side
+    # is unread, so marking read is a single-row write.
+    sender_last_read_id = models.PositiveBigIntegerField(default=0)
+    receiver_last_read_id = models.PositiveBigIntegerField(default=0)
+    
+    objects = ConversationManager()
+    
     class Meta:
         ordering = ['-updated_at']
-        unique_together = ['item', 'sender', 'receiver']
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'user_low', 'user_high'], name='conversation_item_pair_uniq'),
+        ]
     
     def __str__(self):
         return f"Conversation about {self.item.title} between {self.sender.email} and {self.receiver.email}"
     
+    def save(self, *args, **kwargs):
+        self.assign_pair()
+        super().save(*args, **kwargs)
+    
+    def assign_pair(self):
+        """Fill user_low/user_high from sender and receiver"""
+        self.user_low_id, self.user_high_id = sorted([self.sender_id, self.receiver_id])
+    
+    def cache_tags(self):
+        """Tags of the cached views showing this conversation (see core/cache.py)"""
+        return [
+            f'conversation:{self.pk}',
+            f'user:{self.sender_id}:conversations',
+            f'user:{self.receiver_id}:conversations',
+        ]
+    
     def get_other_user(self, user):
         """Get the other user in the conversation"""
         return self.receiver if user == self.sender else self.sender
     
+    def get_other_user_id(self, user_id):
+        """Like get_other_user(), without loading either user"""
+        return self.receiver_id if user_id == self.sender_id else self.sender_id
+    
     def get_last_message(self):
         """Get the last message in this conversation"""
         return self.messages.first()
+    
+    def last_read_field_for(self, user_id):
+        """Name of the read watermark field belonging to ``user_id``"""
+        return 'sender_last_read_id' if user_id == self.sender_id else 'receiver_last_read_id'
+    
+    def last_read_id_for(self, user_id):
+        return getattr(self, self.last_read_field_for(user_id))
+    
+    def has_unread_for(self, user_id):
+        """Whether ``user_id`` has unread messages here, from the snapshot"""
+        return (self.last_message_id or 0) > self.last_read_id_for(user_id)
+    
+    def unread_messages_for(self, user_id, up_to=None):
+        """The other participant's messages above ``user_id``'s watermark"""
+        messages = Message.objects.filter(
+            conversation_id=self.pk,
+            id__gt=self.last_read_id_for(user_id)
+        ).exclude(sender_id=user_id)
+        if up_to is not None:
+            messages = messages.filter(id__lte=up_to)
+        return messages
+    
+    def mark_read_by(self, user_id, up_to=None):
+        """
+        Move ``user_id``'s read watermark up to message ``up_to`` (default,
+        and at most: the latest message) and tell any open sockets.
+        Returns how many messages became read.
+        
+        The watermark is compare-and-set against the value the unread
+        messages were counted from, so concurrent readers never subtract
+        the same messages from the counter twice.
+        """
+        field = self.last_read_field_for(user_id)
+        # up_to may come from a client; a watermark past the latest message
+        # would count every later message as read before it was sent
+        if up_to is None or up_to > (self.last_message_id or 0):
+            latest = self.messages.order_by('-id').values_list('id', flat=True).first() or 0
+            up_to = latest if up_to is None else min(up_to, latest)
+        
+        for attempt in range(3):
+            if attempt:
+                # Someone else moved the watermark; start again from theirs
+                self.refresh_from_db(fields=[field])
+            current = getattr(self, field)
+            if current >= up_to:
+                return 0
+            marked_read = self.unread_messages_for(user_id, up_to).count()
+            if Conversation.objects.filter(pk=self.pk, **{field: current}).update(**{field: up_to}):
+                break
+        else:
+            return 0
+        
+        setattr(self, field, up_to)
+        if marked_read:
+            UnreadCounter.objects.adjust(user_id, -marked_read)
+        invalidate_tags(f'user:{user_id}:conversations')
+        publish_after_commit(self.pk, {'type': 'read', 'reader': user_id, 'up_to': up_to})
+        return marked_read
 
 
 class Message(models.Model):
@@ -38,11 +184,123 @@ class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
-    is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset windows over one conversation's history, newest first
+            models.Index(fields=['conversation', 'created_at', 'id'], name='message_conv_created_idx'),
+            # Unread counts are ranges above a read watermark
+            models.Index(fields=['conversation', 'id'], name='message_conv_id_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Message from {self.sender.email} at {self.created_at}"
+
+
+class ParticipantManager(models.Manager):
+    def create_for(self, conversations):
+        """Inbox rows for both sides of each of ``conversations``"""
+        return self.bulk_create(
+            [
+                Participant(conversation=conversation, user_id=user_id,
+                            updated_at=conversation.last_message_at or conversation.updated_at)
+                for conversation in conversations
+                for user_id in (conversation.sender_id, conversation.receiver_id)
+            ],
+            ignore_conflicts=True,
+        )
     
+    def inbox_for(self, user):
+        """``user``'s inbox rows, most recently active first"""
+        return self.filter(user=user).select_related(
+            'conversation__item',
+            'conversation__sender',
+            'conversation__receiver'
+        ).order_by('-updated_at', '-id')
+    
+    def touch(self, conversation_id, when):
+        """Move a conversation to the top of both participants' inboxes"""
+        self.filter(conversation_id=conversation_id, updated_at__lt=when).update(updated_at=when)
+
+
+class Participant(models.Model):
+    """
+    One row per user per conversation: that user's inbox entry.
+    
+    Listing a user's conversations is then a range scan of the
+    (user, updated_at, id) index rather than an OR across the sender and
+    receiver columns of Conversation. Rows are written when a conversation
+    is created and touched with each new message (chats/signals.py).
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='participants')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_memberships')
+    updated_at = models.DateTimeField()
+    
+    objects = ParticipantManager()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'user'], name='participant_conversation_user_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'updated_at', 'id'], name='participant_user_updated_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.email} in conversation {self.conversation_id}"
+
+
+class UnreadCounterManager(models.Manager):
+    def adjust(self, user_id, delta):
+        """
+        Atomically add ``delta`` (which may be negative) to a user's count,
+        never going below zero.
+        """
+        updated = self.filter(user_id=user_id).update(count=Greatest(F('count') + delta, 0))
+        # A missing row already reads as zero, so only increments create one
+        # (this also keeps a cascading user delete from re-creating it)
+        if not updated and delta > 0:
+            self.get_or_create(user_id=user_id)
+            self.filter(user_id=user_id).update(count=Greatest(F('count') + delta, 0))
+
+    def forget(self, messages):
+        """
+        Take the messages in ``messages`` that are about to be deleted off
+        their recipients' counts, unread ones only, in a single UPDATE
+        however many conversations and recipients they span.
+        """
+        user_id = OuterRef('user_id')
+        unread = messages.filter(
+            Q(conversation__sender_id=user_id, id__gt=F('conversation__sender_last_read_id'))
+            | Q(conversation__receiver_id=user_id, id__gt=F('conversation__receiver_last_read_id'))
+        ).exclude(sender_id=user_id).order_by()
+        # COUNT() as a plain function, so the subquery isn't grouped by message
+        unread_count = unread.annotate(n=Func('id', function='COUNT')).values('n')
+        self.filter(Exists(unread)).update(count=Greatest(F('count') - Subquery(unread_count), 0))
+
+    def count_for(self, user):
+        """Unread messages for ``user`` in a single primary-key lookup"""
+        return self.filter(user=user).values_list('count', flat=True).first() or 0
+
+
+class UnreadCounter(models.Model):
+    """
+    Denormalized number of unread messages addressed to a user.
+
+    Kept up to date by the Message signals in chats/signals.py; the
+    reconcile_unread_counts command repairs any drift.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='unread_counter'
+    )
+    count = models.PositiveIntegerField(default=0)
+
+    objects = UnreadCounterManager()
+
     def __str__(self):
-        return f"Message from {self.sender.email} at {self.created_at}"
\ No newline at end of file
+        return f"{self.user.email}: {self.count} unread"
@@ -0,0 +1,104 @@
+"""
+Real-time delivery of chat events.
+
+Events are published to one channel per conversation and fanned out to
+every WebSocket subscribed to it (see chats/sockets.py). The default
+InProcessBroker only reaches sockets served by the same process, which is
+enough for a single ASGI worker. Deployments with several workers point
+CHAT_REALTIME['BROKER'] at a class with the same subscribe / unsubscribe /
+publish methods backed by a shared broker.
+
+Publishing is fire-and-forget: a socket that misses an event (slow
+client, reconnect) catches up through the messages/since/ endpoint.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+REALTIME_DEFAULTS = {
+    'BROKER': 'chats.realtime.InProcessBroker',
+    'QUEUE_SIZE': 100,  # events buffered per socket before the oldest are dropped
+}
+
+
+def realtime_settings():
+    """REALTIME_DEFAULTS overridden by settings.CHAT_REALTIME"""
+    return {**REALTIME_DEFAULTS, **getattr(settings, 'CHAT_REALTIME', {})}
+
+
+def conversation_channel(conversation_id):
+    return f'conversation.{conversation_id}'
+
+
+class InProcessBroker:
+    """
+    Pub/sub between the sockets of this process.
+
+    publish() may be called from any thread (views and signal handlers
+    run in sync threads); events are handed to each subscriber's event
+    loop with call_soon_threadsafe.
+    """
+
+    def __init__(self, queue_size=REALTIME_DEFAULTS['QUEUE_SIZE']):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(dict)  # channel -> {queue: loop}
+
+    def subscribe(self, channel):
+        """A queue receiving every event published to ``channel`` from now on"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers[channel][queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, channel, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(channel, {})
+            subscribers.pop(queue, None)
+            if not subscribers:
+                self._subscribers.pop(channel, None)
+
+    def publish(self, channel, event):
+        with self._lock:
+            targets = list(self._subscribers.get(channel, {}).items())
+        for queue, loop in targets:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                self.unsubscribe(channel, queue)  # its loop has shut down
+
+    def subscriber_count(self, channel):
+        with self._lock:
+            return len(self._subscribers.get(channel, {}))
+
+
+def _offer(queue, event):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+@lru_cache(maxsize=1)
+def get_broker():
+    """The broker configured in CHAT_REALTIME, one per process"""
+    options = realtime_settings()
+    return import_string(options['BROKER'])(queue_size=options['QUEUE_SIZE'])
+
+
+def serialize_message(message):
+    return {
+        'id': message.id,
+        'sender': message.sender_id,
+        'content': message.content,
+        'created_at': message.created_at.isoformat(),
+    }
+
+
+def publish_after_commit(conversation_id, event):
+    """Publish once the surrounding transaction commits, so no socket sees uncommitted rows"""
+    transaction.on_commit(lambda: get_broker().publish(conversation_channel(conversation_id), event))
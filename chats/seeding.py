@@ -0,0 +1,83 @@
+"""
+Synthetic conversations and messages for the seed_data command.
+
+bulk_create() skips the signals that keep a conversation's last-message
+snapshot, read watermarks and inbox rows in step with its messages, so
+finish_conversations() fills them in from the messages it was given.
+Unread counters are left to the reconcile_unread_counts command.
+"""
+from datetime import timedelta
+
+from items.seeding import other_user_id
+
+from .models import Conversation, Message
+from .signals import snapshot_fields
+
+MESSAGE_LINES = [
+    'Hi, I think this might be mine.', 'Where did you find it?',
+    'Can you describe it?', 'It has a small scratch on the back.',
+    'I can meet at the library at 3pm.', 'Is tomorrow morning okay?',
+    'Thanks so much!', 'Still available?', 'Yes, I still have it.',
+    'What colour is the case?', 'On my way now.', 'Great, see you there.',
+]
+
+# Fraction of participants who have read the whole conversation
+READ_ALL_RATE = 0.7
+
+
+def build_conversations(rng, items, user_ids, rate, max_messages, now):
+    """
+    Unsaved conversations about roughly ``rate`` of the ``items``, started
+    by the claimer if there is one and by some other user otherwise, as
+    [(conversation, [its messages, oldest first])]. Everything in the
+    last-message snapshot except the message id is already filled in.
+    """
+    threads = []
+    for item in items:
+        if rng.random() >= rate:
+            continue
+        conversation = Conversation(
+            item=item,
+            sender_id=item.claimed_by_id or other_user_id(rng, user_ids, item.poster_id),
+            receiver_id=item.poster_id,
+            created_at=min(item.created_at + timedelta(minutes=rng.uniform(5, 24 * 60)), now),
+        )
+        conversation.assign_pair()
+        messages = build_messages(rng, conversation, rng.randint(1, max_messages), now)
+        for field, value in snapshot_fields(messages[-1]).items():
+            if field != 'last_message':  # not saved yet
+                setattr(conversation, field, value)
+        conversation.updated_at = conversation.last_message_at
+        threads.append((conversation, messages))
+    return threads
+
+
+def build_messages(rng, conversation, count, now):
+    """``count`` unsaved messages taking turns in ``conversation``, oldest first"""
+    sent_at = conversation.created_at
+    sender_id = conversation.sender_id
+    messages = []
+    for _ in range(count):
+        messages.append(Message(
+            conversation=conversation,
+            sender_id=sender_id,
+            content=rng.choice(MESSAGE_LINES),
+            created_at=sent_at,
+        ))
+        sent_at = min(sent_at + timedelta(minutes=rng.uniform(1, 180)), now)
+        if rng.random() < 0.7:
+            sender_id = conversation.get_other_user_id(sender_id)
+    return messages
+
+
+def finish_conversations(rng, threads):
+    """
+    Point each saved conversation at its last saved message and set the
+    read watermarks; returns the fields to bulk_update()
+    """
+    for conversation, messages in threads:
+        conversation.last_message = messages[-1]
+        for field in ('sender_last_read_id', 'receiver_last_read_id'):
+            read = len(messages) if rng.random() < READ_ALL_RATE else rng.randint(0, len(messages) - 1)
+            setattr(conversation, field, messages[read - 1].id if read else 0)
+    return ['last_message', 'sender_last_read_id', 'receiver_last_read_id']
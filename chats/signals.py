@@ -0,0 +1,132 @@
+from django.db.models import Case, F, PositiveBigIntegerField, Q, QuerySet, Value, When
+
+from core.cache import invalidate_tags
+from items.models import Item
+
+from .models import PREVIEW_LENGTH, Conversation, Message, Participant, UnreadCounter
+from .realtime import publish_after_commit, serialize_message
+
+
+def snapshot_fields(message):
+    """Conversation fields describing ``message`` as the latest one"""
+    return {
+        'last_message': message,
+        'last_message_preview': message.content[:PREVIEW_LENGTH],
+        'last_message_sender_id': message.sender_id,
+        'last_message_at': message.created_at,
+    }
+
+
+def invalidate_conversation(sender, instance, **kwargs):
+    invalidate_tags(*instance.cache_tags())
+
+
+def invalidate_item_conversations(sender, instance, created=False, **kwargs):
+    """An edited item's title shows in the inbox of everyone talking about it"""
+    if created:
+        return
+    pairs = Conversation.objects.filter(item=instance).values_list('sender_id', 'receiver_id')
+    user_ids = {user_id for pair in pairs for user_id in pair}
+    if user_ids:
+        invalidate_tags(*(f'user:{user_id}:conversations' for user_id in user_ids))
+
+
+def add_participants(sender, instance, created, **kwargs):
+    """Give both sides of a new conversation an inbox row"""
+    if created:
+        Participant.objects.create_for([instance])
+
+
+def record_new_message(sender, instance, created, **kwargs):
+    """
+    Count the message as unread for the other participant and make it
+    the conversation's last-message snapshot.
+    """
+    if not created:
+        return
+    conversation = instance.conversation
+    recipient_id = conversation.get_other_user_id(instance.sender_id)
+    UnreadCounter.objects.adjust(recipient_id, 1)
+
+    # A sender who had read everything has read their own message too.
+    # The condition is checked against the row being updated, not the
+    # possibly stale instance, so unread messages are never skipped.
+    sender_last_read = conversation.last_read_field_for(instance.sender_id)
+    caught_up = Q(last_message__isnull=True) | Q(**{f'{sender_last_read}__gte': F('last_message_id')})
+
+    # The id guard stops a slower concurrent write from replacing a newer
+    # snapshot with an older message
+    Conversation.objects.filter(
+        Q(last_message__isnull=True) | Q(last_message_id__lt=instance.id),
+        pk=conversation.pk,
+    ).update(
+        updated_at=instance.created_at,
+        **snapshot_fields(instance),
+        **{sender_last_read: Case(
+            When(caught_up, then=Value(instance.id)),
+            default=F(sender_last_read),
+            output_field=PositiveBigIntegerField(),
+        )},
+    )
+    Participant.objects.touch(conversation.pk, instance.created_at)
+    # The snapshot and the inbox order changed through .update(), which sends no signals
+    invalidate_tags(*conversation.cache_tags())
+    publish_after_commit(conversation.pk, {'type': 'message', 'message': serialize_message(instance)})
+
+
+def started_delete(instance, origin):
+    """Whether ``instance`` is what delete() was called on, rather than a cascade from something else"""
+    return origin is instance or (isinstance(origin, QuerySet) and isinstance(instance, origin.model))
+
+
+def forget_deleted_conversations(sender, instance, origin=None, **kwargs):
+    """
+    Before a user, item or conversation is deleted, take the unread
+    messages of every conversation going with it off the recipients'
+    counts in one query. The messages' own post_delete handler skips
+    cascades, which would otherwise cost a few queries per message.
+
+    A queryset delete sends pre_delete for each row; the first one
+    handles all of them, so a message reachable from several deleted rows
+    (two users of one conversation, say) is only subtracted once.
+    """
+    if not started_delete(instance, origin):
+        return  # whatever the delete started from accounts for it
+    if isinstance(origin, QuerySet):
+        if getattr(origin, '_unread_forgotten', False):
+            return
+        origin._unread_forgotten = True
+        deleted = origin.values('pk')
+    else:
+        deleted = [instance.pk]
+    if isinstance(instance, Conversation):
+        messages = Message.objects.filter(conversation__in=deleted)
+    elif isinstance(instance, Item):
+        messages = Message.objects.filter(conversation__item__in=deleted)
+    else:
+        messages = Message.objects.filter(
+            Q(conversation__sender__in=deleted) | Q(conversation__receiver__in=deleted)
+            | Q(conversation__item__poster__in=deleted)
+        )
+    UnreadCounter.objects.forget(messages)
+
+
+def forget_deleted_message(sender, instance, origin=None, **kwargs):
+    if not started_delete(instance, origin):
+        return  # the whole conversation is going; see forget_deleted_conversations()
+    conversation = Conversation.objects.filter(pk=instance.conversation_id).first()
+    if conversation is None:
+        return
+    recipient_id = conversation.get_other_user_id(instance.sender_id)
+    if instance.id > conversation.last_read_id_for(recipient_id):
+        UnreadCounter.objects.adjust(recipient_id, -1)
+    if conversation.last_message_id in (None, instance.id):
+        latest = Message.objects.filter(conversation=conversation).first()
+        fields = snapshot_fields(latest) if latest else {
+            'last_message': None,
+            'last_message_preview': '',
+            'last_message_sender_id': None,
+            'last_message_at': None,
+        }
+        Conversation.objects.filter(pk=conversation.pk).update(**fields)
+    invalidate_tags(*conversation.cache_tags())
@@ -0,0 +1,194 @@
+"""
+WebSocket endpoint for live conversations, served straight from
+core/asgi.py as a plain ASGI application.
+
+A socket at /ws/chats/<conversation_id>/ is authenticated from the
+session cookie and subscribed to the conversation's broker channel.
+Clients send JSON frames:
+
+    {"type": "message", "content": "..."}   post a message
+    {"type": "read", "up_to": <message id>} acknowledge messages up to an id
+                                            (everything if up_to is left out)
+
+and receive the events published in chats/realtime.py:
+
+    {"type": "message", "message": {...}}   a new message from either side
+    {"type": "read", "reader": <user id>, "up_to": <message id>}
+                                            a participant's read watermark moved
+    {"type": "error", "detail": "..."}      a frame was rejected
+"""
+import asyncio
+import json
+import re
+from importlib import import_module
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections, transaction
+from django.http.cookie import parse_cookie
+from django.http.request import validate_host
+
+from .models import Conversation, Message
+from .realtime import conversation_channel, get_broker
+
+SOCKET_PATH = re.compile(r'^/ws/chats/(?P<conversation_id>\d+)/$')
+
+MAX_MESSAGE_LENGTH = 5000
+
+# Close codes in the 4000-4999 range are reserved for applications
+CLOSE_NOT_FOUND = 4404
+CLOSE_FORBIDDEN = 4403
+
+
+def database_sync_to_async(func):
+    """sync_to_async that recycles stale connections around each call, as a request would"""
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper)
+
+
+def _headers(scope):
+    return {name.decode('latin1'): value.decode('latin1') for name, value in scope.get('headers', [])}
+
+
+def origin_allowed(origin):
+    """Same-site check standing in for CSRF protection on the handshake"""
+    if not origin:
+        return False
+    if origin in settings.CSRF_TRUSTED_ORIGINS:
+        return True
+    host = urlsplit(origin).netloc
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']
+    return validate_host(host, allowed_hosts)
+
+
+@database_sync_to_async
+def _authenticate(cookie_header):
+    session_key = parse_cookie(cookie_header).get(settings.SESSION_COOKIE_NAME)
+    session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    return get_user(SimpleNamespace(session=session))
+
+
+@database_sync_to_async
+def _conversation_for(user, conversation_id):
+    return Conversation.objects.filter(id=conversation_id, participants__user=user).first()
+
+
+@database_sync_to_async
+def _post_message(conversation, user, content):
+    # One commit for the message, its counter and the conversation snapshot
+    with transaction.atomic():
+        Message.objects.create(conversation=conversation, sender=user, content=content)
+
+
+@database_sync_to_async
+def _mark_read(conversation, user, up_to):
+    conversation.mark_read_by(user.id, up_to=up_to)
+
+
+async def websocket_application(scope, receive, send):
+    """Entry point for every ``websocket`` scope handed over by core/asgi.py"""
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    match = SOCKET_PATH.match(scope['path'])
+    if match is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+
+    headers = _headers(scope)
+    user = await _authenticate(headers.get('cookie', ''))
+    conversation = None
+    if user.is_authenticated and origin_allowed(headers.get('origin')):
+        conversation = await _conversation_for(user, int(match['conversation_id']))
+    if conversation is None:
+        await send({'type': 'websocket.close', 'code': CLOSE_FORBIDDEN})
+        return
+
+    broker = get_broker()
+    channel = conversation_channel(conversation.id)
+    queue = broker.subscribe(channel)
+    try:
+        await send({'type': 'websocket.accept'})
+        await ChatSocket(conversation, user, receive, send, queue).run()
+    finally:
+        broker.unsubscribe(channel, queue)
+
+
+class ChatSocket:
+    """One participant's open connection to a conversation"""
+
+    def __init__(self, conversation, user, receive, send, queue):
+        self.conversation = conversation
+        self.user = user
+        self.receive = receive
+        self.send = send
+        self.queue = queue
+
+    async def run(self):
+        """Relay frames both ways until the client disconnects"""
+        forward = asyncio.create_task(self.forward_events())
+        try:
+            await self.read_frames()
+        finally:
+            forward.cancel()
+            try:
+                await forward
+            except asyncio.CancelledError:
+                pass
+
+    async def forward_events(self):
+        while True:
+            event = await self.queue.get()
+            await self.send_json(event)
+
+    async def read_frames(self):
+        while True:
+            event = await self.receive()
+            if event['type'] == 'websocket.disconnect':
+                return
+            if event['type'] == 'websocket.receive':
+                await self.handle_frame(event.get('text') or '')
+
+    async def handle_frame(self, text):
+        try:
+            frame = json.loads(text)
+        except ValueError:
+            await self.send_error('Frames must be JSON')
+            return
+        if not isinstance(frame, dict):
+            await self.send_error('Frames must be JSON objects')
+            return
+
+        if frame.get('type') == 'message':
+            content = str(frame.get('content', '')).strip()
+            if not content:
+                await self.send_error('Message is empty')
+            elif len(content) > MAX_MESSAGE_LENGTH:
+                await self.send_error('Message is too long')
+            else:
+                await _post_message(self.conversation, self.user, content)
+        elif frame.get('type') == 'read':
+            up_to = frame.get('up_to')
+            if up_to is not None and (type(up_to) is not int or up_to < 0):
+                await self.send_error('up_to must be a message id')
+            else:
+                await _mark_read(self.conversation, self.user, up_to)
+        else:
+            await self.send_error('Unknown frame type')
+
+    async def send_json(self, data):
+        await self.send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+    async def send_error(self, detail):
+        await self.send_json({'type': 'error', 'detail': detail})
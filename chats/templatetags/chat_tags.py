@@ -0,0 +1,15 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def other_participant(conversation, user):
+    """{{ conversation|other_participant:user }} -> the user on the other side"""
+    return conversation.get_other_user(user)
+
+
+@register.filter
+def has_unread(conversation, user):
+    """{{ conversation|has_unread:user }} -> True if ``user`` hasn't read the latest messages"""
+    return conversation.has_unread_for(user.id)
@@ -1,3 +1,657 @@
-from django.test import TestCase
+import asyncio
+import threading
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core.cache import get_cache
+from core.testing import QueryBudgetMixin
+from items.models import Item
+from .management.commands.loadtest_chat import FakeSocket
+from .management.commands.reconcile_unread_counts import Command as ReconcileUnreadCounts
+from .models import Conversation, Message, Participant, UnreadCounter
+from .realtime import InProcessBroker
+from .views import CONVERSATIONS_PER_PAGE, MESSAGES_PER_PAGE
+
+User = get_user_model()
+
+
+class ChatTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.finder = User.objects.create_user(email='finder@example.com', password='pass12345')
+        cls.owner = User.objects.create_user(email='owner@example.com', password='pass12345')
+        cls.item = Item.objects.create(poster=cls.finder, item_type='found', title='Blue umbrella')
+        cls.conversation = Conversation.objects.create(item=cls.item, sender=cls.owner, receiver=cls.finder)
+
+    def setUp(self):
+        get_cache().clear()
+
+    def send(self, sender, content='Is this still available?'):
+        # Run the after-commit hooks (cache invalidation, live events) as a real commit would
+        with self.captureOnCommitCallbacks(execute=True):
+            return Message.objects.create(conversation=self.conversation, sender=sender, content=content)
+
+
+class UnreadCounterTests(ChatTestCase):
+    def test_new_messages_count_for_the_recipient_only(self):
+        self.send(self.owner)
+        self.send(self.owner)
+        self.send(self.finder)
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 2)
+        self.assertEqual(UnreadCounter.objects.count_for(self.owner), 1)
+
+    def test_opening_the_conversation_clears_the_count(self):
+        self.send(self.owner)
+        self.client.force_login(self.finder)
+        self.client.get(reverse('chats:conversation_detail', args=[self.conversation.id]))
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 0)
+
+    def test_reconcile_does_not_overwrite_a_concurrent_change(self):
+        self.send(self.owner)
+        # Compared at 7, but a message arrived (8) before the write
+        UnreadCounter.objects.filter(user=self.finder).update(count=8)
+        self.assertTrue(ReconcileUnreadCounts().repair(self.finder.id, old=7, expected=5))
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 1)
+
+        UnreadCounter.objects.filter(user=self.finder).delete()
+        self.assertTrue(ReconcileUnreadCounts().repair(self.finder.id, old=None, expected=1))
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 1)
+
+    def test_context_processor_is_one_lookup(self):
+        self.send(self.owner)
+        self.client.force_login(self.finder)
+        response = self.client.get(reverse('items:home'))
+        with self.assertNumQueries(1):
+            self.assertEqual(response.context['unread_messages_count'](), 1)
+
+    def test_deleting_what_a_conversation_hangs_off_forgets_its_unread_messages(self):
+        other_item = Item.objects.create(poster=self.finder, item_type='found', title='Black glove')
+        other = Conversation.objects.create(item=other_item, sender=self.owner, receiver=self.finder)
+        self.send(self.owner)
+        self.send(self.owner)
+        Message.objects.create(conversation=other, sender=self.owner, content='Mine too?')
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.item.delete()
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 1)
+        # One counter update for the whole cascade, not one per message
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('UPDATE "chats_unreadcounter"')]), 1)
+
+        other.delete()
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 0)
+
+    def test_deleting_a_user_forgets_what_they_sent(self):
+        self.send(self.owner)
+        self.owner.delete()
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 0)
+
+    def test_deleting_several_users_at_once_forgets_each_message_once(self):
+        reader = User.objects.create_user(email='reader@example.com', password='pass12345')
+        stranger = User.objects.create_user(email='stranger@example.com', password='pass12345')
+        # On the finder's item, so reachable from both deleted users
+        shared = Conversation.objects.create(item=self.item, sender=self.owner, receiver=reader)
+        other_item = Item.objects.create(poster=stranger, item_type='found', title='Black glove')
+        kept = Conversation.objects.create(item=other_item, sender=reader, receiver=stranger)
+        for conversation, sender in ((shared, self.owner), (shared, self.owner), (kept, stranger)):
+            Message.objects.create(conversation=conversation, sender=sender, content='Hello?')
+        self.assertEqual(UnreadCounter.objects.count_for(reader), 3)
+
+        User.objects.filter(pk__in=[self.owner.pk, self.finder.pk]).delete()
+        self.assertEqual(UnreadCounter.objects.count_for(reader), 1)
+
+    def test_reconcile_repairs_drift(self):
+        self.send(self.owner)
+        UnreadCounter.objects.filter(user=self.finder).update(count=7)
+        UnreadCounter.objects.filter(user=self.owner).delete()
+
+        call_command('reconcile_unread_counts', stdout=StringIO())
+
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 1)
+        self.assertEqual(UnreadCounter.objects.count_for(self.owner), 0)
+
+
+class ConversationSnapshotTests(ChatTestCase):
+    def test_new_message_updates_the_snapshot(self):
+        self.send(self.owner, 'Hi, I think that umbrella is mine')
+        message = self.send(self.finder, 'Sure, what colour is the handle?')
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message, message)
+        self.assertEqual(self.conversation.last_message_preview, message.content)
+        self.assertEqual(self.conversation.last_message_sender, self.finder)
+        self.assertTrue(self.conversation.has_unread_for(self.owner.id))
+        self.assertTrue(self.conversation.has_unread_for(self.finder.id))
+
+    def test_deleting_the_last_message_falls_back_to_the_previous_one(self):
+        first = self.send(self.owner)
+        self.send(self.finder).delete()
+
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message, first)
+
+    def test_reading_clears_only_the_readers_flag(self):
+        self.send(self.finder)
+        self.send(self.owner)
+        self.client.force_login(self.finder)
+        self.client.get(reverse('chats:conversation_detail', args=[self.conversation.id]))
+
+        self.conversation.refresh_from_db()
+        self.assertFalse(self.conversation.has_unread_for(self.finder.id))
+        self.assertTrue(self.conversation.has_unread_for(self.owner.id))
+
+    def test_inbox_queries_do_not_grow_with_conversations_or_messages(self):
+        self.client.force_login(self.finder)
+        self.send(self.owner)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(reverse('chats:inbox'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                other = User.objects.create_user(email=f'other{i}@example.com', password='pass12345')
+                conversation = Conversation.objects.create(item=self.item, sender=other, receiver=self.finder)
+                for _ in range(10):
+                    Message.objects.create(conversation=conversation, sender=other, content='Hello')
+
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(reverse('chats:inbox'))
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(len(response.context['conversations']), 6)
+
+
+class ReadWatermarkTests(ChatTestCase):
+    def test_reading_moves_only_the_readers_watermark(self):
+        first = self.send(self.owner)
+        second = self.send(self.owner)
+
+        self.assertEqual(self.conversation.mark_read_by(self.finder.id, up_to=first.id), 1)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.receiver_last_read_id, first.id)
+        self.assertEqual(self.conversation.sender_last_read_id, second.id)
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 1)
+
+    def test_marking_read_is_a_range_count_and_a_single_row_write(self):
+        self.send(self.owner)
+        self.send(self.owner)
+        self.conversation.refresh_from_db()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.conversation.mark_read_by(self.finder.id, up_to=self.conversation.last_message_id)
+        writes = [q['sql'] for q in queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(queries), 3)  # count, watermark, counter
+        self.assertEqual(len(writes), 2)
+        self.assertIn('chats_conversation', writes[0])
+
+        with self.assertNumQueries(0):
+            self.conversation.mark_read_by(self.finder.id, up_to=self.conversation.last_message_id)
+
+    def test_a_watermark_past_the_last_message_is_clamped(self):
+        sent = self.send(self.owner)
+        self.assertEqual(self.conversation.mark_read_by(self.finder.id, up_to=10 ** 9), 1)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.receiver_last_read_id, sent.id)
+
+        self.send(self.owner)
+        self.conversation.refresh_from_db()
+        self.assertTrue(self.conversation.has_unread_for(self.finder.id))
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 1)
+        self.assertEqual(self.conversation.mark_read_by(self.finder.id), 1)
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 0)
+
+    def test_a_stale_reader_does_not_subtract_messages_twice(self):
+        first = self.send(self.owner)
+        self.send(self.owner)
+        stale = Conversation.objects.get(pk=self.conversation.pk)
+        fresh = Conversation.objects.get(pk=self.conversation.pk)
+
+        self.assertEqual(fresh.mark_read_by(self.finder.id, up_to=first.id), 1)
+        self.assertEqual(stale.mark_read_by(self.finder.id), 1)
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 0)
+
+    def test_replying_keeps_a_caught_up_sender_caught_up(self):
+        self.send(self.owner)
+        self.conversation.refresh_from_db()
+        self.conversation.mark_read_by(self.finder.id)
+        self.send(self.finder, 'Yes, come by the library')
+
+        self.conversation.refresh_from_db()
+        self.assertFalse(self.conversation.has_unread_for(self.finder.id))
+        self.assertTrue(self.conversation.has_unread_for(self.owner.id))
+
+    def test_deleting_only_unread_messages_changes_the_count(self):
+        read = self.send(self.owner)
+        self.conversation.refresh_from_db()
+        self.conversation.mark_read_by(self.finder.id)
+        unread = self.send(self.owner)
+
+        read.delete()
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 1)
+        unread.delete()
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 0)
+
+
+class ParticipantTests(ChatTestCase):
+    def start(self, email):
+        other = User.objects.create_user(email=email, password='pass12345')
+        return Conversation.objects.create(item=self.item, sender=other, receiver=self.finder)
+
+    def test_each_side_of_a_new_conversation_gets_an_inbox_row(self):
+        users = Participant.objects.filter(conversation=self.conversation).values_list('user', flat=True)
+        self.assertCountEqual(users, [self.owner.id, self.finder.id])
+
+    def test_new_messages_move_the_conversation_to_the_top_of_both_inboxes(self):
+        newer = self.start('other@example.com')
+        self.assertEqual(Participant.objects.inbox_for(self.finder).first().conversation, newer)
+
+        self.send(self.owner)
+        for user in (self.finder, self.owner):
+            self.assertEqual(Participant.objects.inbox_for(user).first().conversation, self.conversation)
+
+    def test_inbox_pages_through_every_conversation(self):
+        for i in range(CONVERSATIONS_PER_PAGE + 4):
+            self.start(f'other{i}@example.com')
+        self.client.force_login(self.finder)
+
+        first = self.client.get(reverse('chats:inbox'))
+        self.assertEqual(len(first.context['conversations']), CONVERSATIONS_PER_PAGE)
+        second = self.client.get(reverse('chats:inbox'), {'cursor': first.context['next_cursor']})
+        self.assertEqual(len(second.context['conversations']), 5)
+        self.assertIsNone(second.context['next_cursor'])
+        seen = {c.id for c in first.context['conversations']} | {c.id for c in second.context['conversations']}
+        self.assertEqual(len(seen), CONVERSATIONS_PER_PAGE + 5)
+
+    def test_inbox_listing_is_an_index_range_scan(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN output is SQLite-specific')
+        sql, params = Participant.objects.inbox_for(self.finder)[:CONVERSATIONS_PER_PAGE].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertIn('participant_user_updated_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+class StartConversationTests(ChatTestCase):
+    def test_either_participant_reaches_the_existing_thread(self):
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('chats:start_conversation', args=[self.item.id]))
+        self.assertRedirects(response, reverse('chats:conversation_detail', args=[self.conversation.id]))
+        self.assertEqual(Conversation.objects.count(), 1)
+
+        reverse_id = Conversation.objects.get_or_start_id(self.item.id, self.finder.id, self.owner.id)
+        self.assertEqual(reverse_id, self.conversation.id)
+
+    def test_get_or_start_is_one_statement_plus_inbox_rows(self):
+        other = User.objects.create_user(email='other@example.com', password='pass12345')
+        with self.assertNumQueries(2):
+            conversation_id = Conversation.objects.get_or_start_id(self.item.id, other.id, self.finder.id)
+
+        conversation = Conversation.objects.get(id=conversation_id)
+        self.assertEqual((conversation.sender, conversation.receiver), (other, self.finder))
+        self.assertEqual(conversation.participants.count(), 2)
+
+    def test_the_pair_is_unique_in_either_direction(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Conversation.objects.create(item=self.item, sender=self.finder, receiver=self.owner)
+
+
+class InboxCacheTests(ChatTestCase):
+    """The cached inbox and sidebar show every write on their next read"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.finder)
+
+    def inbox(self):
+        return self.client.get(reverse('chats:inbox')).context['conversations']
+
+    def test_first_page_is_cached(self):
+        self.inbox()
+        with CaptureQueriesContext(connection) as queries:
+            self.inbox()
+        self.assertFalse([q for q in queries if '"chats_participant"' in q['sql']])
+
+    def test_new_messages_show_up(self):
+        self.assertEqual(self.inbox()[0].last_message_preview, '')
+        self.send(self.owner, 'Still have it?')
+        self.assertEqual(self.inbox()[0].last_message_preview, 'Still have it?')
+
+        message = self.send(self.owner, 'Hello?')
+        with self.captureOnCommitCallbacks(execute=True):
+            message.delete()
+        self.assertEqual(self.inbox()[0].last_message_preview, 'Still have it?')
+
+    def test_reads_clear_the_unread_marker(self):
+        self.send(self.owner)
+        self.assertTrue(self.inbox()[0].has_unread_for(self.finder.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('chats:conversation_detail', args=[self.conversation.id]))
+        self.assertFalse(self.inbox()[0].has_unread_for(self.finder.id))
+
+    def test_new_conversations_show_up(self):
+        other_item = Item.objects.create(poster=self.owner, item_type='lost', title='Red scarf', date_lost='2026-10-01')
+        self.assertEqual(len(self.inbox()), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('chats:start_conversation', args=[other_item.id]))
+        self.assertEqual([c.item for c in self.inbox()], [other_item, self.item])
+
+    def test_item_edits_show_up(self):
+        self.assertEqual(self.inbox()[0].item.title, 'Blue umbrella')
+        self.item.title = 'Navy umbrella'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.save()
+        self.assertEqual(self.inbox()[0].item.title, 'Navy umbrella')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.delete()
+        self.assertEqual(self.inbox(), [])
+
+    def test_sidebar_shares_the_cached_page(self):
+        self.inbox()
+        self.send(self.owner, 'Are you around?')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(reverse('chats:conversation_detail', args=[self.conversation.id]))
+        self.assertEqual(response.context['all_conversations'][0].last_message_preview, 'Are you around?')
+        self.assertFalse(self.inbox()[0].has_unread_for(self.finder.id))
+
+
+class ConcurrentStartConversationTests(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # Shared-cache in-memory SQLite fails concurrent writers with
+            # "table is locked" instead of waiting for them
+            self.skipTest('needs a file-backed or server test database (set DATABASES TEST NAME)')
+
+    def test_parallel_starts_share_one_thread_per_pair(self):
+        poster = User.objects.create_user(email='poster@example.com', password='pass12345')
+        item = Item.objects.create(poster=poster, item_type='found', title='Student card')
+        starters = [
+            User.objects.create_user(email=f'starter{i}@example.com', password='pass12345') for i in range(3)
+        ]
+        clients = []
+        for starter in starters:
+            for _ in range(4):
+                client = Client()
+                client.force_login(starter)
+                clients.append((starter, client))
+
+        barrier = threading.Barrier(len(clients))
+        results, errors = [], []
+
+        def start(starter, client):
+            try:
+                barrier.wait()
+                response = client.get(reverse('chats:start_conversation', args=[item.id]))
+                results.append((starter.id, response.status_code, response['Location']))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=start, args=pair) for pair in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual({status for _, status, _ in results}, {302})
+        self.assertEqual(Conversation.objects.filter(item=item).count(), len(starters))
+        for starter in starters:
+            locations = {location for starter_id, _, location in results if starter_id == starter.id}
+            conversation = Conversation.objects.get(item=item, sender=starter)
+            self.assertEqual(locations, {reverse('chats:conversation_detail', args=[conversation.id])})
+        self.assertEqual(Participant.objects.filter(conversation__item=item).count(), len(starters) * 2)
+
+
+class MessageHistoryTests(ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.finder)
+
+    def send_many(self, count):
+        return [self.send(self.owner, f'Message {i}') for i in range(count)]
+
+    def test_detail_renders_only_the_latest_window(self):
+        sent = self.send_many(MESSAGES_PER_PAGE + 5)
+        response = self.client.get(reverse('chats:conversation_detail', args=[self.conversation.id]))
+
+        shown = response.context['messages_list']
+        self.assertEqual([m.id for m in shown], [m.id for m in sent[-MESSAGES_PER_PAGE:]])
+        self.assertIsNotNone(response.context['older_cursor'])
+        self.assertEqual(response.context['latest_message_id'], sent[-1].id)
+
+    def test_paging_backwards_reaches_the_first_message_without_gaps(self):
+        sent = self.send_many(MESSAGES_PER_PAGE * 2 + 3)
+        response = self.client.get(reverse('chats:conversation_detail', args=[self.conversation.id]))
+        seen = [m.id for m in response.context['messages_list']]
+        cursor = response.context['older_cursor']
+
+        while cursor:
+            data = self.client.get(
+                reverse('chats:message_history', args=[self.conversation.id]), {'before': cursor}
+            ).json()
+            seen = [m['id'] for m in data['messages']] + seen
+            cursor = data['next_cursor']
+        self.assertEqual(seen, [m.id for m in sent])
+
+    def test_html_fragment_carries_the_next_cursor(self):
+        self.send_many(MESSAGES_PER_PAGE + 1)
+        response = self.client.get(reverse('chats:conversation_detail', args=[self.conversation.id]))
+        fragment = self.client.get(
+            reverse('chats:message_history', args=[self.conversation.id]),
+            {'before': response.context['older_cursor'], 'format': 'html'},
+        )
+        self.assertContains(fragment, 'Message 0')
+        self.assertNotIn('X-Next-Cursor', fragment)
+
+    def test_since_returns_only_newer_messages_and_marks_them_read(self):
+        first = self.send(self.owner, 'First')
+        self.send(self.owner, 'Second')
+        self.send(self.finder, 'Third')
+
+        data = self.client.get(
+            reverse('chats:messages_since', args=[self.conversation.id]), {'after': first.id}
+        ).json()
+        self.assertEqual([m['content'] for m in data['messages']], ['Second', 'Third'])
+        self.assertEqual([m['mine'] for m in data['messages']], [False, True])
+        self.assertEqual(UnreadCounter.objects.count_for(self.finder), 0)
+
+    def test_bad_cursor_and_message_id_are_rejected(self):
+        history = reverse('chats:message_history', args=[self.conversation.id])
+        since = reverse('chats:messages_since', args=[self.conversation.id])
+        self.assertEqual(self.client.get(history, {'before': 'nonsense'}).status_code, 400)
+        self.assertEqual(self.client.get(since, {'after': 'x'}).status_code, 400)
+
+    def test_endpoints_are_limited_to_participants(self):
+        outsider = User.objects.create_user(email='outsider@example.com', password='pass12345')
+        self.client.force_login(outsider)
+        for name in ('chats:message_history', 'chats:messages_since'):
+            response = self.client.get(reverse(name, args=[self.conversation.id]))
+            self.assertEqual(response.status_code, 404)
+
+    def test_detail_queries_do_not_grow_with_history(self):
+        self.send_many(5)
+        url = reverse('chats:conversation_detail', args=[self.conversation.id])
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+
+        self.send_many(MESSAGES_PER_PAGE * 3)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(url)
+        self.assertEqual(len(large), len(small))
+
+
+class SeededConversationTests(TestCase):
+    """seed_data bypasses the Message signals, so it must fill their fields in itself"""
+
+    def test_denormalized_fields_are_consistent(self):
+        call_command('seed_data', users=30, items=300, batch_size=100, conversation_rate=0.5, seed=7,
+                     stdout=StringIO())
+        conversations = Conversation.objects.all()
+        self.assertTrue(conversations.exists())
+        for conversation in conversations:
+            latest = conversation.messages.order_by('-id').first()
+            self.assertEqual(conversation.last_message_id, latest.id)
+            self.assertEqual(conversation.last_message_at, latest.created_at)
+            self.assertEqual(conversation.last_message_preview, latest.content)
+            self.assertLessEqual(conversation.sender_last_read_id, latest.id)
+        self.assertEqual(Participant.objects.count(), 2 * conversations.count())
+        counted = {counter.user_id: counter.count for counter in UnreadCounter.objects.exclude(count=0)}
+        self.assertEqual(counted, dict(ReconcileUnreadCounts.actual_counts()))
+
+
+class BrokerTests(TestCase):
+    async def test_publish_from_another_thread_reaches_subscribers(self):
+        broker = InProcessBroker()
+        queue = broker.subscribe('conversation.1')
+        other = broker.subscribe('conversation.2')
+
+        thread = threading.Thread(target=broker.publish, args=('conversation.1', {'type': 'read'}))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(await asyncio.wait_for(queue.get(), 1), {'type': 'read'})
+        self.assertTrue(other.empty())
+
+    async def test_slow_subscribers_drop_the_oldest_events(self):
+        broker = InProcessBroker(queue_size=2)
+        queue = broker.subscribe('conversation.1')
+        for n in range(3):
+            broker.publish('conversation.1', n)
+        await asyncio.sleep(0)
+        self.assertEqual([queue.get_nowait(), queue.get_nowait()], [1, 2])
+
+        broker.unsubscribe('conversation.1', queue)
+        self.assertEqual(broker.subscriber_count('conversation.1'), 0)
+
+
+class LiveChatTests(TransactionTestCase):
+    """Sockets driven through core.asgi.application, with real commits"""
+
+    def setUp(self):
+        get_cache().clear()
+        self.finder = User.objects.create_user(email='finder@example.com', password='pass12345')
+        self.owner = User.objects.create_user(email='owner@example.com', password='pass12345')
+        item = Item.objects.create(poster=self.finder, item_type='found', title='Blue umbrella')
+        self.conversation = Conversation.objects.create(item=item, sender=self.owner, receiver=self.finder)
+        self.path = f'/ws/chats/{self.conversation.id}/'
+        outsider = User.objects.create_user(email='outsider@example.com', password='pass12345')
+        self.cookies = {user: self.cookie_for(user) for user in (self.finder, self.owner, outsider)}
+        self.cookies['outsider'] = self.cookies.pop(outsider)
+
+    def cookie_for(self, user):
+        client = Client()
+        client.force_login(user)
+        return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+    async def connect(self, *users):
+        sockets = [FakeSocket(self.path, self.cookies[user], 'http://localhost') for user in users]
+        for socket in sockets:
+            await socket.connect()
+        return sockets
+
+    async def test_messages_are_pushed_to_both_participants(self):
+        finder, owner = await self.connect(self.finder, self.owner)
+        try:
+            await self.exchange_messages(finder, owner)
+        finally:
+            await finder.close()
+            await owner.close()
+
+    async def exchange_messages(self, finder, owner):
+        await owner.send_json({'type': 'message', 'content': 'Is that my umbrella?'})
+        for socket in (finder, owner):
+            event = await asyncio.wait_for(socket.receive_json(), 2)
+            self.assertEqual(event['type'], 'message')
+            self.assertEqual(event['message']['content'], 'Is that my umbrella?')
+            self.assertEqual(event['message']['sender'], self.owner.id)
+        counter = await UnreadCounter.objects.aget(user=self.finder)
+        self.assertEqual(counter.count, 1)
+
+        await finder.send_json({'type': 'read', 'up_to': event['message']['id']})
+        read = await asyncio.wait_for(owner.receive_json(), 2)
+        self.assertEqual(read, {'type': 'read', 'reader': self.finder.id, 'up_to': event['message']['id']})
+        counter = await UnreadCounter.objects.aget(user=self.finder)
+        self.assertEqual(counter.count, 0)
+
+    async def test_invalid_frames_get_an_error(self):
+        owner, = await self.connect(self.owner)
+        try:
+            frames = (
+                'not json', '[]', '{"type": "message", "content": "  "}', '{"type": "shout"}',
+                '{"type": "read", "up_to": "latest"}',
+            )
+            for text in frames:
+                await owner.inbound.put({'type': 'websocket.receive', 'text': text})
+                event = await asyncio.wait_for(owner.receive_json(), 2)
+                self.assertEqual(event['type'], 'error')
+        finally:
+            await owner.close()
+        self.assertFalse(await Message.objects.aexists())
+
+    async def test_handshake_is_refused_without_access(self):
+        cases = [
+            (self.path, '', 'http://localhost'),
+            (self.path, self.cookies['outsider'], 'http://localhost'),
+            (self.path, self.cookies[self.owner], 'https://evil.example.com'),
+            ('/ws/chats/0/', self.cookies[self.owner], 'http://localhost'),
+        ]
+        for path, cookie, origin in cases:
+            with self.subTest(path=path, origin=origin):
+                with self.assertRaisesRegex(RuntimeError, 'rejected'):
+                    await FakeSocket(path, cookie, origin).connect()
+
+
+class QueryBudgetTests(QueryBudgetMixin, ChatTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.finder)
+
+    def add_rows(self, count):
+        # Messages in the open conversation, and more conversations in the sidebar and inbox
+        for _ in range(count):
+            self.send(self.owner)
+            self.send(self.finder)
+            asker = User.objects.create_user(email=f'asker{User.objects.count()}@example.com')
+            conversation = Conversation.objects.create(item=self.item, sender=asker, receiver=self.finder)
+            with self.captureOnCommitCallbacks(execute=True):
+                Message.objects.create(conversation=conversation, sender=asker, content='Is it mine?')
+
+    def test_inbox(self):
+        self.assertConstantQueries(self.add_rows, lambda: self.client.get(reverse('chats:inbox')), budget=5)
+
+    def test_conversation_detail(self):
+        url = reverse('chats:conversation_detail', args=[self.conversation.id])
+        self.assertConstantQueries(self.add_rows, lambda: self.client.get(url), budget=8)
+        self.assertConstantQueries(self.add_rows, lambda: self.client.post(url, {'content': 'Where are you?'}),
+                                   sizes=(21, 25, 40))
+
+    def test_message_history_and_since(self):
+        history = reverse('chats:message_history', args=[self.conversation.id])
+        since = reverse('chats:messages_since', args=[self.conversation.id])
+        self.assertConstantQueries(self.add_rows, lambda: self.client.get(history, {'format': 'html'}), budget=4)
+
+        def add_rows(count):
+            # Polls for what arrived since the last one, which marks it read
+            self.after = Message.objects.latest('id').id
+            self.add_rows(count)
+
+        self.assertConstantQueries(add_rows, lambda: self.client.get(since, {'after': self.after}), budget=7)
+
+    def test_start_conversation(self):
+        def add_rows(count):
+            self.add_rows(count)
+            self.item = Item.objects.create(poster=self.owner, item_type='lost', title='Red scarf')
+
+        self.assertConstantQueries(
+            add_rows, lambda: self.client.get(reverse('chats:start_conversation', args=[self.item.id])), budget=6,
+        )
@@ -6,5 +6,7 @@ app_name = 'chats'  # Changed from 'messages'
 urlpatterns = [
     path('', views.inbox, name='inbox'),
     path('<int:conversation_id>/', views.conversation_detail, name='conversation_detail'),
+    path('<int:conversation_id>/messages/', views.message_history, name='message_history'),
+    path('<int:conversation_id>/messages/since/', views.messages_since, name='messages_since'),
     path('start/<int:item_id>/', views.start_conversation, name='start_conversation'),
-]
\ No newline at end of file
+]
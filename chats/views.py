@@ -1,51 +1,98 @@
+from django.core.exceptions import BadRequest
+from django.http import JsonResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q, Max
 from django.contrib import messages as django_messages
-from .models import Conversation, Message
+from .models import Conversation, Message, Participant, UnreadCounter
+from .realtime import serialize_message
+from core.cache import get_cache
 from items.models import Item
+from items.pagination import paginate_keyset
+
+
+CONVERSATIONS_PER_PAGE = 30
+
+# Messages, reads, new conversations and edits to their items invalidate
+# the first page through the user's user:<id>:conversations tag
+INBOX_CACHE_SECONDS = 300
+
+
+def _inbox_page(user, cursor=None):
+    """One keyset page of ``user``'s inbox rows; the first one comes from the cache"""
+    def load_page():
+        # One range scan of the user's inbox rows, newest activity first
+        return paginate_keyset(
+            Participant.objects.inbox_for(user),
+            cursor=cursor,
+            per_page=CONVERSATIONS_PER_PAGE,
+            field='updated_at',
+        )
+    
+    if cursor:
+        return load_page()
+    return get_cache().get_or_set(
+        f'chats:inbox:{user.id}', load_page, INBOX_CACHE_SECONDS, tags=[f'user:{user.id}:conversations']
+    )
 
 
 @login_required
 def inbox(request):
     """Display all conversations for the logged-in user"""
-    # Get all conversations where user is either sender or receiver
-    conversations = Conversation.objects.filter(
-        Q(sender=request.user) | Q(receiver=request.user)
-    ).select_related('item', 'sender', 'receiver').prefetch_related('messages')
+    page = _inbox_page(request.user, request.GET.get('cursor'))
     
     # Get unread count
-    unread_count = Message.objects.filter(
-        conversation__in=conversations,
-        is_read=False
-    ).exclude(sender=request.user).count()
+    unread_count = UnreadCounter.objects.count_for(request.user)
     
     context = {
-        'conversations': conversations,
+        'conversations': [participant.conversation for participant in page],
+        'next_cursor': page.next_cursor,
         'unread_count': unread_count,
     }
     
     return render(request, 'chats/inbox.html', context)
 
 
+MESSAGES_PER_PAGE = 50
+
+
+def _get_participating_conversation(request, conversation_id):
+    """The conversation if the current user takes part in it, else 404"""
+    return get_object_or_404(Conversation, id=conversation_id, participants__user=request.user)
+
+
+def _message_payload(request, conversation, messages_list, next_cursor=None):
+    """Messages as JSON, or as an HTML fragment with ?format=html"""
+    if request.GET.get('format') == 'html':
+        response = render(request, 'chats/message_list.html', {'messages_list': messages_list})
+        if next_cursor:
+            response['X-Next-Cursor'] = next_cursor
+        return response
+    
+    return JsonResponse({
+        'conversation': conversation.id,
+        'messages': [
+            {**serialize_message(message), 'mine': message.sender_id == request.user.id}
+            for message in messages_list
+        ],
+        'next_cursor': next_cursor,
+    })
+
+
 @login_required
 def conversation_detail(request, conversation_id):
     """Display a specific conversation and handle sending messages"""
     conversation = get_object_or_404(
-        Conversation,
+        Conversation.objects.select_related('item', 'sender', 'receiver'),
         id=conversation_id
     )
     
     # Check if user is part of this conversation
-    if request.user not in [conversation.sender, conversation.receiver]:
+    if request.user.id not in [conversation.sender_id, conversation.receiver_id]:
         django_messages.error(request, "You don't have access to this conversation")
         return redirect('chats:inbox')
     
-    # Mark messages as read
-    Message.objects.filter(
-        conversation=conversation,
-        is_read=False
-    ).exclude(sender=request.user).update(is_read=True)
+    # Mark messages as read, up to the latest one in the snapshot
+    conversation.mark_read_by(request.user.id, up_to=conversation.last_message_id or 0)
     
     # Handle sending new message
     if request.method == 'POST':
@@ -58,17 +105,18 @@ def conversation_detail(request, conversation_id):
             )
             return redirect('chats:conversation_detail', conversation_id=conversation.id)
     
-    # Get all messages in this conversation
-    messages_list = conversation.messages.all().order_by('created_at')
+    # Only the latest page of messages; older ones load on demand
+    page = paginate_keyset(conversation.messages.all(), per_page=MESSAGES_PER_PAGE)
+    messages_list = page.object_list[::-1]
     
-    # Get all conversations for sidebar
-    all_conversations = Conversation.objects.filter(
-        Q(sender=request.user) | Q(receiver=request.user)
-    ).select_related('item', 'sender', 'receiver')
+    # Most recent conversations for sidebar
+    all_conversations = [participant.conversation for participant in _inbox_page(request.user)]
     
     context = {
         'conversation': conversation,
         'messages_list': messages_list,
+        'older_cursor': page.next_cursor,
+        'latest_message_id': messages_list[-1].id if messages_list else 0,
         'all_conversations': all_conversations,
         'other_user': conversation.get_other_user(request.user),
     }
@@ -76,37 +124,46 @@ def conversation_detail(request, conversation_id):
     return render(request, 'chats/conversation_detail.html', context)
 
 
+@login_required
+def message_history(request, conversation_id):
+    """Page backwards through older messages from a ?before= cursor"""
+    conversation = _get_participating_conversation(request, conversation_id)
+    page = paginate_keyset(
+        conversation.messages.all(),
+        cursor=request.GET.get('before'),
+        per_page=MESSAGES_PER_PAGE,
+    )
+    return _message_payload(request, conversation, page.object_list[::-1], page.next_cursor)
+
+
+@login_required
+def messages_since(request, conversation_id):
+    """Messages newer than ?after=<message id>, oldest first"""
+    conversation = _get_participating_conversation(request, conversation_id)
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        raise BadRequest('Invalid message id')
+    
+    messages_list = list(
+        conversation.messages.filter(id__gt=after).order_by('id')[:MESSAGES_PER_PAGE]
+    )
+    if messages_list:
+        conversation.mark_read_by(request.user.id, up_to=messages_list[-1].id)
+    return _message_payload(request, conversation, messages_list)
+
+
 @login_required
 def start_conversation(request, item_id):
     """Start a new conversation about an item"""
     item = get_object_or_404(Item, id=item_id)
     
     # Can't message yourself
-    if item.poster == request.user:
+    if item.poster_id == request.user.id:
         django_messages.error(request, "You can't message yourself about your own item")
         return redirect('items:item_detail', item_id=item.id)
     
-    # Check if conversation already exists
-    conversation = Conversation.objects.filter(
-        item=item,
-        sender=request.user,
-        receiver=item.poster
-    ).first()
-    
-    if not conversation:
-        # Check reverse (if item poster already messaged current user)
-        conversation = Conversation.objects.filter(
-            item=item,
-            sender=item.poster,
-            receiver=request.user
-        ).first()
-    
-    # Create new conversation if doesn't exist
-    if not conversation:
-        conversation = Conversation.objects.create(
-            item=item,
-            sender=request.user,
-            receiver=item.poster
-        )
+    # Find or create the thread in one statement, whichever side started it
+    conversation_id = Conversation.objects.get_or_start_id(item.id, request.user.id, item.poster_id)
     
-    return redirect('chats:conversation_detail', conversation_id=conversation.id)
\ No newline at end of file
+    return redirect('chats:conversation_detail', conversation_id=conversation_id)
\ No newline at end of file
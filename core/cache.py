@@ -0,0 +1,494 @@
+"""
+Two-tier cache for hot, shared data such as the home feed.
+
+Reads try a small in-process LRU first and the shared Django cache
+(settings.CACHES, file-backed by default so every worker on the host sees
+it) second. A hot key therefore costs a dict lookup on most requests and
+one shared-cache read per LOCAL_TTL seconds on the rest; a tagged one
+costs a lookup per tag as well (see below), also local on most requests.
+
+get_or_set() stores each value with the time it took to compute and the
+moment it expires, and protects the database when a popular key runs out:
+
+* Probabilistic early recomputation (XFetch): shortly before expiry each
+  reader recomputes with a probability that grows as expiry approaches
+  and with how expensive the value is, so one request usually refreshes
+  the key before anyone sees it expire.
+* Single flight: recomputing takes a lock in the shared cache (and a
+  per-process one, since the shared add() is not atomic on every
+  backend). Whoever loses keeps serving the previous value, which stays
+  in the shared tier for STALE_SECONDS past expiry; a reader with no
+  value at all waits briefly for the winner instead of computing too.
+
+Entries can be tagged with what they show (``item:<id>``,
+``user:<id>:items``, ``feed:lost``, ``conversation:<id>``...). Each tag
+has a version in the shared tier and an entry remembers the versions it
+was computed under; invalidate_tags() gives the tags new versions, which
+makes every entry under them a miss on its next read in any process,
+without scanning keys or flushing anything. A process keeps the tag
+versions it has read in its local tier for LOCAL_TTL seconds like any
+other value, and takes the new ones straight away when it bumps tags
+itself. So a write shows on the next read in the process that made it,
+and at most LOCAL_TTL seconds later in every other one.
+Which models bump which tags is decided by their cache_tags() methods and
+the signal handlers in each app.
+
+Both tiers hand out copies: the shared one unpickles what it stores and
+the local one keeps pickled snapshots, so callers may mutate a value they
+got or set without changing it for anyone else.
+
+Untagged data in the local tier does not hear about deletes made by
+other processes, so only leave data untagged if it may be LOCAL_TTL
+seconds stale. Counters are per process; see core.views.cache_stats. Hits
+and misses also count towards the request timer (core/timing.py).
+"""
+import hashlib
+import math
+import pickle
+import random
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, namedtuple
+from functools import lru_cache, wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+from .timing import current_timer
+
+CACHE_LAYER_DEFAULTS = {
+    'SHARED_ALIAS': 'default',
+    'LOCAL_MAX_ENTRIES': 512,
+    'LOCAL_TTL': 5,  # seconds a process trusts its own copy
+    'STALE_SECONDS': 60,  # how long an expired value can stand in during a recompute
+    'EARLY_RECOMPUTE_BETA': 1.0,  # > 1 recomputes earlier, 0 disables early recomputation
+    'LOCK_TIMEOUT': 30,  # seconds before an abandoned recompute lock frees itself
+    'LOCK_WAIT': 2.0,  # how long a reader with nothing to serve waits for the recompute
+    'ANONYMOUS_PAGES': True,  # serve cache_anonymous_page views from the cache
+}
+
+# versions maps each of the entry's tags to its version at compute time
+Entry = namedtuple('Entry', ['value', 'expires_at', 'cost', 'versions'], defaults=[None])
+
+
+def cache_layer_settings():
+    """CACHE_LAYER_DEFAULTS overridden by settings.CACHE_LAYER"""
+    return {**CACHE_LAYER_DEFAULTS, **getattr(settings, 'CACHE_LAYER', {})}
+
+
+class FileCache(FileBasedCache):
+    """
+    FileBasedCache that counts its entries on about one write in
+    CULL_CHECK_EVERY instead of on every write. The stock backend lists the
+    whole cache directory before each set(), so writes (and with them tag
+    bumps on every chat message) get slower the fuller the cache is. The
+    directory can overshoot MAX_ENTRIES by a few writes between checks.
+    """
+
+    CULL_CHECK_EVERY = 64
+
+    def _cull(self):
+        if random.randrange(self.CULL_CHECK_EVERY) == 0:
+            super()._cull()
+
+
+class LocalCache:
+    """
+    Thread-safe LRU of Entry objects (and tag versions), each trusted for
+    ``ttl`` seconds.
+    Entries are kept pickled and every get() returns a fresh copy, like
+    the shared tier, so nobody mutates a value other requests are served.
+    """
+
+    def __init__(self, max_entries, ttl, on_evict=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (pickled Entry, local deadline)
+
+    def get(self, key):
+        with self._lock:
+            found = self._entries.get(key)
+            if found is None:
+                return None
+            entry, deadline = found
+            if deadline <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return pickle.loads(entry)
+
+    def set(self, key, entry):
+        entry = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        evicted = 0
+        with self._lock:
+            self._entries[key] = (entry, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted and self.on_evict:
+            self.on_evict(evicted)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TieredCache:
+    """The local LRU in front of a shared Django cache; see the module docstring"""
+
+    COUNTERS = (
+        'local_hits', 'shared_hits', 'misses', 'local_evictions',
+        'recomputes', 'early_recomputes', 'stale_served', 'lock_waits',
+        'invalidated',
+    )
+
+    def __init__(self, shared, local_max_entries=CACHE_LAYER_DEFAULTS['LOCAL_MAX_ENTRIES'],
+                 local_ttl=CACHE_LAYER_DEFAULTS['LOCAL_TTL'], stale_seconds=CACHE_LAYER_DEFAULTS['STALE_SECONDS'],
+                 beta=CACHE_LAYER_DEFAULTS['EARLY_RECOMPUTE_BETA'], lock_timeout=CACHE_LAYER_DEFAULTS['LOCK_TIMEOUT'],
+                 lock_wait=CACHE_LAYER_DEFAULTS['LOCK_WAIT']):
+        self.shared = shared
+        self.local = LocalCache(local_max_entries, local_ttl, on_evict=self._count_evictions)
+        self.stale_seconds = stale_seconds
+        self.beta = beta
+        self.lock_timeout = lock_timeout
+        self.lock_wait = lock_wait
+        self._counters = Counter()
+        self._counter_lock = threading.Lock()
+        self._inflight = set()
+        self._inflight_lock = threading.Lock()
+
+    # Counters
+
+    def _count(self, name, n=1):
+        with self._counter_lock:
+            self._counters[name] += n
+        timer = current_timer()
+        if timer is not None:
+            timer.count(name, n)
+
+    def _count_evictions(self, n):
+        self._count('local_evictions', n)
+
+    def stats(self):
+        """This process's counters, plus hit ratio and local tier size"""
+        with self._counter_lock:
+            stats = {name: self._counters[name] for name in self.COUNTERS}
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_ratio'] = round((lookups - stats['misses']) / lookups, 4) if lookups else None
+        stats['local_entries'] = len(self.local)
+        return stats
+
+    def reset_stats(self):
+        with self._counter_lock:
+            self._counters.clear()
+
+    # Tags
+
+    def _tag_key(self, tag):
+        return f'tag-version:{tag}'
+
+    def tag_versions(self, tags):
+        """{tag: current version} for ``tags``, from the nearest tier"""
+        versions = {}
+        keys = {}
+        for tag in tags:
+            key = self._tag_key(tag)
+            version = self.local.get(key)
+            if version is None:
+                keys[key] = tag
+            else:
+                versions[tag] = version
+        if not keys:
+            return versions
+        found = self.shared.get_many(keys)
+        for key in keys.keys() - found.keys():
+            # First use, or evicted. Any fresh version will do: entries
+            # stored under the lost one just stop matching.
+            self.shared.add(key, uuid.uuid4().hex, None)
+            found[key] = self.shared.get(key)
+        for key, tag in keys.items():
+            versions[tag] = found[key]
+            self.local.set(key, found[key])
+        return versions
+
+    def bump_tags(self, tags):
+        """Give ``tags`` new versions, invalidating every entry stored under them"""
+        versions = {self._tag_key(tag): uuid.uuid4().hex for tag in tags}
+        self.shared.set_many(versions, None)
+        for key, version in versions.items():
+            self.local.set(key, version)
+
+    # Plain get / set / delete
+
+    def _get_entry(self, key, versions=None):
+        """The entry for ``key`` if it was computed under ``versions``, from the nearest tier"""
+        versions = versions or None
+        entry = self.local.get(key)
+        if entry is not None:
+            if entry.versions == versions:
+                self._count('local_hits')
+                return entry
+            self.local.delete(key)
+        entry = self.shared.get(key)
+        if isinstance(entry, Entry):
+            if entry.versions == versions:
+                self._count('shared_hits')
+                self.local.set(key, entry)
+                return entry
+            self._count('invalidated')
+        self._count('misses')
+        return None
+
+    def get(self, key, default=None, tags=()):
+        """The cached value, or ``default`` if it is missing, expired or invalidated"""
+        entry = self._get_entry(key, self.tag_versions(tags))
+        if entry is None or entry.expires_at <= time.time():
+            return default
+        return entry.value
+
+    def set(self, key, value, timeout, tags=(), cost=0.0, versions=None):
+        """
+        Store ``value`` under ``tags``. Pass the ``versions`` read before
+        computing it, if there are any, so a bump made in the meantime
+        still invalidates it.
+        """
+        if versions is None:
+            versions = self.tag_versions(tags)
+        entry = Entry(value, time.time() + timeout, cost, versions or None)
+        self.shared.set(key, entry, timeout + self.stale_seconds)
+        self.local.set(key, entry)
+
+    # Bulk get / set
+
+    def get_many(self, tagged_keys, versions=None):
+        """
+        {key: value} for those of ``tagged_keys`` ({key: tags}) that are
+        cached, fresh and current, with one shared read for whatever the
+        local tier doesn't have. ``versions`` are tag versions already
+        read with tag_versions(); they are read here otherwise.
+        """
+        if versions is None:
+            versions = self.tag_versions({tag for tags in tagged_keys.values() for tag in tags})
+        wanted = {key: {tag: versions[tag] for tag in tags} or None for key, tags in tagged_keys.items()}
+        entries = {}
+        for key, key_versions in wanted.items():
+            entry = self.local.get(key)
+            if entry is not None and entry.versions == key_versions:
+                self._count('local_hits')
+                entries[key] = entry
+        remote = wanted.keys() - entries.keys()
+        for key, entry in (self.shared.get_many(remote) if remote else {}).items():
+            if isinstance(entry, Entry) and entry.versions == wanted[key]:
+                self._count('shared_hits')
+                self.local.set(key, entry)
+                entries[key] = entry
+        self._count('misses', len(wanted) - len(entries))
+        now = time.time()
+        return {key: entry.value for key, entry in entries.items() if entry.expires_at > now}
+
+    def set_many(self, tagged_values, timeout, versions=None):
+        """
+        Store each of ``tagged_values`` ({key: (value, tags)}). As with
+        set(), pass the tag ``versions`` read before computing the values.
+        """
+        if versions is None:
+            versions = self.tag_versions({tag for _, tags in tagged_values.values() for tag in tags})
+        expires_at = time.time() + timeout
+        entries = {
+            key: Entry(value, expires_at, 0.0, {tag: versions[tag] for tag in tags} or None)
+            for key, (value, tags) in tagged_values.items()
+        }
+        self.shared.set_many(entries, timeout + self.stale_seconds)
+        for key, entry in entries.items():
+            self.local.set(key, entry)
+
+    def delete(self, key):
+        """Drop ``key`` from the shared tier and this process's local tier"""
+        self.local.delete(key)
+        self.shared.delete(key)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    # Stampede-protected reads
+
+    def get_or_set(self, key, compute, timeout, tags=()):
+        """
+        The value of ``key``, calling ``compute()`` to (re)build it when it
+        is missing, expired, invalidated through one of ``tags`` or picked
+        for early recomputation
+        """
+        versions = self.tag_versions(tags)
+        entry = self._get_entry(key, versions)
+        now = time.time()
+        if entry is not None and not self._should_recompute(entry, now):
+            return entry.value
+
+        if not self._acquire(key):
+            if entry is not None:
+                # Someone else is already refreshing it
+                self._count('stale_served')
+                return entry.value
+            entry = self._wait_for(key, versions)
+            if entry is not None:
+                return entry.value
+            # The recompute is taking too long; do it here rather than fail
+            return self._recompute(key, compute, timeout, versions)
+
+        try:
+            if entry is not None and entry.expires_at > now:
+                self._count('early_recomputes')
+            return self._recompute(key, compute, timeout, versions)
+        finally:
+            self._release(key)
+
+    def _should_recompute(self, entry, now):
+        # XFetch: -log(u) is exponentially distributed, so the head start
+        # scales with the compute cost and is usually small
+        head_start = entry.cost * self.beta * -math.log(1.0 - random.random())
+        return now + head_start >= entry.expires_at
+
+    def _recompute(self, key, compute, timeout, versions):
+        self._count('recomputes')
+        start = time.monotonic()
+        value = compute()
+        self.set(key, value, timeout, cost=time.monotonic() - start, versions=versions)
+        return value
+
+    def _lock_key(self, key):
+        return f'{key}:recompute-lock'
+
+    def _acquire(self, key):
+        with self._inflight_lock:
+            if key in self._inflight:
+                return False
+            self._inflight.add(key)
+        if self.shared.add(self._lock_key(key), 1, self.lock_timeout):
+            return True
+        with self._inflight_lock:
+            self._inflight.discard(key)
+        return False
+
+    def _release(self, key):
+        self.shared.delete(self._lock_key(key))
+        with self._inflight_lock:
+            self._inflight.discard(key)
+
+    def _wait_for(self, key, versions):
+        """Poll the shared tier for up to lock_wait seconds for a fresh value"""
+        self._count('lock_waits')
+        deadline = time.monotonic() + self.lock_wait
+        while time.monotonic() < deadline:
+            time.sleep(0.02)
+            entry = self.shared.get(key)
+            if isinstance(entry, Entry) and entry.versions == (versions or None) and entry.expires_at > time.time():
+                self.local.set(key, entry)
+                return entry
+        return None
+
+
+@lru_cache(maxsize=1)
+def get_cache():
+    """This process's TieredCache, configured from settings.CACHE_LAYER"""
+    options = cache_layer_settings()
+    return TieredCache(
+        caches[options['SHARED_ALIAS']],
+        local_max_entries=options['LOCAL_MAX_ENTRIES'],
+        local_ttl=options['LOCAL_TTL'],
+        stale_seconds=options['STALE_SECONDS'],
+        beta=options['EARLY_RECOMPUTE_BETA'],
+        lock_timeout=options['LOCK_TIMEOUT'],
+        lock_wait=options['LOCK_WAIT'],
+    )
+
+
+def invalidate_tags(*tags):
+    """
+    Invalidate every entry stored under any of ``tags``, in every process,
+    once the surrounding transaction commits. Bumping any earlier would let
+    another connection recompute from the old rows under the new versions.
+    """
+    transaction.on_commit(lambda: get_cache().bump_tags(tags))
+
+
+class _Uncacheable(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+def cache_anonymous_page(key_func, timeout, max_age):
+    """
+    Cache a view's whole response for logged-out visitors.
+
+    ``key_func(request)`` returns ``(key, tags)`` for the page, normalising
+    whatever parameters the view reads, or None if it shouldn't be cached.
+    Only 200 responses are stored. Every response varies on Cookie; cached
+    ones may also be kept by browsers and proxies for ``max_age`` seconds,
+    which tag invalidation can't reach, so keep that short. Everyone
+    else's responses are private.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            spec = None
+            # A pending flash message makes the page one-off
+            if (cache_layer_settings()['ANONYMOUS_PAGES'] and request.method in ('GET', 'HEAD')
+                    and not request.user.is_authenticated and not get_messages(request)):
+                spec = key_func(request)
+
+            if spec is None:
+                response = view(request, *args, **kwargs)
+                patch_cache_control(response, private=True)
+            else:
+                def render():
+                    response = view(request, *args, **kwargs)
+                    if response.status_code != 200 or response.streaming:
+                        raise _Uncacheable(response)
+                    return response.content, response['Content-Type']
+
+                key, tags = spec
+                try:
+                    content, content_type = get_cache().get_or_set(key, render, timeout, tags=tags)
+                except _Uncacheable as e:
+                    response = e.response
+                    patch_cache_control(response, private=True)
+                else:
+                    response = HttpResponse(content, content_type=content_type)
+                    patch_cache_control(response, public=True, max_age=max_age)
+            patch_vary_headers(response, ['Cookie'])
+            return response
+        return wrapper
+    return decorator
+
+
+def tag_etag(request, tags):
+    """
+    ETag for a page showing what ``tags`` cover, as rendered for this
+    visitor: the tags' current versions, who is looking and their CSRF
+    cookie, since a page the browser reuses must still carry a valid
+    token. None, so the page is always rendered, while a flash message is
+    pending.
+    """
+    if get_messages(request):
+        return None
+    versions = get_cache().tag_versions(tags)
+    parts = [f'{tag}={versions[tag]}' for tag in sorted(versions)]
+    parts += [str(request.user.pk), request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')]
+    return hashlib.md5('\n'.join(parts).encode()).hexdigest()
@@ -0,0 +1,105 @@
+import cProfile
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from .profiling import profile_reason, profiling_settings, save_profile
+from .timing import RequestTimer, timing_settings
+
+logger = logging.getLogger('core.timing')
+
+# cProfile hooks the whole interpreter (and since Python 3.12 refuses a
+# second active profiler), so one request per process is profiled at a time
+_profiling_lock = threading.Lock()
+
+
+class ServerTimingMiddleware:
+    """
+    Measures a sample of requests (REQUEST_TIMING['SAMPLE_RATE']) and
+    reports total time, query count and time, template time and cache
+    hits in a Server-Timing header and a log line; see core/timing.py.
+    Goes first in MIDDLEWARE so the total covers the other middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        options = timing_settings()
+        self.sample_rate = options['SAMPLE_RATE']
+        self.header = options['HEADER']
+        self.log = options['LOG']
+
+    def __call__(self, request):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        timer = RequestTimer()
+        with timer.activate(), ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer.query))
+            response = self.get_response(request)
+        timer.stop()
+
+        if self.header:
+            response['Server-Timing'] = timer.server_timing()
+        if self.log:
+            record = {
+                'method': request.method,
+                'path': request.path,
+                'view': getattr(request.resolver_match, 'view_name', None),
+                'status': response.status_code,
+                **timer.summary(),
+            }
+            logger.info(json.dumps(record), extra={'timing': record})
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles the view of requests that ask for it or are sampled; see
+    core/profiling.py. Goes last in MIDDLEWARE, after authentication, so
+    it can tell staff apart and profiles only the view and its templates.
+    A request that turns up while another one is being profiled is
+    served without a profile.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.options = profiling_settings()
+
+    def __call__(self, request):
+        reason = profile_reason(request, self.options)
+        if reason is None:
+            return self.get_response(request)
+
+        if not _profiling_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Some other profiling tool is active in this process
+                return self.get_response(request)
+            start = time.perf_counter()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            duration = time.perf_counter() - start
+        finally:
+            _profiling_lock.release()
+
+        response['X-Profile-Id'] = save_profile(profiler, self.options['DIRECTORY'], {
+            'method': request.method,
+            'path': request.path,
+            'view': getattr(request.resolver_match, 'view_name', None),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'reason': reason,
+        })
+        return response
@@ -0,0 +1,100 @@
+"""
+Profiles of single requests, for views that are slow in production.
+
+ProfilingMiddleware (core/middleware.py) runs cProfile around the view,
+its template rendering included, when a request asks for it or is
+sampled:
+
+* an X-Profile header carrying a token from ``manage.py profiles token``,
+  signed with SECRET_KEY and good for TOKEN_MAX_AGE seconds,
+* ``?profile=1`` from a logged-in staff user,
+* SAMPLE_RATE of all other requests.
+
+Each profile is written to DIRECTORY as <id>.pstats, which pstats,
+snakeviz and flameprof (flamegraphs) read, next to <id>.json describing
+the request. The response names the profile in an X-Profile-Id header.
+``manage.py profiles`` lists, aggregates and prunes them.
+"""
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+from django.core import signing
+
+PROFILING_DEFAULTS = {
+    'SAMPLE_RATE': 0.0,  # fraction of requests profiled without asking
+    'DIRECTORY': os.path.join(tempfile.gettempdir(), 'campusfound-profiles'),
+    'TOKEN_MAX_AGE': 3600,  # seconds an X-Profile token stays valid
+}
+
+TOKEN_SALT = 'core.profiling'
+TOKEN_VALUE = 'profile'
+
+
+def profiling_settings():
+    """PROFILING_DEFAULTS overridden by settings.PROFILING"""
+    return {**PROFILING_DEFAULTS, **getattr(settings, 'PROFILING', {})}
+
+
+def make_token():
+    """A value for the X-Profile header"""
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(TOKEN_VALUE)
+
+
+def valid_token(token, max_age):
+    try:
+        return signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=max_age) == TOKEN_VALUE
+    except signing.BadSignature:
+        return False
+
+
+def profile_reason(request, options):
+    """Why ``request`` should be profiled ('token', 'staff' or 'sampled'), or None"""
+    token = request.headers.get('X-Profile')
+    if token is not None:
+        return 'token' if valid_token(token, options['TOKEN_MAX_AGE']) else None
+    if request.GET.get('profile') and request.user.is_staff:
+        return 'staff'
+    if options['SAMPLE_RATE'] and random.random() < options['SAMPLE_RATE']:
+        return 'sampled'
+    return None
+
+
+def save_profile(profiler, directory, meta):
+    """Write ``profiler``'s stats and ``meta`` to ``directory``; returns the profile id"""
+    os.makedirs(directory, exist_ok=True)
+    profile_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+    profiler.dump_stats(os.path.join(directory, f'{profile_id}.pstats'))
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w') as f:
+        json.dump({'id': profile_id, 'created_at': time.time(), **meta}, f)
+    return profile_id
+
+
+def stored_profiles(directory):
+    """Metadata of the profiles in ``directory``, newest first, each with the path of its .pstats"""
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue  # being written, or damaged
+        meta['path'] = os.path.join(directory, f'{meta["id"]}.pstats')
+        profiles.append(meta)
+    return sorted(profiles, key=lambda meta: meta['created_at'], reverse=True)
+
+
+def delete_profile(meta):
+    for path in (meta['path'], meta['path'][:-len('.pstats')] + '.json'):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -4,6 +4,7 @@ Django settings for core project.
 
 from pathlib import Path
 import os
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -45,6 +46,7 @@ AUTHENTICATION_BACKENDS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Add this for static files
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -53,13 +55,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.timing.DjangoTemplates',  # Django's, timed for Server-Timing
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -80,9 +83,56 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # File-backed, unlike SQLite's default in-memory test database, so
+        # tests with concurrent writers wait on locks instead of failing
+        'TEST': {'NAME': os.path.join(tempfile.gettempdir(), 'campusfound-test.sqlite3')},
     }
 }
 
+# Shared cache, the second tier behind core/cache.py. File-backed so every
+# gunicorn worker on the host shares it; point it at Redis or memcached
+# when the app runs on more than one machine.
+CACHES = {
+    'default': {
+        'BACKEND': 'core.cache.FileCache',
+        'LOCATION': os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'campusfound-cache')),
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+# Tests get a cache directory of their own (see core/testing.py)
+TEST_RUNNER = 'core.testing.TestRunner'
+
+# In-process tier and stampede protection (see core/cache.py)
+CACHE_LAYER = {
+    'LOCAL_MAX_ENTRIES': 512,
+    'LOCAL_TTL': 5,
+    'STALE_SECONDS': 60,
+}
+
+# Server-Timing header and a log line for a sample of requests (see core/timing.py)
+REQUEST_TIMING = {
+    'SAMPLE_RATE': float(os.environ.get('REQUEST_TIMING_SAMPLE_RATE', '0')),
+}
+
+# cProfile of requests that ask for it or are sampled (see core/profiling.py)
+PROFILING = {
+    'SAMPLE_RATE': float(os.environ.get('PROFILING_SAMPLE_RATE', '0')),
+    'DIRECTORY': os.environ.get('PROFILING_DIR', os.path.join(tempfile.gettempdir(), 'campusfound-profiles')),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -132,4 +182,25 @@ CLOUDINARY_STORAGE = {
 }
 
 MEDIA_URL = '/media/'
-DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
\ No newline at end of file
+DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
+
+# Full-text item search (see items/search.py)
+ITEM_SEARCH = {
+    'SNIPPET_WORDS': 16,
+    'HIGHLIGHT_TAG': 'mark',
+    'RESULT_LIMIT': 100,
+}
+
+# Lost-to-found matching (see items/matching.py)
+ITEM_MATCHING = {
+    'TOP_K': 5,
+    'MIN_SCORE': 0.2,
+    'REFRESH_SECONDS': 300,
+}
+
+# Live chat over WebSockets (see chats/realtime.py); point BROKER at a
+# shared implementation when running more than one ASGI worker
+CHAT_REALTIME = {
+    'BROKER': 'chats.realtime.InProcessBroker',
+    'QUEUE_SIZE': 100,
+}
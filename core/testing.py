@@ -0,0 +1,163 @@
+"""
+Test support: a runner with its own cache, and query budgets for view
+tests.
+
+TestRunner (settings.TEST_RUNNER) points the shared cache tier at a fresh
+temporary directory for the run, so tests that clear the cache don't wipe
+a development server's, and removes it afterwards.
+
+QueryBudgetMixin.assertConstantQueries() requests a view at several data
+sizes and fails if the number of queries changes with the number of rows,
+which is how an N+1 shows up. The failure lists the SQL of the largest
+run grouped by call site: the template tag or variable being rendered
+when the query ran, and the innermost frame of project code.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from collections import defaultdict
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.template.base import TokenType
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from core.cache import cache_layer_settings, get_cache
+
+PROJECT_ROOT = str(settings.BASE_DIR) + os.sep
+TEMPLATE_RENDER = os.path.join('django', 'template', 'base.py')
+ORM = (os.path.join('django', 'db', ''), os.path.join('django', 'utils', 'asyncio.py'))
+
+
+class TestRunner(DiscoverRunner):
+    """DiscoverRunner with the shared cache in a directory of its own"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_dir = tempfile.mkdtemp(prefix='campusfound-test-cache-')
+        alias = cache_layer_settings()['SHARED_ALIAS']
+        self.cache_override = override_settings(CACHES={
+            **settings.CACHES,
+            alias: {**settings.CACHES[alias], 'LOCATION': self.cache_dir},
+        })
+        self.cache_override.enable()
+        get_cache.cache_clear()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_override.disable()
+        get_cache.cache_clear()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
+
+
+def _template_site(frame):
+    node = frame.f_locals.get('self')
+    origin, token = getattr(node, 'origin', None), getattr(node, 'token', None)
+    if origin is None or token is None:
+        return None
+    tag = f'{{{{ {token.contents} }}}}' if token.token_type == TokenType.VAR else f'{{% {token.contents} %}}'
+    return f'{origin.template_name or origin.name}:{token.lineno} {tag[:80]}'
+
+
+def _is_project_code(filename):
+    return filename.startswith(PROJECT_ROOT) and 'site-packages' not in filename
+
+
+def _is_test_code(filename):
+    return filename == __file__ or os.path.basename(filename).startswith('test')
+
+
+def _frame_site(frame):
+    filename = frame.f_code.co_filename
+    root = PROJECT_ROOT if filename.startswith(PROJECT_ROOT) else os.path.dirname(os.path.dirname(django.__file__))
+    return f'{os.path.relpath(filename, root)}:{frame.f_lineno} in {frame.f_code.co_name}'
+
+
+def call_site(frame):
+    """
+    Where the query being executed under ``frame`` came from: the template
+    node being rendered and the innermost project code, or failing that
+    the innermost code outside the ORM (middleware, say). The walk stops
+    at the test that made the request.
+    """
+    template = project = outside_orm = None
+    while frame is not None and not (template and project):
+        filename = frame.f_code.co_filename
+        if _is_test_code(filename):
+            break
+        if template is None and frame.f_code.co_name == 'render_annotated' and filename.endswith(TEMPLATE_RENDER):
+            template = _template_site(frame)
+        elif project is None and _is_project_code(filename):
+            project = _frame_site(frame)
+        elif outside_orm is None and not any(path in filename for path in ORM):
+            outside_orm = _frame_site(frame)
+        frame = frame.f_back
+    return ' via '.join(site for site in (template, project or outside_orm) if site) or '<unknown>'
+
+
+class QueryRecorder:
+    """Records the SQL and call site of every query on the default connection while active"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, call_site(sys._getframe(1))))
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def report(self):
+        """The queries grouped by call site, busiest first"""
+        by_site = defaultdict(list)
+        for sql, site in self.queries:
+            by_site[site].append(sql)
+        lines = []
+        for site, queries in sorted(by_site.items(), key=lambda entry: -len(entry[1])):
+            lines.append(f'  {len(queries)}x {site}')
+            lines.append(f'      {queries[0][:300]}')
+        return '\n'.join(lines)
+
+
+class QueryBudgetMixin:
+    """TestCase mixin adding assertConstantQueries(); see the module docstring"""
+
+    query_budget_sizes = (1, 5, 20)
+
+    def assertConstantQueries(self, add_rows, request, budget=None, sizes=None):
+        """
+        For each of ``sizes``, call ``add_rows(n)`` to add ``n`` more rows,
+        so there are that many in total, clear the cache and count the
+        queries ``request()`` runs. The count must be the same at every
+        size and, if ``budget`` is given, no more than that.
+        """
+        counts, total = {}, 0
+        recorder = None
+        for size in sizes or self.query_budget_sizes:
+            add_rows(size - total)
+            total = size
+            get_cache().clear()
+            with QueryRecorder() as recorder:
+                response = request()
+            self.assertLess(response.status_code, 400, f'{response.status_code} at {size} rows')
+            counts[size] = len(recorder)
+
+        if len(set(counts.values())) > 1:
+            sizes_and_counts = ', '.join(f'{size} rows: {count}' for size, count in counts.items())
+            self.fail(f'Query count grows with rows ({sizes_and_counts}). At {total} rows:\n{recorder.report()}')
+        count = counts[total]
+        if budget is not None and count > budget:
+            self.fail(f'{count} queries, over the budget of {budget}:\n{recorder.report()}')
+        return count
@@ -0,0 +1,135 @@
+"""
+Where the time goes in a request.
+
+A RequestTimer is made for each sampled request by
+core.middleware.ServerTimingMiddleware and is the current timer while the
+request runs. The pieces of the stack that know what they are doing
+report to it when there is one:
+
+* database queries, through an execute wrapper on every connection,
+* template rendering, through the DjangoTemplates backend below (set as
+  the TEMPLATES backend),
+* hits and misses of the two-tier cache, from TieredCache's counters.
+
+Outside a sampled request current_timer() is None, so unsampled requests
+pay one context variable lookup per template render and cache counter.
+"""
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as django_backend
+
+TIMING_DEFAULTS = {
+    'SAMPLE_RATE': 0.0,  # fraction of requests measured; 0 turns the middleware into a pass-through
+    'HEADER': True,  # send the Server-Timing header on measured responses
+    'LOG': True,  # log a JSON line per measured request to the core.timing logger
+}
+
+_current = ContextVar('request_timer', default=None)
+
+
+def timing_settings():
+    """TIMING_DEFAULTS overridden by settings.REQUEST_TIMING"""
+    return {**TIMING_DEFAULTS, **getattr(settings, 'REQUEST_TIMING', {})}
+
+
+def current_timer():
+    """The RequestTimer of the request being measured, if any"""
+    return _current.get()
+
+
+class RequestTimer:
+    """Durations (in seconds) and counts gathered over one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = None
+        self.durations = defaultdict(float)
+        self.counts = Counter()
+        self.template_depth = 0  # renders in progress, so nested ones aren't timed twice
+
+    @contextmanager
+    def activate(self):
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    @contextmanager
+    def timing(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] += time.perf_counter() - start
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def stop(self):
+        self.total = time.perf_counter() - self.started
+
+    def query(self, execute, sql, params, many, context):
+        """Execute wrapper (see connection.execute_wrapper) timing each query"""
+        self.counts['queries'] += 1
+        with self.timing('db'):
+            return execute(sql, params, many, context)
+
+    def summary(self):
+        """The measurements in milliseconds, as logged"""
+        return {
+            'total_ms': round(self.total * 1000, 2),
+            'db_ms': round(self.durations['db'] * 1000, 2),
+            'queries': self.counts['queries'],
+            'template_ms': round(self.durations['template'] * 1000, 2),
+            'cache_hits': self.counts['local_hits'] + self.counts['shared_hits'],
+            'cache_misses': self.counts['misses'],
+        }
+
+    def server_timing(self):
+        """The Server-Timing header value"""
+        summary = self.summary()
+        lookups = summary['cache_hits'] + summary['cache_misses']
+        metrics = [
+            f'total;dur={summary["total_ms"]}',
+            f'db;dur={summary["db_ms"]};desc="{summary["queries"]} queries"',
+            f'template;dur={summary["template_ms"]}',
+        ]
+        if lookups:
+            metrics.append(f'cache;desc="{summary["cache_hits"]}/{lookups} hits"')
+        return ', '.join(metrics)
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        timer = _current.get()
+        if timer is None:
+            return super().render(context, request)
+        # Only the outermost render is timed; it already includes any
+        # render_to_string() calls made while it runs (item cards, say)
+        timer.template_depth += 1
+        try:
+            if timer.template_depth > 1:
+                return super().render(context, request)
+            with timer.timing('template'):
+                return super().render(context, request)
+        finally:
+            timer.template_depth -= 1
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The Django template backend, with render() time reported to the current timer"""
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            django_backend.reraise(exc, self)
@@ -3,7 +3,10 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
+from . import views
+
 urlpatterns = [
+    path('admin/cache-stats/', views.cache_stats, name='cache_stats'),
     path('admin/', admin.site.urls),
     path('accounts/', include('accounts.urls')),
     path('', include('items.urls')),
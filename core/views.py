@@ -0,0 +1,12 @@
+import os
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+
+from .cache import get_cache
+
+
+@staff_member_required
+def cache_stats(request):
+    """Hit, miss and eviction counters of the two-tier cache in this worker process"""
+    return JsonResponse({'pid': os.getpid(), **get_cache().stats()})
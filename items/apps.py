@@ -1,6 +1,20 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class ItemsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'items'
+
+    def ready(self):
+        from . import signals
+        from .models import Item, Review
+
+        post_migrate.connect(signals.restore_search_triggers, sender=self)
+        post_save.connect(signals.update_match_index, sender=Item)
+        post_delete.connect(signals.remove_from_match_index, sender=Item)
+        post_save.connect(signals.forget_removed_photo, sender=Item)
+
+        for signal in (post_save, post_delete):
+            signal.connect(signals.invalidate_item, sender=Item)
+            signal.connect(signals.invalidate_review, sender=Review)
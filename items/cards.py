@@ -0,0 +1,72 @@
+"""
+Item cards, the tile an item is shown as in the home feed and on the
+dashboard.
+
+A card's HTML only changes when its item does, so it is cached under the
+item's ``item:<id>`` tag, which every Item write bumps (see
+Item.cache_tags), and a page of cards comes from one bulk cache read.
+What depends on the moment or the request (how long ago the item was
+posted, a search snippet) is left as a slot in the cached HTML and filled
+in on every render.
+"""
+import re
+
+from django.template.loader import render_to_string
+from django.utils.html import conditional_escape, format_html
+from django.utils.safestring import mark_safe
+from django.utils.timesince import timesince
+
+from core.cache import get_cache
+
+CACHE_TIMEOUT = 60 * 60  # invalidation keeps cards fresh; this only bounds memory
+
+TEMPLATE = 'includes/item_card.html'
+
+# Slots are marked with NUL characters, which forms reject, so item text
+# can never be mistaken for one
+SLOT = re.compile('\x00(\\w+)\x00')
+SLOTS = {name: mark_safe(f'\x00{name}\x00') for name in ('since', 'snippet')}
+
+SNIPPET_HTML = '<p class="text-sm text-gray-600 mt-1 line-clamp-2">{}</p>'
+
+
+def cache_key(item_id):
+    return f'items:card:{item_id}'
+
+
+def render_card(item):
+    """The card's HTML split around its slots: [html, slot name, html, ...]"""
+    return SLOT.split(render_to_string(TEMPLATE, {'item': item, 'slot': SLOTS}))
+
+
+def fill_slots(parts, item):
+    snippet = getattr(item, 'search_snippet', None)
+    values = {
+        'since': timesince(item.created_at),
+        'snippet': format_html(SNIPPET_HTML, snippet) if snippet else '',
+    }
+    return mark_safe(''.join(
+        part if i % 2 == 0 else conditional_escape(values[part]) for i, part in enumerate(parts)
+    ))
+
+
+def render_cards(items):
+    """HTML of each of ``items``' cards, rendering only those not cached"""
+    items = list(items)
+    cache = get_cache()
+    tags = {cache_key(item.id): [f'item:{item.id}'] for item in items}
+    versions = cache.tag_versions({tag for item_tags in tags.values() for tag in item_tags})
+    cached = cache.get_many(tags, versions=versions)
+
+    rendered = {}
+    cards = []
+    for item in items:
+        key = cache_key(item.id)
+        parts = cached.get(key)
+        if parts is None:
+            parts = render_card(item)
+            rendered[key] = (parts, tags[key])
+        cards.append(fill_slots(parts, item))
+    if rendered:
+        cache.set_many(rendered, CACHE_TIMEOUT, versions=versions)
+    return cards
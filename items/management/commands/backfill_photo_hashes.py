@@ -0,0 +1,71 @@
+import io
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from items.models import Item, PhotoFingerprint
+from items.photohash import fingerprint_fields, phash
+
+
+class Command(BaseCommand):
+    """
+    Fingerprint item photos that were uploaded before hashing existed.
+
+    Photos are downloaded from storage and hashed by a thread pool one
+    batch at a time; each batch is written with a single bulk insert.
+    """
+
+    help = 'Compute perceptual hashes for existing item photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--timeout', type=float, default=15, help='Download timeout in seconds')
+        parser.add_argument('--force', action='store_true', help='Re-hash photos that already have a fingerprint')
+
+    def handle(self, *args, **options):
+        items = Item.objects.exclude(photo__isnull=True).exclude(photo='').order_by('id')
+        if not options['force']:
+            items = items.filter(photo_fingerprint__isnull=True)
+
+        done = failed = 0
+        start = time.perf_counter()
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                batch = list(items.filter(id__gt=last_id)[:options['batch_size']])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+
+                results = pool.map(lambda item: (item, self.hash_photo(item, options['timeout'])), batch)
+                fingerprints = []
+                for item, value in results:
+                    if value is None:
+                        failed += 1
+                        continue
+                    fingerprints.append(PhotoFingerprint(item=item, **fingerprint_fields(value)))
+
+                PhotoFingerprint.objects.bulk_create(
+                    fingerprints,
+                    update_conflicts=True,
+                    unique_fields=['item'],
+                    update_fields=['hash', 'chunk0', 'chunk1', 'chunk2', 'chunk3'],
+                )
+                done += len(fingerprints)
+                self.stdout.write(f'  {done} hashed, {failed} failed (up to item {last_id})')
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Fingerprinted {done} photos in {elapsed:.1f}s ({failed} could not be read)'
+        ))
+
+    def hash_photo(self, item, timeout):
+        try:
+            with urllib.request.urlopen(item.photo.url, timeout=timeout) as response:
+                return phash(io.BytesIO(response.read()))
+        except Exception as e:
+            self.stderr.write(f'Item {item.id}: {e}')
+            return None
@@ -0,0 +1,120 @@
+import random
+import threading
+import time
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from items.models import Item
+
+User = get_user_model()
+
+EMAIL_DOMAIN = 'benchclaims.invalid'
+
+
+class Command(BaseCommand):
+    """
+    Race threads to claim the same items, comparing the conditional
+    UPDATE in Item.objects.claim() with the old read-check-save.
+
+    Every thread tries every item, in its own random order. A correct
+    strategy ends with exactly one winner per item, and that winner is
+    the one recorded in claimed_by. Rows are created for the run and
+    deleted afterwards; run it against a scratch database (SQLite needs a
+    file database, since threads each open their own connection).
+    """
+
+    help = 'Benchmark claim_item under contention'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--items', type=int, default=200)
+        parser.add_argument('--strategy', choices=['cas', 'naive', 'both'], default='both')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        strategies = ['naive', 'cas'] if options['strategy'] == 'both' else [options['strategy']]
+        self.stdout.write(
+            f'{"strategy":<8} {"claims/s":>9} {"p50 ms":>7} {"p99 ms":>7} '
+            f'{"winners":>8} {"doubles":>8} {"wrong owner":>12}'
+        )
+        for strategy in strategies:
+            users, item_ids = self.create_fixtures(options['threads'], options['items'])
+            try:
+                self.run(strategy, users, item_ids, options['seed'])
+            finally:
+                User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}').delete()
+
+    def create_fixtures(self, threads, items):
+        users = User.objects.bulk_create([
+            User(email=f'claimer{i}@{EMAIL_DOMAIN}', password='!') for i in range(threads + 1)
+        ])
+        poster, claimers = users[0], users[1:]
+        created = Item.objects.bulk_create([
+            Item(poster=poster, item_type='found', title=f'Contended item {i}') for i in range(items)
+        ])
+        return claimers, [item.id for item in created]
+
+    def run(self, strategy, users, item_ids, seed):
+        attempt = self.claim_cas if strategy == 'cas' else self.claim_naive
+        barrier = threading.Barrier(len(users))
+        wins, timings, errors = Counter(), [], []
+        lock = threading.Lock()
+
+        def worker(user, order):
+            local_wins, local_timings = [], []
+            try:
+                barrier.wait()
+                for item_id in order:
+                    start = time.perf_counter()
+                    if attempt(item_id, user.id):
+                        local_wins.append((item_id, user.id))
+                    local_timings.append((time.perf_counter() - start) * 1000)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+            with lock:
+                wins.update(local_wins)
+                timings.extend(local_timings)
+
+        rng = random.Random(seed)
+        threads = [
+            threading.Thread(target=worker, args=(user, rng.sample(item_ids, len(item_ids))))
+            for user in users
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        winners_per_item = Counter(item_id for item_id, _ in wins)
+        owners = dict(Item.objects.filter(id__in=item_ids).values_list('id', 'claimed_by_id'))
+        wrong_owner = sum(1 for item_id, user_id in wins if owners[item_id] != user_id)
+        timings.sort()
+        self.stdout.write(
+            f'{strategy:<8} {len(timings) / elapsed:>9.0f} '
+            f'{timings[len(timings) // 2]:>7.2f} {timings[int(len(timings) * 0.99) - 1]:>7.2f} '
+            f'{len(wins):>8} {sum(1 for n in winners_per_item.values() if n > 1):>8} {wrong_owner:>12}'
+        )
+        for error in errors[:3]:
+            self.stderr.write(f'  {strategy}: {error}')
+
+    @staticmethod
+    def claim_cas(item_id, user_id):
+        return Item.objects.claim(item_id, user_id)
+
+    @staticmethod
+    def claim_naive(item_id, user_id):
+        """The pre-compare-and-set claim_item: read, check in Python, save the whole row"""
+        item = Item.objects.get(pk=item_id)
+        if item.status != 'active':
+            return False
+        item.status = 'claimed'
+        item.claimed_by_id = user_id
+        item.save()
+        return True
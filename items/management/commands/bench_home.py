@@ -0,0 +1,93 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from core.cache import cache_layer_settings, get_cache
+from items.models import Item
+from items.seeding import OBJECTS, build_items
+
+User = get_user_model()
+
+EMAIL_DOMAIN = 'benchhome.invalid'
+
+
+class Command(BaseCommand):
+    """
+    Requests per second of the home page for logged-out visitors, with
+    and without the anonymous page cache.
+
+    Requests go through the whole middleware stack with the test client,
+    one at a time, over a mix of URLs shaped like real traffic: mostly
+    the plain feed, some type filters and sorts, and a few popular
+    searches. Rows are created inside a transaction that is rolled back
+    at the end; the caches are cleared before each run.
+    """
+
+    help = 'Benchmark the anonymous home page cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=5_000)
+        parser.add_argument('--requests', type=int, default=1_000, help='Requests timed per mode')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        urls = self.traffic(rng, options['requests'])
+
+        with transaction.atomic():
+            poster = User.objects.create_user(email=f'poster@{EMAIL_DOMAIN}', password=None)
+            Item.objects.bulk_create(build_items(rng, [poster], options['items']), batch_size=5_000)
+
+            self.stdout.write(f'{"page cache":<11} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8}')
+            results = {}
+            for enabled in (False, True):
+                with override_settings(CACHE_LAYER={**cache_layer_settings(), 'ANONYMOUS_PAGES': enabled}):
+                    get_cache().clear()
+                    results[enabled] = rps, p50, p95 = self.run(urls)
+                self.stdout.write(f'{"on" if enabled else "off":<11} {rps:>8.0f} {p50:>8.2f} {p95:>8.2f}')
+
+            transaction.set_rollback(True)
+        get_cache().clear()
+        self.stdout.write(self.style.SUCCESS(f'{results[True][0] / results[False][0]:.1f}x requests per second'))
+
+    @staticmethod
+    def traffic(rng, count):
+        home = reverse('items:home')
+        searches = [obj.lower() for objs in OBJECTS.values() for obj in objs[:2]]
+        urls = []
+        for _ in range(count):
+            roll = rng.random()
+            if roll < 0.6:
+                urls.append(home)
+            elif roll < 0.8:
+                urls.append(f'{home}?type={rng.choice(["lost", "found"])}')
+            elif roll < 0.9:
+                urls.append(f'{home}?sort=oldest')
+            else:
+                urls.append(f'{home}?q={rng.choice(searches).replace(" ", "+")}')
+        return urls
+
+    @staticmethod
+    def run(urls):
+        """Requests per second, p50 and p95 latency in milliseconds"""
+        # The test client's default host isn't in ALLOWED_HOSTS outside the test runner
+        host = settings.ALLOWED_HOSTS[0].lstrip('.') if settings.ALLOWED_HOSTS else 'localhost'
+        client = Client(HTTP_HOST='localhost' if host == '*' else host)
+        timings = []
+        start = time.perf_counter()
+        for url in urls:
+            request_start = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - request_start) * 1000)
+            assert response.status_code == 200, (url, response.status_code)
+        elapsed = time.perf_counter() - start
+        timings.sort()
+        return len(urls) / elapsed, statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
@@ -0,0 +1,58 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from items.matching import ItemVectorizer, MatchIndex, matching_settings
+from items.seeding import random_item_fields
+
+
+class Command(BaseCommand):
+    """
+    Time match index construction and top-k queries on synthetic items.
+
+    Runs entirely in memory, so it needs no database rows.
+    """
+
+    help = 'Benchmark the lost-to-found match index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--top-k', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        def row():
+            fields = random_item_fields(rng)
+            return fields['title'], fields['description'], fields['category'], fields['location']
+
+        rows = [(pk, *row()) for pk in range(options['items'])]
+        index = MatchIndex(ItemVectorizer(matching_settings()['N_FEATURES']))
+
+        start = time.perf_counter()
+        index.build(rows)
+        build = time.perf_counter() - start
+        self.stdout.write(f'Built index of {len(index):,} items in {build:.2f}s')
+
+        start = time.perf_counter()
+        for pk in range(options['items'], options['items'] + 1000):
+            index.add(pk, *row())
+        self.stdout.write(f'Added 1,000 items incrementally in {(time.perf_counter() - start) * 1000:.1f}ms')
+
+        timings = []
+        for _ in range(options['queries']):
+            vector = index.vectorizer.transform([row()])
+            start = time.perf_counter()
+            index.query(vector, options['top_k'])
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f'Query top-{options["top_k"]}: '
+            f'p50 {statistics.median(timings):.2f}ms '
+            f'p95 {timings[int(len(timings) * 0.95) - 1]:.2f}ms '
+            f'max {timings[-1]:.2f}ms'
+        )
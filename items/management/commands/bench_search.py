@@ -0,0 +1,90 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from items.models import Item
+from items.search import get_search_backend
+from items.seeding import ADJECTIVES, OBJECTS, LOCATIONS, build_items
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Compare full-text search latency with the old four-way icontains OR.
+
+    Rows are created inside a transaction that is rolled back at the end,
+    so the command leaves the database as it found it. Run it against a
+    scratch database all the same: 1M rows takes a while to insert.
+    """
+
+    help = 'Benchmark item search latency at increasing table sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--queries', type=int, default=50, help='Queries timed per size')
+        parser.add_argument('--batch-size', type=int, default=5_000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        objects = [obj for objs in OBJECTS.values() for obj in objs]
+        search = get_search_backend()
+        self.stdout.write(f'Backend: {type(search).__name__}')
+
+        with transaction.atomic():
+            poster = User.objects.create_user(email='bench-search@example.com', password=None)
+            total = Item.objects.count()
+
+            for size in sorted(options['sizes']):
+                while total < size:
+                    batch = min(options['batch_size'], size - total)
+                    Item.objects.bulk_create(build_items(rng, [poster], batch))
+                    total += batch
+
+                # Multi-word queries like students type them, e.g. "blue airpods library"
+                queries = [
+                    f'{rng.choice(ADJECTIVES)} {rng.choice(objects)} {rng.choice(LOCATIONS).split()[0]}'.lower()
+                    for _ in range(options['queries'])
+                ]
+                fts = self.time_queries(queries, lambda q: self.first_page(search.filter(Item.objects.all(), q)))
+                like = self.time_queries(queries, lambda q: self.first_page(self.icontains(q)))
+                ranked = self.time_queries(queries, lambda q: search.ranked(Item.objects.all(), q, limit=24))
+
+                self.stdout.write(
+                    f'{size:>9,} items | '
+                    f'fts p50 {fts[0]:7.2f}ms p95 {fts[1]:7.2f}ms | '
+                    f'ranked p50 {ranked[0]:7.2f}ms p95 {ranked[1]:7.2f}ms | '
+                    f'icontains p50 {like[0]:7.2f}ms p95 {like[1]:7.2f}ms'
+                )
+
+            transaction.set_rollback(True)
+
+    @staticmethod
+    def icontains(query):
+        return Item.objects.filter(
+            Q(title__icontains=query) |
+            Q(description__icontains=query) |
+            Q(category__icontains=query) |
+            Q(location__icontains=query)
+        )
+
+    @staticmethod
+    def first_page(queryset):
+        return list(queryset.order_by('-created_at', '-id')[:24])
+
+    @staticmethod
+    def time_queries(queries, run):
+        """p50 and p95 latency of ``run(query)`` in milliseconds"""
+        timings = []
+        for query in queries:
+            start = time.perf_counter()
+            run(query)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return statistics.median(timings), timings[max(int(len(timings) * 0.95) - 1, 0)]
@@ -0,0 +1,314 @@
+import http.client
+import json
+import os
+import re
+import shlex
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from chats.models import Message, Participant
+from items.models import Item
+
+User = get_user_model()
+
+SCENARIOS = ['home', 'home_logged_in', 'item_detail', 'dashboard', 'inbox', 'conversation_detail']
+
+# The deployed server, so --transport http measures the production request path
+RENDER_YAML = os.path.join(settings.BASE_DIR, 'render.yaml')
+
+
+def server_command(path=RENDER_YAML):
+    """The web service's startCommand in render.yaml, split into arguments"""
+    with open(path) as f:
+        match = re.search(r'^\s*startCommand:\s*(.+?)\s*$', f.read(), re.MULTILINE)
+    if match is None:
+        raise CommandError(f'No startCommand in {path}')
+    return shlex.split(match.group(1).strip('"\''))
+
+
+def percentile(timings, fraction):
+    """The ``fraction`` percentile of sorted ``timings``"""
+    return timings[max(int(len(timings) * fraction) - 1, 0)]
+
+
+def summarize(timings, sizes, queries=None):
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'p50_ms': round(statistics.median(timings), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'queries': round(statistics.mean(queries), 2) if queries else None,
+        'bytes': round(statistics.mean(sizes)),
+    }
+
+
+def compare(baseline, current, threshold):
+    """
+    Regressions of ``current`` results against ``baseline`` ones: a p95
+    more than ``threshold`` (a fraction) slower, or more queries per
+    request. Scenarios only one side has are skipped.
+    """
+    regressions = []
+    for transport, scenarios in current['results'].items():
+        for name, result in scenarios.items():
+            before = baseline['results'].get(transport, {}).get(name)
+            if before is None:
+                continue
+            if result['p95_ms'] > before['p95_ms'] * (1 + threshold):
+                regressions.append(
+                    f'{transport} {name}: p95 {result["p95_ms"]:.2f}ms vs {before["p95_ms"]:.2f}ms '
+                    f'({result["p95_ms"] / before["p95_ms"] - 1:+.0%})'
+                )
+            if None not in (result['queries'], before['queries']) and result['queries'] > before['queries']:
+                regressions.append(
+                    f'{transport} {name}: {result["queries"]:g} queries per request vs {before["queries"]:g}'
+                )
+    return regressions
+
+
+class Command(BaseCommand):
+    """
+    End-to-end latency of the main pages on a seeded database (see
+    seed_data).
+
+    Each page is requested --requests times after --warmup unmeasured
+    requests, through the Django test client (the whole middleware stack
+    in this process, which is also where queries per request are counted)
+    and/or over HTTP, either to the server render.yaml starts in
+    production (run here, on a free port) or one already running at --url. Logged-in pages are requested as the user
+    with the most conversations, or --email.
+
+    Results go to --output as JSON. Given a --baseline file from an
+    earlier run, the command fails if any page's p95 got more than
+    --threshold slower or it runs more queries than before.
+    """
+
+    help = 'Benchmark the main pages end to end'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transport', choices=['client', 'http', 'both'], default='client')
+        parser.add_argument('--url', help='Benchmark a server already running here instead of starting one')
+        parser.add_argument('--workers', type=int, help="Workers to start, instead of render.yaml's")
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per page')
+        parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per page first')
+        parser.add_argument('--email', help='User to request logged-in pages as')
+        parser.add_argument('--output', default='bench-results.json')
+        parser.add_argument('--baseline', help='Results file to compare against')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed p95 slowdown against the baseline, as a fraction')
+
+    def handle(self, *args, **options):
+        scenarios = options['scenarios'].split(',')
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        host = self.host()
+        user = self.pick_user(options['email'])
+        pages = self.pages(user, scenarios)
+        logged_in = Client(HTTP_HOST=host)
+        logged_in.force_login(user)
+        session_key = logged_in.cookies[settings.SESSION_COOKIE_NAME].value
+
+        results = {}
+        try:
+            if options['transport'] in ('client', 'both'):
+                clients = {False: Client(HTTP_HOST=host), True: logged_in}
+                results['client'] = {
+                    name: self.run_client(clients[needs_login], url, options)
+                    for name, (url, needs_login) in pages.items()
+                }
+            if options['transport'] in ('http', 'both'):
+                cookie = f'{settings.SESSION_COOKIE_NAME}={session_key}'
+                with self.server(options) as base_url:
+                    results['http'] = {
+                        name: self.run_http(base_url, host, url, cookie if needs_login else None, options)
+                        for name, (url, needs_login) in pages.items()
+                    }
+        finally:
+            Session.objects.filter(session_key=session_key).delete()
+
+        report = {'meta': self.meta(user, options), 'results': results}
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.print_results(results)
+        self.stdout.write(f'Wrote {options["output"]}')
+
+        if baseline is not None:
+            regressions = compare(baseline, report, options['threshold'])
+            if regressions:
+                for regression in regressions:
+                    self.stderr.write(f'  {regression}')
+                raise CommandError(f'{len(regressions)} regressions against {options["baseline"]}')
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {options["baseline"]}'))
+
+    @staticmethod
+    def host():
+        # The test client's default host isn't in ALLOWED_HOSTS outside the test runner
+        host = settings.ALLOWED_HOSTS[0].lstrip('.') if settings.ALLOWED_HOSTS else 'localhost'
+        return 'localhost' if host == '*' else host
+
+    @staticmethod
+    def pick_user(email):
+        if email:
+            user = User.objects.filter(email=email).first()
+            if user is None:
+                raise CommandError(f'No user {email}')
+            return user
+        busiest = Participant.objects.values('user').annotate(n=Count('id')).order_by('-n').values('user')[:1]
+        user = User.objects.filter(pk__in=busiest).first()
+        if user is None:
+            raise CommandError('Nobody has any conversations; seed the database first (manage.py seed_data)')
+        return user
+
+    def pages(self, user, scenarios):
+        """{scenario: (path, whether it needs the logged-in user)}"""
+        participant = Participant.objects.inbox_for(user).select_related('conversation').first()
+        # The item the user is talking about, else the newest one
+        item_id = participant.conversation.item_id if participant else (
+            Item.objects.order_by('-id').values_list('id', flat=True).first()
+        )
+        if item_id is None:
+            raise CommandError('There are no items; seed the database first (manage.py seed_data)')
+        pages = {
+            'home': (reverse('items:home'), False),
+            'home_logged_in': (reverse('items:home'), True),
+            'item_detail': (reverse('items:item_detail', args=[item_id]), True),
+            'dashboard': (reverse('items:dashboard'), True),
+            'inbox': (reverse('chats:inbox'), True),
+        }
+        if participant:
+            pages['conversation_detail'] = (
+                reverse('chats:conversation_detail', args=[participant.conversation_id]), True
+            )
+        elif 'conversation_detail' in scenarios:
+            self.stderr.write(f'Skipping conversation_detail: {user.email} has no conversations')
+        return {name: pages[name] for name in scenarios if name in pages}
+
+    @staticmethod
+    def run_client(client, url, options):
+        for _ in range(options['warmup']):
+            client.get(url)
+        timings, sizes, queries = [], [], []
+        for _ in range(options['requests']):
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f'{url} answered {response.status_code}')
+            sizes.append(len(response.content))
+            queries.append(len(captured))
+        return summarize(timings, sizes, queries)
+
+    @staticmethod
+    def run_http(base_url, host, url, cookie, options):
+        parts = urlsplit(base_url)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        headers = {'Host': host}
+        if cookie:
+            headers['Cookie'] = cookie
+        timings, sizes = [], []
+        try:
+            for n in range(options['warmup'] + options['requests']):
+                start = time.perf_counter()
+                conn.request('GET', url, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+                elapsed = (time.perf_counter() - start) * 1000
+                if response.status != 200:
+                    raise CommandError(f'{url} answered {response.status}')
+                if n >= options['warmup']:
+                    timings.append(elapsed)
+                    sizes.append(len(body))
+        finally:
+            conn.close()
+        return summarize(timings, sizes)
+
+    @contextmanager
+    def server(self, options):
+        """Base URL of the server to benchmark, starting render.yaml's unless --url was given"""
+        if options['url']:
+            yield options['url']
+            return
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        program, *arguments = server_command()
+        # Later options win, so these override render.yaml's
+        arguments += ['--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+        if options['workers']:
+            arguments += ['--workers', str(options['workers'])]
+        process = subprocess.Popen([sys.executable, '-m', program, *arguments], env=os.environ.copy())
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                    break
+                except OSError:
+                    if process.poll() is not None or time.monotonic() > deadline:
+                        raise CommandError(f'{program} did not start')
+                    time.sleep(0.2)
+            yield f'http://127.0.0.1:{port}'
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    @staticmethod
+    def meta(user, options):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'created_at': timezone.now().isoformat(),
+            'commit': commit,
+            'database': connection.vendor,
+            'rows': {
+                'users': User.objects.count(),
+                'items': Item.objects.count(),
+                'messages': Message.objects.count(),
+            },
+            'user': user.email,
+            'requests': options['requests'],
+            'warmup': options['warmup'],
+            'server': options['url'] or ' '.join(server_command()),
+            'workers': options['workers'],
+        }
+
+    def print_results(self, results):
+        self.stdout.write(
+            f'{"transport":<10} {"page":<20} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} {"bytes":>8}'
+        )
+        for transport, scenarios in results.items():
+            for name, result in scenarios.items():
+                queries = '-' if result['queries'] is None else f'{result["queries"]:g}'
+                self.stdout.write(
+                    f'{transport:<10} {name:<20} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} '
+                    f'{result["p99_ms"]:>8.2f} {queries:>8} {result["bytes"]:>8}'
+                )
@@ -0,0 +1,82 @@
+import io
+import pstats
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.profiling import delete_profile, make_token, profiling_settings, stored_profiles
+
+SORT_KEYS = ['cumulative', 'tottime', 'ncalls']
+
+
+class Command(BaseCommand):
+    """
+    The request profiles ProfilingMiddleware stored (see core/profiling.py).
+
+    list       the newest --limit profiles, optionally of one --view
+    aggregate  the profiles of --view (or all of them) merged into one,
+               printing the --limit top functions by --sort and writing
+               the merged stats to --output if given
+    prune      delete profiles older than --older-than days and all but
+               the newest --keep
+    token      print an X-Profile header value that gets a request
+               profiled in production
+    """
+
+    help = 'List, aggregate and prune stored request profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'aggregate', 'prune', 'token'])
+        parser.add_argument('--directory', help='Where the profiles are (default: PROFILING["DIRECTORY"])')
+        parser.add_argument('--view', help='Only profiles of this view name, e.g. items:item_detail')
+        parser.add_argument('--limit', type=int, default=25, help='Profiles to list, or functions to print')
+        parser.add_argument('--sort', choices=SORT_KEYS, default='cumulative')
+        parser.add_argument('--output', help='Write the aggregated stats to this .pstats file')
+        parser.add_argument('--older-than', type=float, help='Prune profiles older than this many days')
+        parser.add_argument('--keep', type=int, help='Prune all but this many of the newest profiles')
+
+    def handle(self, *args, **options):
+        if options['action'] == 'token':
+            self.stdout.write(f'X-Profile: {make_token()}')
+            return
+        directory = options['directory'] or profiling_settings()['DIRECTORY']
+        profiles = stored_profiles(directory)
+        if options['view']:
+            profiles = [meta for meta in profiles if meta['view'] == options['view']]
+        getattr(self, options['action'])(profiles, options)
+
+    def list(self, profiles, options):
+        self.stdout.write(f'{"id":<32} {"view":<30} {"status":>6} {"ms":>9} {"reason":<8} path')
+        for meta in profiles[:options['limit']]:
+            self.stdout.write(
+                f'{meta["id"]:<32} {meta["view"] or "-":<30} {meta["status"]:>6} {meta["duration_ms"]:>9.2f} '
+                f'{meta["reason"]:<8} {meta["method"]} {meta["path"]}'
+            )
+        self.stdout.write(f'{len(profiles)} profiles')
+
+    def aggregate(self, profiles, options):
+        if not profiles:
+            raise CommandError('No profiles to aggregate')
+        # pstats writes partial lines, which OutputWrapper would break up
+        out = io.StringIO()
+        stats = pstats.Stats(*[meta['path'] for meta in profiles], stream=out)
+        stats.sort_stats(options['sort']).print_stats(options['limit'])
+        self.stdout.write(f'{len(profiles)} profiles')
+        self.stdout.write(out.getvalue())
+        if options['output']:
+            stats.dump_stats(options['output'])
+            self.stdout.write(f'Wrote {options["output"]}')
+
+    def prune(self, profiles, options):
+        if options['older_than'] is None and options['keep'] is None:
+            raise CommandError('Give --older-than and/or --keep')
+        keep = options['keep']
+        cutoff = None if options['older_than'] is None else time.time() - options['older_than'] * 86400
+        # profiles is newest first
+        doomed = [
+            meta for n, meta in enumerate(profiles)
+            if (keep is not None and n >= keep) or (cutoff is not None and meta['created_at'] < cutoff)
+        ]
+        for meta in doomed:
+            delete_profile(meta)
+        self.stdout.write(f'Deleted {len(doomed)} of {len(profiles)} profiles')
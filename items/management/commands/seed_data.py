@@ -0,0 +1,138 @@
+import random
+import time
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from chats.models import Conversation, Message, Participant
+from chats.seeding import build_conversations, finish_conversations
+from core.cache import get_cache
+from items.models import Item, Review
+from items.seeding import (
+    SEED_EMAIL_DOMAIN, User, build_reviews, build_seed_items, build_users, explicit_timestamps,
+)
+
+UPDATE_BATCH_SIZE = 500
+
+MODELS = ['users', 'items', 'reviews', 'conversations', 'messages']
+
+
+class Command(BaseCommand):
+    """
+    Generate users, items, reviews, conversations and messages at scale.
+
+    Rows are written with batched bulk_create() on SQLite and Postgres
+    alike, items a batch at a time together with their reviews and
+    conversations, so memory stays flat however many are asked for. The
+    denormalized fields the signals would normally maintain (conversation
+    snapshots and watermarks, inbox rows) are filled in directly and the
+    unread counters are recounted at the end with reconcile_unread_counts.
+
+    The same --seed on the same database produces the same rows, apart
+    from timestamps, which are relative to now. Users are numbered after
+    any seeded earlier, so running it again adds more.
+    """
+
+    help = 'Bulk-generate realistic data for load and scale testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1_000)
+        parser.add_argument('--items', type=int, default=10_000)
+        parser.add_argument('--review-rate', type=float, default=0.6,
+                            help='Fraction of returned items their claimer reviewed')
+        parser.add_argument('--conversation-rate', type=float, default=0.3,
+                            help='Fraction of items somebody started a conversation about')
+        parser.add_argument('--max-messages', type=int, default=12, help='Most messages in one conversation')
+        parser.add_argument('--days', type=int, default=365, help='How far back the rows are spread')
+        parser.add_argument('--batch-size', type=int, default=5_000)
+        parser.add_argument('--password', help='Password for every seeded user (default: unusable)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options['users'] < 2:
+            raise CommandError('Claims and conversations need at least two users')
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        batch_size = options['batch_size']
+        self.rows, self.seconds = Counter(), Counter()
+        start = time.perf_counter()
+
+        with explicit_timestamps(User, Item, Review, Conversation, Message):
+            user_ids = self.seed_users(rng, options, now)
+            for offset in range(0, options['items'], batch_size):
+                count = min(batch_size, options['items'] - offset)
+                with transaction.atomic():
+                    self.seed_items(rng, user_ids, count, options, now)
+                self.stdout.write(f'  {offset + count} / {options["items"]} items', ending='\r')
+        self.stdout.write('')
+
+        with self.timed('unread counters'):
+            call_command('reconcile_unread_counts', batch_size=batch_size, stdout=self.stdout)
+        # bulk_create() sends no signals, so no cache tags were bumped
+        get_cache().clear()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'{"":<14} {"rows":>10} {"rows/s":>10}')
+        for name in MODELS:
+            self.stdout.write(
+                f'{name:<14} {self.rows[name]:>10} {self.rows[name] / max(self.seconds[name], 1e-9):>10.0f}'
+            )
+        total = sum(self.rows.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {total} rows in {elapsed:.1f}s ({total / elapsed:.0f} rows/s overall)'
+        ))
+
+    def timed(self, name):
+        return _Timer(self.seconds, name)
+
+    def create(self, name, model, objs, batch_size):
+        with self.timed(name):
+            created = model.objects.bulk_create(objs, batch_size=batch_size)
+        self.rows[name] += len(created)
+        return created
+
+    def seed_users(self, rng, options, now):
+        password = make_password(options['password']) if options['password'] else make_password(None)
+        start = User.objects.filter(email__endswith=f'@{SEED_EMAIL_DOMAIN}').count()
+        user_ids = []
+        for offset in range(0, options['users'], options['batch_size']):
+            count = min(options['batch_size'], options['users'] - offset)
+            users = build_users(rng, start + offset, count, password, now, options['days'])
+            user_ids += [user.pk for user in self.create('users', User, users, options['batch_size'])]
+        return user_ids
+
+    def seed_items(self, rng, user_ids, count, options, now):
+        batch_size = options['batch_size']
+        items = self.create('items', Item, build_seed_items(rng, user_ids, count, now, options['days']), batch_size)
+        self.create('reviews', Review, build_reviews(rng, items, options['review_rate'], now), batch_size)
+
+        threads = build_conversations(
+            rng, items, user_ids, options['conversation_rate'], options['max_messages'], now,
+        )
+        conversations = self.create('conversations', Conversation, [conversation for conversation, _ in threads], batch_size)
+        self.create('messages', Message, [message for _, messages in threads for message in messages],
+                    batch_size)
+        with self.timed('conversations'):
+            fields = finish_conversations(rng, threads)
+            # Each batch is one UPDATE with a CASE per field over every row
+            # in it, so only the ids that weren't known before the insert
+            Conversation.objects.bulk_update(conversations, fields, batch_size=UPDATE_BATCH_SIZE)
+            Participant.objects.create_for(conversations)
+
+
+class _Timer:
+    """Adds the seconds spent inside the block to ``seconds[name]``"""
+
+    def __init__(self, seconds, name):
+        self.seconds = seconds
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.seconds[self.name] += time.perf_counter() - self.start
@@ -0,0 +1,315 @@
+"""
+Lost-to-found matching.
+
+Every active item is turned into a sparse, L2-normalised vector of hashed
+word unigrams and bigrams from its title, description, category and
+location. Vectors live in one in-memory index per item type; finding
+matches for a lost item is a single sparse matrix-vector product against
+the found index (and vice versa).
+
+HashingVectorizer is stateless, so items can be added to or dropped from
+an index as they are saved without refitting anything. Each worker keeps
+its own copy, updated by the Item signals in items/signals.py and rebuilt
+from the database every REFRESH_SECONDS to pick up writes made elsewhere.
+Only the first build makes a request wait; later ones run in a background
+thread while queries keep using the current index, which is swapped for
+the new one when it is ready.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import connections
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from .models import Item
+
+logger = logging.getLogger(__name__)
+
+MATCHING_DEFAULTS = {
+    'TOP_K': 5,              # candidates shown on item_detail
+    'MIN_SCORE': 0.2,        # cosine similarity below this isn't a match
+    'N_FEATURES': 2 ** 18,   # size of the hashed feature space
+    'REFRESH_SECONDS': 300,  # background rebuild interval per worker
+}
+
+OPPOSITE_TYPE = {'lost': 'found', 'found': 'lost'}
+
+INDEX_FIELDS = ('id', 'title', 'description', 'category', 'location')
+
+
+def matching_settings():
+    """MATCHING_DEFAULTS overridden by settings.ITEM_MATCHING"""
+    return {**MATCHING_DEFAULTS, **getattr(settings, 'ITEM_MATCHING', {})}
+
+
+class ItemVectorizer:
+    """Hashed word unigram + bigram features for an item"""
+
+    def __init__(self, n_features):
+        self.n_features = n_features
+        self.hasher = HashingVectorizer(
+            n_features=n_features,
+            ngram_range=(1, 2),
+            stop_words='english',
+            alternate_sign=False,
+            norm=None,
+            dtype=np.float32,
+        )
+
+    @staticmethod
+    def document(title, description, category, location):
+        # The title is repeated so it outweighs a long description
+        return ' '.join([title, title, category or '', location or '', description or ''])
+
+    def transform(self, rows):
+        """Vectorize (title, description, category, location) tuples"""
+        documents = [self.document(*row) for row in rows]
+        if not documents:
+            # HashingVectorizer can't take an empty batch
+            return sparse.csr_matrix((0, self.hasher.n_features), dtype=np.float32)
+        matrix = self.hasher.transform(documents)
+        matrix.data = np.log1p(matrix.data)
+        return normalize(matrix, copy=False)
+
+
+class MatchIndex:
+    """
+    Sparse vectors for the active items of one type.
+
+    Vectors are stored transposed (one row per feature, one column per
+    item), i.e. as an inverted index: scoring a query only reads the
+    posting rows of the handful of features the query actually has.
+
+    Newly added vectors sit in a small pending buffer that is scored
+    separately and merged into the postings once it reaches MERGE_AT rows.
+    Removed items are masked out and only physically dropped once they
+    make up a quarter of the columns.
+    """
+
+    MERGE_AT = 1000
+
+    def __init__(self, vectorizer):
+        self.vectorizer = vectorizer
+        self.lock = threading.Lock()
+        self.ids = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+        self.postings = sparse.csr_matrix((vectorizer.n_features, 0), dtype=np.float32)
+        self.positions = {}
+        self.pending_ids = []
+        self.pending_vectors = []
+        self.built_at = 0.0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def build(self, rows):
+        """Replace the index contents with (id, title, description, category, location) rows"""
+        rows = list(rows)
+        postings = self.vectorizer.transform([row[1:] for row in rows]).T.tocsr()
+        with self.lock:
+            self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+            self.alive = np.ones(len(rows), dtype=bool)
+            self.postings = postings
+            self.positions = {pk: i for i, pk in enumerate(self.ids.tolist())}
+            self.pending_ids, self.pending_vectors = [], []
+            self.built_at = time.monotonic()
+
+    def add(self, item_id, title, description, category, location):
+        vector = self.vectorizer.transform([(title, description, category, location)])
+        with self.lock:
+            self._discard(item_id)
+            self.positions[item_id] = len(self.ids) + len(self.pending_ids)
+            self.pending_ids.append(item_id)
+            self.pending_vectors.append(vector)
+            if len(self.pending_ids) >= self.MERGE_AT:
+                self._merge()
+
+    def remove(self, item_id):
+        with self.lock:
+            self._discard(item_id)
+            if len(self.alive) and (~self.alive).sum() > len(self.alive) // 4:
+                self._merge()
+
+    def _discard(self, item_id):
+        position = self.positions.pop(item_id, None)
+        if position is None:
+            return
+        if position < len(self.ids):
+            self.alive[position] = False
+        else:
+            # Still pending: drop it before it ever reaches the postings
+            offset = position - len(self.ids)
+            del self.pending_ids[offset]
+            del self.pending_vectors[offset]
+            for pk, pos in self.positions.items():
+                if pos > position:
+                    self.positions[pk] = pos - 1
+
+    def _merge(self):
+        """Fold pending vectors into the postings and drop removed items"""
+        postings, ids, alive = self.postings, self.ids, self.alive
+        if self.pending_ids:
+            pending = sparse.vstack(self.pending_vectors, format='csr').T
+            postings = sparse.hstack([postings, pending], format='csr')
+            ids = np.concatenate([ids, np.array(self.pending_ids, dtype=np.int64)])
+            alive = np.concatenate([alive, np.ones(len(self.pending_ids), dtype=bool)])
+        if not alive.all():
+            postings = postings[:, alive]
+            ids = ids[alive]
+            alive = np.ones(len(ids), dtype=bool)
+        self.postings, self.ids, self.alive = postings, ids, alive
+        self.positions = {pk: i for i, pk in enumerate(ids.tolist())}
+        self.pending_ids, self.pending_vectors = [], []
+
+    def query(self, vector, k):
+        """Top ``k`` (item_id, score) pairs by cosine similarity"""
+        with self.lock:
+            ids = self.ids
+            scores = np.asarray(self.postings[vector.indices].T @ vector.data, dtype=np.float32)
+            scores[~self.alive] = -1.0
+            if self.pending_ids:
+                pending = sparse.vstack(self.pending_vectors, format='csr')
+                ids = np.concatenate([ids, np.array(self.pending_ids, dtype=np.int64)])
+                scores = np.concatenate([scores, (pending @ vector.T).toarray().ravel()])
+
+        if not len(ids):
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+
+class MatchEngine:
+    """
+    One MatchIndex per item type, built lazily from the database.
+
+    Saves and deletes made while an index is being built are journaled and
+    replayed onto the new index before it replaces the old one, so none
+    are lost to the gap between reading the rows and swapping it in.
+    """
+
+    def __init__(self):
+        config = matching_settings()
+        self.vectorizer = ItemVectorizer(config['N_FEATURES'])
+        self.indexes = {item_type: MatchIndex(self.vectorizer) for item_type in OPPOSITE_TYPE}
+        self.build_lock = threading.Lock()
+        # Guards indexes, journals and rebuilding; held only briefly
+        self.swap_lock = threading.Lock()
+        self.journals = []  # (item_type, [(item_id, row or None)]) per build in progress
+        self.rebuilding = set()
+
+    def get_index(self, item_type):
+        index = self.indexes[item_type]
+        if not index.built_at:
+            # Nothing to serve yet, so this request builds it
+            with self.build_lock:
+                if not self.indexes[item_type].built_at:
+                    self.build(item_type)
+            index = self.indexes[item_type]
+        elif time.monotonic() - index.built_at > matching_settings()['REFRESH_SECONDS']:
+            self.rebuild_in_background(item_type)
+        return index
+
+    def build(self, item_type):
+        """Build a fresh index of ``item_type`` from the database and swap it in"""
+        journal = (item_type, [])
+        with self.swap_lock:
+            self.journals.append(journal)
+        index = MatchIndex(self.vectorizer)
+        try:
+            rows = (
+                Item.objects.filter(status='active', item_type=item_type)
+                .values_list(*INDEX_FIELDS)
+                .iterator(chunk_size=5000)
+            )
+            index.build(rows)
+        except BaseException:
+            with self.swap_lock:
+                self.journals.remove(journal)
+            raise
+        with self.swap_lock:
+            self.journals.remove(journal)
+            for item_id, row in journal[1]:
+                index.remove(item_id)
+                if row is not None:
+                    index.add(item_id, *row)
+            self.indexes[item_type] = index
+
+    def rebuild_in_background(self, item_type):
+        """Start rebuilding ``item_type``'s index in a thread, unless that is already happening"""
+        with self.swap_lock:
+            if item_type in self.rebuilding:
+                return
+            self.rebuilding.add(item_type)
+        threading.Thread(target=self._background_build, args=(item_type,), daemon=True).start()
+
+    def _background_build(self, item_type):
+        try:
+            self.build(item_type)
+        except Exception:
+            # The current index stays in use; the next stale query tries again
+            logger.exception('Rebuilding the %s match index failed', item_type)
+        finally:
+            with self.swap_lock:
+                self.rebuilding.discard(item_type)
+            connections.close_all()
+
+    def reset(self):
+        """Forget every index; each is rebuilt on its next query"""
+        with self.swap_lock:
+            for index in self.indexes.values():
+                index.built_at = 0.0
+
+    def item_saved(self, item):
+        """Keep built indexes, and any being built, in step with a saved item"""
+        row = (item.title, item.description, item.category, item.location)
+        with self.swap_lock:
+            for item_type, changes in self.journals:
+                changes.append((item.pk, row if item.item_type == item_type and item.status == 'active' else None))
+            # An edit may have changed the type, so drop it everywhere first
+            for index in self.indexes.values():
+                index.remove(item.pk)
+            index = self.indexes.get(item.item_type)
+            if index is not None and index.built_at and item.status == 'active':
+                index.add(item.pk, *row)
+
+    def item_deleted(self, item):
+        with self.swap_lock:
+            for _, changes in self.journals:
+                changes.append((item.pk, None))
+            for index in self.indexes.values():
+                index.remove(item.pk)
+
+    def candidates(self, item, k=None):
+        """Best (item_id, score) pairs of the opposite type for ``item``"""
+        config = matching_settings()
+        k = k or config['TOP_K']
+        vector = self.vectorizer.transform([(item.title, item.description, item.category, item.location)])
+        # Over-fetch so the poster's own items can be dropped afterwards
+        hits = self.get_index(OPPOSITE_TYPE[item.item_type]).query(vector, k * 2)
+        return [(pk, score) for pk, score in hits if score >= config['MIN_SCORE']]
+
+    def find_matches(self, item, k=None):
+        """Up to ``k`` active opposite-type Items, best first, each with a ``match_score``"""
+        k = k or matching_settings()['TOP_K']
+        hits = self.candidates(item, k)
+        if not hits:
+            return []
+        found = Item.objects.filter(status='active').exclude(poster_id=item.poster_id).in_bulk(
+            [pk for pk, _ in hits]
+        )
+        matches = []
+        for pk, score in hits:
+            if pk in found:
+                found[pk].match_score = score
+                matches.append(found[pk])
+        return matches[:k]
+
+
+engine = MatchEngine()
@@ -0,0 +1,78 @@
+from django.db import migrations
+
+# Frozen copies of items/search.py's table and triggers as they were when
+# this migration was written, so later changes there can't alter it
+FTS_TABLE = 'items_item_fts'
+
+SQLITE_FTS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS items_item_fts_ai AFTER INSERT ON items_item BEGIN
+        INSERT INTO items_item_fts(rowid, title, description, category, location)
+        VALUES (new.id, new.title, new.description, new.category, new.location);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS items_item_fts_ad AFTER DELETE ON items_item BEGIN
+        INSERT INTO items_item_fts(items_item_fts, rowid, title, description, category, location)
+        VALUES ('delete', old.id, old.title, old.description, old.category, old.location);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS items_item_fts_au
+    AFTER UPDATE OF title, description, category, location ON items_item BEGIN
+        INSERT INTO items_item_fts(items_item_fts, rowid, title, description, category, location)
+        VALUES ('delete', old.id, old.title, old.description, old.category, old.location);
+        INSERT INTO items_item_fts(rowid, title, description, category, location)
+        VALUES (new.id, new.title, new.description, new.category, new.location);
+    END
+    """,
+]
+
+POSTGRES_SEARCH_VECTOR = """
+ALTER TABLE items_item ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(category, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(location, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(description, '')), 'C')
+) STORED
+"""
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "title, description, category, location, "
+            "content='items_item', content_rowid='id', "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        for statement in SQLITE_FTS_TRIGGERS:
+            schema_editor.execute(statement)
+        schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_SEARCH_VECTOR)
+        schema_editor.execute(
+            "CREATE INDEX items_item_search_idx ON items_item USING GIN (search_vector)"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        for trigger in ('items_item_fts_ai', 'items_item_fts_ad', 'items_item_fts_au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute("ALTER TABLE items_item DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('items', '0010_item_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -6,6 +6,27 @@ from cloudinary.models import CloudinaryField
 User = get_user_model()
 
 
+class ItemQuerySet(models.QuerySet):
+    def transition(self, item_id, from_status, to_status, **fields):
+        """
+        Move an item from ``from_status`` to ``to_status`` with a single
+        conditional UPDATE, also writing ``fields`` and nothing else.
+        
+        The status check happens in the WHERE clause, so when several
+        requests race only one of them matches the row; returns whether
+        this call was the one.
+        """
+        return self.filter(pk=item_id, status=from_status).update(status=to_status, **fields) == 1
+    
+    def claim(self, item_id, user_id):
+        """Claim an active item for ``user_id`` unless they posted it; True if this call won"""
+        return self.exclude(poster_id=user_id).transition(item_id, 'active', 'claimed', claimed_by_id=user_id)
+    
+    def mark_returned(self, item_id):
+        """Close a claimed item; True if this call made the change"""
+        return self.transition(item_id, 'claimed', 'returned')
+
+
 class Item(models.Model):
     TYPE_CHOICES = (
         ('found', 'Found'),
@@ -110,9 +131,18 @@ class Item(models.Model):
         help_text="User who claimed this item"
     )
 
+    objects = ItemQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.item_type.title()}: {self.title}"
 
+    def cache_tags(self):
+        """Tags of the cached pages and summaries this item appears in (see core/cache.py)"""
+        tags = [f'item:{self.pk}', f'feed:{self.item_type}', f'user:{self.poster_id}:items']
+        if self.claimed_by_id:
+            tags.append(f'user:{self.claimed_by_id}:items')
+        return tags
+
     def get_whatsapp_link(self):
         """Generate WhatsApp link from contact_info if it starts with 'whatsapp:'"""
         if self.contact_info and 'whatsapp:' in self.contact_info:
@@ -124,6 +154,25 @@ class Item(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of the home feed seeks on (created_at, id)
+            models.Index(fields=['created_at', 'id'], name='item_created_id_idx'),
+            # Home feed filtered by type
+            models.Index(fields=['item_type', 'created_at', 'id'], name='item_type_created_idx'),
+            # Dashboard listing (optionally by type) and its per-status counts
+            models.Index(fields=['poster', 'created_at'], name='item_poster_created_idx'),
+            models.Index(fields=['poster', 'item_type', 'created_at'], name='item_poster_type_created_idx'),
+            models.Index(fields=['poster', 'status'], name='item_poster_status_idx'),
+            # Items a user claimed that are waiting for a review
+            models.Index(fields=['claimed_by', 'status', 'created_at'], name='item_claimer_status_idx'),
+            # Only active items can be claimed or matched, and they are a
+            # small slice of the table once items get returned
+            models.Index(
+                fields=['item_type', 'created_at'],
+                name='item_active_type_created_idx',
+                condition=models.Q(status='active'),
+            ),
+        ]
 
 
 class Review(models.Model):
@@ -142,4 +191,28 @@ class Review(models.Model):
         unique_together = ['item', 'reviewer']
 
     def __str__(self):
-        return f"Review by {self.reviewer.email} for {self.item.title} - {self.rating} stars"
\ No newline at end of file
+        return f"Review by {self.reviewer.email} for {self.item.title} - {self.rating} stars"
+
+    def cache_tags(self):
+        # Shown on the item's page; settles an item on the reviewer's dashboard
+        return [f'item:{self.item_id}', f'user:{self.reviewer_id}:items']
+
+
+class PhotoFingerprint(models.Model):
+    """Perceptual hash of an item's photo, indexed for similarity lookups"""
+    item = models.OneToOneField(
+        Item,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='photo_fingerprint'
+    )
+    hash = models.BigIntegerField(help_text="64-bit pHash stored as a signed integer")
+    # The hash split into four 16-bit chunks; see items/photohash.py
+    chunk0 = models.PositiveIntegerField(db_index=True)
+    chunk1 = models.PositiveIntegerField(db_index=True)
+    chunk2 = models.PositiveIntegerField(db_index=True)
+    chunk3 = models.PositiveIntegerField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Fingerprint {self.hash & 0xFFFFFFFFFFFFFFFF:016x} for {self.item.title}"
@@ -0,0 +1,142 @@
+"""
+Perceptual hashes of item photos and "visually similar" lookups.
+
+Each photo gets a 64-bit DCT hash (pHash): resized copies, recompressed
+JPEGs and small crops of the same picture land within a few bits of each
+other. Hashes are stored in PhotoFingerprint split into four 16-bit
+chunks, each with its own index, which makes the table a multi-index
+hash: if two hashes are within Hamming distance r, at least one of their
+chunks is within r // 4 (pigeonhole), so a lookup only reads the rows
+whose chunks fall in a handful of small buckets instead of every hash.
+"""
+import logging
+from functools import lru_cache
+from itertools import combinations
+
+import numpy as np
+from django.db.models import Q
+from PIL import Image, UnidentifiedImageError
+
+from .models import PhotoFingerprint
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8         # 8x8 low-frequency DCT block -> 64 bits
+IMAGE_SIZE = 32       # image is reduced to 32x32 before the DCT
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+DEFAULT_RADIUS = 8    # max Hamming distance still considered "similar"
+
+
+@lru_cache(maxsize=1)
+def _dct_matrix():
+    """Orthonormal DCT-II basis for IMAGE_SIZE samples"""
+    n = IMAGE_SIZE
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * x + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def phash(image_file):
+    """64-bit perceptual hash of an image file or file-like object"""
+    with Image.open(image_file) as image:
+        pixels = np.asarray(
+            image.convert('L').resize((IMAGE_SIZE, IMAGE_SIZE), Image.Resampling.LANCZOS),
+            dtype=np.float64,
+        )
+    dct = _dct_matrix()
+    low = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # Compare against the median of the AC terms; the DC term is just brightness
+    bits = low > np.median(low[1:])
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def to_signed(value):
+    """Store an unsigned 64-bit hash in a signed BigIntegerField"""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def split_chunks(value):
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (CHUNK_BITS * i)) & mask for i in range(CHUNKS)]
+
+
+def fingerprint_fields(value):
+    """PhotoFingerprint field values for an unsigned 64-bit hash"""
+    fields = {'hash': to_signed(value)}
+    for i, chunk in enumerate(split_chunks(value)):
+        fields[f'chunk{i}'] = chunk
+    return fields
+
+
+def _neighbours(chunk, radius):
+    """Every CHUNK_BITS value within ``radius`` bit flips of ``chunk``"""
+    values = [chunk]
+    for distance in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), distance):
+            flipped = chunk
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
+
+
+def hash_upload(uploaded_file):
+    """
+    Hash a freshly uploaded photo, leaving the file rewound for storage.
+
+    Returns None if Pillow can't read it; a missing fingerprint only
+    means the item is left out of similarity lookups.
+    """
+    try:
+        return phash(uploaded_file)
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        logger.warning('Could not fingerprint %s: %s', getattr(uploaded_file, 'name', uploaded_file), e)
+        return None
+    finally:
+        uploaded_file.seek(0)
+
+
+def save_fingerprint(item, value):
+    PhotoFingerprint.objects.update_or_create(item=item, defaults=fingerprint_fields(value))
+
+
+def forget_fingerprint(item):
+    """Take ``item`` out of similarity lookups, e.g. once its photo is gone"""
+    PhotoFingerprint.objects.filter(item=item).delete()
+
+
+def similar_items(item, radius=DEFAULT_RADIUS, limit=6):
+    """
+    Other items whose photo is within ``radius`` bits of ``item``'s,
+    closest first, each with a ``photo_distance`` attribute.
+    """
+    try:
+        value = to_unsigned(item.photo_fingerprint.hash)
+    except PhotoFingerprint.DoesNotExist:
+        return []
+
+    sub_radius = radius // CHUNKS
+    buckets = Q()
+    for i, chunk in enumerate(split_chunks(value)):
+        buckets |= Q(**{f'chunk{i}__in': _neighbours(chunk, sub_radius)})
+
+    matches = []
+    candidates = PhotoFingerprint.objects.filter(buckets).exclude(item=item).select_related('item')
+    for fingerprint in candidates:
+        distance = hamming(value, to_unsigned(fingerprint.hash))
+        if distance <= radius:
+            fingerprint.item.photo_distance = distance
+            matches.append(fingerprint.item)
+    matches.sort(key=lambda match: match.photo_distance)
+    return matches[:limit]
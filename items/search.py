@@ -0,0 +1,207 @@
+"""
+Full-text search over Item title, description, category and location.
+
+SQLite uses an FTS5 external-content table kept in sync by triggers;
+PostgreSQL uses a generated ``tsvector`` column with a GIN index. Both
+are created by migration 0011 and maintained by the database itself, so
+saves, deletes and bulk writes can never leave the index stale.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+SEARCH_DEFAULTS = {
+    'SNIPPET_WORDS': 16,       # words of context around the match
+    'HIGHLIGHT_TAG': 'mark',   # element wrapped around matched terms
+    'RESULT_LIMIT': 100,       # max rows for relevance-ranked results
+}
+
+# Control characters the database wraps around matches; swapped for the
+# highlight tag only after the snippet text has been HTML-escaped.
+_START, _STOP = '\x02', '\x03'
+
+FTS_TABLE = 'items_item_fts'
+
+SQLITE_FTS_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS items_item_fts_ai AFTER INSERT ON items_item BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, description, category, location)
+        VALUES (new.id, new.title, new.description, new.category, new.location);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS items_item_fts_ad AFTER DELETE ON items_item BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, category, location)
+        VALUES ('delete', old.id, old.title, old.description, old.category, old.location);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS items_item_fts_au
+    AFTER UPDATE OF title, description, category, location ON items_item BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, category, location)
+        VALUES ('delete', old.id, old.title, old.description, old.category, old.location);
+        INSERT INTO {FTS_TABLE}(rowid, title, description, category, location)
+        VALUES (new.id, new.title, new.description, new.category, new.location);
+    END
+    """,
+]
+
+
+def search_settings():
+    """SEARCH_DEFAULTS overridden by settings.ITEM_SEARCH"""
+    return {**SEARCH_DEFAULTS, **getattr(settings, 'ITEM_SEARCH', {})}
+
+
+def tokenize(query):
+    """Split a user query into lowercase word tokens (drops all operators)"""
+    return re.findall(r'\w+', query.lower())
+
+
+def _highlight(raw):
+    """Escape a database snippet and turn the match markers into tags"""
+    tag = search_settings()['HIGHLIGHT_TAG']
+    html = escape(raw).replace(_START, f'<{tag}>').replace(_STOP, f'</{tag}>')
+    return mark_safe(html)
+
+
+def install_sqlite_triggers(conn):
+    """
+    (Re)create the FTS sync triggers.
+
+    SQLite drops a table's triggers whenever Django rebuilds that table
+    during a migration, so this also runs after every migrate.
+    """
+    with conn.cursor() as cursor:
+        for statement in SQLITE_FTS_TRIGGERS:
+            cursor.execute(statement)
+
+
+class SearchBackend:
+    """Plain ``icontains`` matching, for databases without a full-text index"""
+
+    def filter(self, queryset, query):
+        """Restrict ``queryset`` to items matching every word in ``query``"""
+        for token in tokenize(query):
+            queryset = queryset.filter(
+                Q(title__icontains=token) |
+                Q(description__icontains=token) |
+                Q(category__icontains=token) |
+                Q(location__icontains=token)
+            )
+        return queryset
+
+    def ranked(self, queryset, query, limit=None):
+        """Matching items, best match first"""
+        limit = limit or search_settings()['RESULT_LIMIT']
+        return list(self.filter(queryset, query).order_by('-created_at', '-id')[:limit])
+
+    def snippets(self, query, ids):
+        """Highlighted snippets for ``ids`` keyed by item id"""
+        return {}
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """FTS5 with bm25 ranking and prefix queries"""
+
+    def match_expression(self, query):
+        # Every token is quoted (so FTS syntax in user input is inert) and
+        # made a prefix query; FTS5 ANDs space-separated terms.
+        return ' '.join(f'"{token}"*' for token in tokenize(query))
+
+    def filter(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset
+        return queryset.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [expression]
+        ))
+
+    def ranked(self, queryset, query, limit=None):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        limit = limit or search_settings()['RESULT_LIMIT']
+        # FTS5 drives the scan through filter(); bm25() is then a rowid
+        # lookup per match. Weights: title, description, category, location.
+        ranking = RawSQL(
+            f"SELECT bm25({FTS_TABLE}, 10.0, 1.0, 4.0, 4.0) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid = items_item.id",
+            [expression],
+        )
+        return list(
+            self.filter(queryset, query)
+            .annotate(search_rank=ranking)
+            .order_by('search_rank', '-created_at')[:limit]
+        )
+
+    def snippets(self, query, ids):
+        expression = self.match_expression(query)
+        if not expression or not ids:
+            return {}
+        words = search_settings()['SNIPPET_WORDS']
+        placeholders = ', '.join(['%s'] * len(ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, snippet({FTS_TABLE}, -1, %s, %s, '…', %s) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s AND rowid IN ({placeholders})",
+                [_START, _STOP, words, expression, *ids],
+            )
+            return {pk: _highlight(text) for pk, text in cursor.fetchall()}
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Generated tsvector column + GIN index, ranked with ts_rank_cd"""
+
+    def tsquery(self, query):
+        return ' & '.join(f'{token}:*' for token in tokenize(query))
+
+    def filter(self, queryset, query):
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            return queryset
+        return queryset.filter(id__in=RawSQL(
+            "SELECT id FROM items_item WHERE search_vector @@ to_tsquery('simple', %s)", [tsquery]
+        ))
+
+    def ranked(self, queryset, query, limit=None):
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            return []
+        limit = limit or search_settings()['RESULT_LIMIT']
+        ranking = RawSQL(
+            "ts_rank_cd(items_item.search_vector, to_tsquery('simple', %s))", [tsquery]
+        )
+        return list(
+            self.filter(queryset, query)
+            .annotate(search_rank=ranking)
+            .order_by('-search_rank', '-created_at')[:limit]
+        )
+
+    def snippets(self, query, ids):
+        tsquery = self.tsquery(query)
+        if not tsquery or not ids:
+            return {}
+        words = int(search_settings()['SNIPPET_WORDS'])
+        options = f'StartSel={_START}, StopSel={_STOP}, MaxWords={words}, MinWords={max(words // 3, 1)}'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id, ts_headline('simple', "
+                "concat_ws(' ', title, description, category, location), "
+                "to_tsquery('simple', %s), %s) FROM items_item WHERE id = ANY(%s)",
+                [tsquery, options, list(ids)],
+            )
+            return {pk: _highlight(text) for pk, text in cursor.fetchall()}
+
+
+def get_search_backend():
+    """Search backend for the default database"""
+    if connection.vendor == 'sqlite':
+        return SQLiteSearchBackend()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return SearchBackend()
@@ -0,0 +1,190 @@
+"""
+Synthetic data for benchmarks, load tests and the seed_data command.
+
+Builders return unsaved instances for bulk_create(); everything random is
+drawn from the ``rng`` passed in, so a seed reproduces the same rows.
+"""
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+
+from .models import Item, Review
+
+User = get_user_model()
+
+SEED_EMAIL_DOMAIN = 'seed.invalid'
+
+ADJECTIVES = [
+    'black', 'blue', 'red', 'silver', 'white', 'green', 'small', 'large',
+    'leather', 'broken', 'new', 'old', 'striped', 'plastic', 'metal', 'pink',
+]
+
+OBJECTS = {
+    'Electronics': ['iPhone', 'Samsung phone', 'MacBook', 'laptop charger', 'AirPods', 'calculator', 'power bank', 'USB drive'],
+    'Keys': ['car keys', 'room key', 'keychain', 'locker key', 'bike key'],
+    'Books': ['textbook', 'notebook', 'calculus book', 'novel', 'lab manual', 'dictionary'],
+    'Clothing': ['hoodie', 'jacket', 'scarf', 'cap', 'sweater', 'umbrella'],
+    'ID/Cards': ['student ID', 'ATM card', 'library card', 'driver licence', 'meal card'],
+    'Bags': ['backpack', 'tote bag', 'laptop bag', 'purse', 'gym bag'],
+    'Other': ['water bottle', 'glasses', 'wristwatch', 'ring', 'headphones', 'lunch box'],
+}
+
+LOCATIONS = [
+    'Main Library', 'Science Cafe', 'Student Union', 'Engineering Block',
+    'Sports Complex', 'Lecture Theatre 1', 'Hostel A', 'Chapel', 'Medical Centre',
+    'Computer Lab', 'Car Park B', 'Faculty of Arts', 'Bus Stop',
+]
+
+PHRASES = [
+    'Last seen near the entrance.', 'Has a sticker on the back.',
+    'Left on a table after class.', 'Name written inside.',
+    'Found under a chair.', 'Has a small scratch on one side.',
+    'Please contact me if you have seen it.', 'Handed in at the front desk.',
+]
+
+
+def random_item_fields(rng):
+    """Realistic field values for one Item, drawn from ``rng``"""
+    category = rng.choice(list(OBJECTS))
+    obj = rng.choice(OBJECTS[category])
+    adjective = rng.choice(ADJECTIVES)
+    location = rng.choice(LOCATIONS)
+    return {
+        'item_type': rng.choice(['lost', 'found']),
+        'title': f'{adjective.title()} {obj}',
+        'category': category,
+        'location': location,
+        'description': f'{adjective.title()} {obj} around {location}. ' + ' '.join(rng.sample(PHRASES, 2)),
+    }
+
+
+def build_items(rng, posters, count):
+    """Unsaved Item instances ready for bulk_create()"""
+    return [
+        Item(poster=rng.choice(posters), **random_item_fields(rng))
+        for _ in range(count)
+    ]
+
+
+FIRST_NAMES = [
+    'Ada', 'Bola', 'Chidi', 'Dami', 'Efe', 'Funmi', 'Gbenga', 'Halima',
+    'Ife', 'Jide', 'Kemi', 'Lola', 'Musa', 'Ngozi', 'Ola', 'Tunde',
+]
+
+LAST_NAMES = [
+    'Adeyemi', 'Bello', 'Chukwu', 'Danjuma', 'Eze', 'Folarin', 'Garba',
+    'Ibrahim', 'Okafor', 'Okonkwo', 'Olawale', 'Uche', 'Yusuf',
+]
+
+REWARDS = ['N2,000 reward', 'N5,000 reward', 'Coffee on me!', 'Lunch on me', 'Small reward']
+
+VERIFICATION_QUESTIONS = [
+    'What colour is the case?', 'What is written on the back?',
+    'What is the lock screen picture?', 'Which keyring is attached?',
+]
+
+# Only found items are claimed and returned, as in the app
+FOUND_STATUS_WEIGHTS = {'active': 60, 'claimed': 25, 'returned': 15}
+
+RATING_WEIGHTS = {1: 3, 2: 4, 3: 10, 4: 33, 5: 50}
+
+REVIEW_COMMENTS = [
+    'Got my item back quickly, thank you!', 'Very honest and helpful.',
+    'Easy to arrange the handover.', 'Took a while to reply but all good.',
+    'Everything was there. Great person.',
+]
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Let bulk_create() keep the values set on the models' auto_now and
+    auto_now_add fields instead of stamping every row with now()
+    """
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def random_moment(rng, now, days):
+    """A time in the ``days`` before ``now``"""
+    return now - timedelta(seconds=rng.uniform(0, days * 24 * 60 * 60))
+
+
+def other_user_id(rng, user_ids, user_id):
+    """A user other than ``user_id``; needs at least two users"""
+    while True:
+        other_id = rng.choice(user_ids)
+        if other_id != user_id:
+            return other_id
+
+
+def build_users(rng, start, count, password, now, days):
+    """
+    Unsaved users numbered from ``start``, sharing one already hashed
+    ``password`` (hashing per user would dominate the run)
+    """
+    users = []
+    for n in range(start, start + count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        users.append(User(
+            email=f'user{n}@{SEED_EMAIL_DOMAIN}',
+            full_name=f'{first} {last}',
+            password=password,
+            is_verified_student=rng.random() < 0.7,
+            date_joined=random_moment(rng, now, days),
+        ))
+    return users
+
+
+def build_seed_items(rng, user_ids, count, now, days):
+    """
+    Unsaved Items with every field the forms fill in, spread over the
+    last ``days``. Claimed and returned items have a claimer who isn't the
+    poster. Create them inside explicit_timestamps(Item).
+    """
+    items = []
+    for _ in range(count):
+        poster_id = rng.choice(user_ids)
+        item = Item(
+            poster_id=poster_id,
+            created_at=random_moment(rng, now, days),
+            contact_preference=rng.choice(['email', 'phone', 'chat']),
+            **random_item_fields(rng),
+        )
+        if item.item_type == 'lost':
+            item.date_lost = (item.created_at - timedelta(days=rng.randint(0, 3))).date()
+            if rng.random() < 0.3:
+                item.reward_offered = rng.choice(REWARDS)
+        else:
+            item.verification_question = rng.choice(VERIFICATION_QUESTIONS)
+            item.status = rng.choices(list(FOUND_STATUS_WEIGHTS), list(FOUND_STATUS_WEIGHTS.values()))[0]
+            if item.status != 'active':
+                item.claimed_by_id = other_user_id(rng, user_ids, poster_id)
+        items.append(item)
+    return items
+
+
+def build_reviews(rng, items, rate, now):
+    """Unsaved Reviews by the claimer of about ``rate`` of the returned ``items``"""
+    return [
+        Review(
+            item=item,
+            reviewer_id=item.claimed_by_id,
+            rating=rng.choices(list(RATING_WEIGHTS), list(RATING_WEIGHTS.values()))[0],
+            comment=rng.choice(REVIEW_COMMENTS),
+            created_at=min(item.created_at + timedelta(days=rng.uniform(1, 5)), now),
+        )
+        for item in items
+        if item.status == 'returned' and rng.random() < rate
+    ]
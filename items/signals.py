@@ -0,0 +1,42 @@
+from django.db import connections
+
+from core.cache import invalidate_tags
+
+from .matching import engine
+from .photohash import forget_fingerprint
+from .search import FTS_TABLE, install_sqlite_triggers
+
+
+def restore_search_triggers(sender, using='default', **kwargs):
+    """Put back the FTS sync triggers if a migration rebuilt items_item"""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    if FTS_TABLE in connection.introspection.table_names():
+        install_sqlite_triggers(connection)
+
+
+def update_match_index(sender, instance, **kwargs):
+    engine.item_saved(instance)
+
+
+def remove_from_match_index(sender, instance, **kwargs):
+    engine.item_deleted(instance)
+
+
+def forget_removed_photo(sender, instance, created=False, **kwargs):
+    """An item whose photo was cleared shouldn't match on the old one"""
+    if not created and not instance.photo:
+        forget_fingerprint(instance)
+
+
+def invalidate_item(sender, instance, created=False, **kwargs):
+    tags = instance.cache_tags()
+    if not created:
+        # An edit may have moved it between the lost and found feeds
+        tags += ['feed:lost', 'feed:found']
+    invalidate_tags(*tags)
+
+
+def invalidate_review(sender, instance, **kwargs):
+    invalidate_tags(*instance.cache_tags())
@@ -0,0 +1,48 @@
+"""
+Per-user dashboard numbers.
+
+Every count the dashboard shows comes from one conditional aggregate over
+the items a user posted or claimed. The result is cached per user under
+the ``user:<id>:items`` tag, which Item and Review writes bump (see
+Item.cache_tags), so a dashboard view normally doesn't aggregate at all.
+"""
+from django.db.models import Count, Exists, OuterRef, Q
+
+from core.cache import get_cache
+
+from .models import Item, Review
+
+CACHE_TIMEOUT = 60 * 60  # invalidation keeps it fresh; this only bounds memory
+
+
+def cache_key(user_id):
+    return f'items:dashboard-stats:{user_id}'
+
+
+def compute_dashboard_stats(user_id):
+    reviewed = Review.objects.filter(item=OuterRef('pk'), reviewer_id=user_id)
+    posted = Q(poster_id=user_id)
+    stats = (
+        Item.objects.filter(posted | Q(claimed_by_id=user_id))
+        .aggregate(
+            total=Count('id', filter=posted),
+            lost=Count('id', filter=posted & Q(item_type='lost')),
+            found=Count('id', filter=posted & Q(item_type='found')),
+            active=Count('id', filter=posted & Q(status='active')),
+            claimed=Count('id', filter=posted & Q(status='claimed')),
+            returned=Count('id', filter=posted & Q(status='returned')),
+            to_review=Count('id', filter=Q(~Exists(reviewed), claimed_by_id=user_id, status='returned')),
+        )
+    )
+    stats['in_progress'] = stats['active'] + stats['claimed']
+    return stats
+
+
+def dashboard_stats(user_id):
+    """Dashboard numbers for ``user_id``, from the cache when possible"""
+    return get_cache().get_or_set(
+        cache_key(user_id),
+        lambda: compute_dashboard_stats(user_id),
+        CACHE_TIMEOUT,
+        tags=[f'user:{user_id}:items'],
+    )
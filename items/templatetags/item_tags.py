@@ -0,0 +1,11 @@
+from django import template
+
+from ..cards import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def item_cards(items):
+    """{% item_cards items as cards %} -> [(item, card HTML)], the cards read from the cache in bulk"""
+    return list(zip(items, render_cards(items)))
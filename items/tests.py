@@ -1,3 +1,1228 @@
-from django.test import TestCase
+import io
+import json
+import os
+import pstats
+import random
+import tempfile
+import re
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.template import engines
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from chats.models import Conversation, Message
+from core import middleware as core_middleware
+from core.cache import Entry, TieredCache, get_cache
+from core.profiling import stored_profiles
+from core.testing import QueryBudgetMixin
+from core.timing import RequestTimer
+
+from .cards import render_cards
+from .management.commands import bench_views
+from .matching import MatchIndex, engine as match_engine
+from .models import Item, PhotoFingerprint, Review
+from .pagination import paginate_keyset
+from .photohash import hamming, phash, save_fingerprint, similar_items
+from .search import get_search_backend
+from .seeding import SEED_EMAIL_DOMAIN, build_items
+from .stats import dashboard_stats
+
+User = get_user_model()
+
+
+def make_item(poster, **fields):
+    fields.setdefault('item_type', 'found')
+    fields.setdefault('title', 'Blue water bottle')
+    return Item.objects.create(poster=poster, **fields)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='poster@example.com', password='pass12345')
+        now = timezone.now()
+        for i in range(7):
+            item = make_item(cls.user, title=f'Item {i}')
+            # Pairs of items share a timestamp so the id tiebreaker is exercised
+            Item.objects.filter(pk=item.pk).update(created_at=now - timedelta(minutes=i // 2))
+
+    def setUp(self):
+        get_cache().clear()
+
+    def walk(self, descending):
+        seen, cursor = [], None
+        while True:
+            page = paginate_keyset(Item.objects.all(), cursor=cursor, per_page=3, descending=descending)
+            seen.extend(item.pk for item in page)
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_newest_first_visits_every_row_once(self):
+        expected = list(Item.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk(descending=True), expected)
+
+    def test_oldest_first_visits_every_row_once(self):
+        expected = list(Item.objects.order_by('created_at', 'id').values_list('id', flat=True))
+        self.assertEqual(self.walk(descending=False), expected)
+
+    @mock.patch('items.views.ITEMS_PER_PAGE', 3)
+    def test_home_feed_fragment_continues_from_cursor(self):
+        first = self.client.get(reverse('items:home'))
+        cursor = first.context['next_cursor']
+        self.assertIsNotNone(cursor)
+
+        response = self.client.get(reverse('items:home_feed'), {'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '<html')
+        first_ids = {item.pk for item in first.context['items']}
+        self.assertFalse(first_ids & {item.pk for item in response.context['items']})
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse('items:home_feed'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='poster@example.com', password='pass12345')
+        cls.laptop = make_item(cls.user, title='Silver MacBook Air', location='Main Library')
+        cls.keys = make_item(cls.user, title='Car keys', description='Toyota <b>keyfob</b> on a red lanyard')
+
+    def search(self, query):
+        return set(get_search_backend().filter(Item.objects.all(), query))
+
+    def test_prefix_match_across_fields(self):
+        self.assertEqual(self.search('macb libr'), {self.laptop})
+        self.assertEqual(self.search('lanyard'), {self.keys})
+
+    def test_index_follows_saves_and_deletes(self):
+        self.laptop.title = 'Dell XPS'
+        self.laptop.save()
+        self.assertEqual(self.search('macbook'), set())
+        self.assertEqual(self.search('dell'), {self.laptop})
+
+        self.keys.delete()
+        self.assertEqual(self.search('lanyard'), set())
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        snippet = get_search_backend().snippets('keyfob', [self.keys.id])[self.keys.id]
+        self.assertIn('<mark>keyfob</mark>', snippet)
+        self.assertIn('&lt;b&gt;', snippet)
+
+    def test_ranked_puts_title_matches_first(self):
+        keyring = make_item(self.user, title='Keyring', description='Found near the car park')
+        ranked = get_search_backend().ranked(Item.objects.filter(poster=self.user), 'car')
+        self.assertEqual(ranked, [self.keys, keyring])
+
+    def test_relevance_sort_on_home(self):
+        response = self.client.get(reverse('items:home'), {'q': 'keys', 'sort': 'relevance'})
+        self.assertEqual([item.pk for item in response.context['items']], [self.keys.pk])
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN every query the hot item views run against a seeded table and
+    fail on a full scan of items_item or a sort the index can't satisfy.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(3)
+        cls.users = [
+            User.objects.create_user(email=f'user{i}@example.com', password='pass12345')
+            for i in range(5)
+        ]
+        items = build_items(rng, cls.users, 400)
+        for item in items:
+            item.status = rng.choice(['active', 'active', 'claimed', 'returned'])
+            if item.status != 'active':
+                item.claimed_by = rng.choice(cls.users)
+        Item.objects.bulk_create(items)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        get_cache().clear()
+
+    def plan(self, sql, params=()):
+        explain = 'EXPLAIN' if connection.vendor == 'postgresql' else 'EXPLAIN QUERY PLAN'
+        with connection.cursor() as cursor:
+            cursor.execute(f'{explain} {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def bad_steps(self, sql, params=()):
+        """Plan steps that scan the whole item table or sort it"""
+        steps = self.plan(sql, params)
+        if connection.vendor == 'postgresql':
+            return [s for s in steps if re.search(r'Seq Scan on items_item\b|^\s*(->\s*)?Sort\b', s)]
+        return [s for s in steps if re.match(r'SCAN items_item$', s) or 'TEMP B-TREE' in s]
+
+    def assertIndexedPlans(self, url, params=None):
+        self.client.force_login(self.users[0])
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+
+        item_queries = [
+            q['sql'] for q in ctx.captured_queries
+            if q['sql'].startswith('SELECT') and '"items_item"' in q['sql']
+        ]
+        self.assertTrue(item_queries)
+        for sql in item_queries:
+            with self.subTest(sql=sql):
+                self.assertEqual(self.bad_steps(sql), [])
+
+    def test_home(self):
+        self.assertIndexedPlans(reverse('items:home'))
+        self.assertIndexedPlans(reverse('items:home'), {'type': 'lost'})
+        self.assertIndexedPlans(reverse('items:home'), {'type': 'found', 'sort': 'oldest'})
+
+    def test_home_next_page(self):
+        first = self.client.get(reverse('items:home'), {'type': 'lost'})
+        self.assertIndexedPlans(reverse('items:home_feed'), {'type': 'lost', 'cursor': first.context['next_cursor']})
+
+    def test_dashboard(self):
+        self.assertIndexedPlans(reverse('items:dashboard'))
+        self.assertIndexedPlans(reverse('items:dashboard'), {'filter': 'found'})
+
+    def test_active_items_by_type(self):
+        sql, params = Item.objects.filter(
+            status='active', item_type='found'
+        ).order_by('-created_at')[:10].query.sql_with_params()
+        self.assertEqual(self.bad_steps(sql, params), [])
+
+
+class MatchingTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        match_engine.reset()
+        self.owner = User.objects.create_user(email='owner@example.com', password='pass12345')
+        self.finder = User.objects.create_user(email='finder@example.com', password='pass12345')
+        self.lost = make_item(
+            self.owner, item_type='lost', title='Black iPhone 13',
+            category='Electronics', location='Main Library',
+            description='Black iPhone with a cracked screen protector',
+        )
+        self.phone = make_item(
+            self.finder, title='Black iPhone', category='Electronics',
+            location='Library second floor', description='Cracked screen protector, black case',
+        )
+        self.scarf = make_item(self.finder, title='Red wool scarf', category='Clothing', location='Chapel')
+
+    def test_finds_similar_items_of_the_opposite_type(self):
+        self.assertEqual(match_engine.find_matches(self.lost), [self.phone])
+
+    def test_index_follows_new_and_claimed_items(self):
+        match_engine.find_matches(self.lost)  # build the index
+        newer = make_item(self.finder, title='iPhone 13 black', category='Electronics')
+        self.assertIn(newer, match_engine.find_matches(self.lost))
+
+        Item.objects.filter(pk=newer.pk).update(status='claimed')
+        newer.refresh_from_db()
+        newer.save()
+        self.assertNotIn(newer, match_engine.find_matches(self.lost))
+
+    def test_stale_index_is_rebuilt_in_the_background(self):
+        match_engine.find_matches(self.lost)  # build the index
+        match_engine.indexes['found'].built_at -= 3600
+        self.addCleanup(match_engine.rebuilding.clear)
+        with mock.patch('items.matching.threading.Thread') as thread:
+            self.assertEqual(match_engine.find_matches(self.lost), [self.phone])
+            self.assertEqual(match_engine.find_matches(self.lost), [self.phone])
+        thread.assert_called_once()
+
+    def test_saves_during_a_rebuild_reach_the_new_index(self):
+        match_engine.find_matches(self.lost)
+        saved = []
+        build = MatchIndex.build
+
+        def build_after_a_save(index, rows):
+            rows = list(rows)
+            saved.append(make_item(self.finder, title='iPhone 13 black', category='Electronics'))
+            build(index, rows)
+
+        with mock.patch.object(MatchIndex, 'build', build_after_a_save):
+            match_engine.build('found')
+        self.assertIn(saved[0], match_engine.find_matches(self.lost))
+
+    def test_no_items_of_the_opposite_type(self):
+        Item.objects.filter(item_type='found').delete()
+        match_engine.reset()
+        self.assertEqual(match_engine.find_matches(self.lost), [])
+
+    def test_item_detail_lists_matches(self):
+        response = self.client.get(reverse('items:item_detail', args=[self.lost.id]))
+        self.assertEqual(response.context['matches'], [self.phone])
+        self.assertContains(response, 'Possible Matches')
+
+
+class ClaimTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.poster = User.objects.create_user(email='poster@example.com', password='pass12345')
+        self.first = User.objects.create_user(email='first@example.com', password='pass12345')
+        self.second = User.objects.create_user(email='second@example.com', password='pass12345')
+        self.item = make_item(self.poster, title='Grey laptop sleeve')
+
+    def claim(self, user):
+        self.client.force_login(user)
+        response = self.client.post(reverse('items:claim_item', args=[self.item.id]), follow=True)
+        return [str(message) for message in response.context['messages']]
+
+    def test_claim_is_one_conditional_update_of_two_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(Item.objects.claim(self.item.id, self.first.id))
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql']
+        self.assertRegex(sql, r'^UPDATE')
+        self.assertIn('"status" = \'active\'', sql.split('WHERE', 1)[1])
+        self.assertNotIn('"title"', sql)
+
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.status, self.item.claimed_by), ('claimed', self.first))
+
+    def test_only_the_first_claimer_wins(self):
+        self.assertIn('Item claimed! Please contact the poster to arrange pickup.', self.claim(self.first))
+        self.assertIn('This item has already been claimed.', self.claim(self.second))
+        self.assertIn('You have already claimed this item.', self.claim(self.first))
+
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.claimed_by, self.first)
+
+    def test_posters_cannot_claim_their_own_items(self):
+        self.assertFalse(Item.objects.claim(self.item.id, self.poster.id))
+        self.assertIn("You can't claim your own item!", self.claim(self.poster))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.status, 'active')
+
+    def test_claimed_items_leave_the_match_index(self):
+        match_engine.reset()
+        lost = make_item(self.first, item_type='lost', title='Grey laptop sleeve')
+        self.assertEqual(match_engine.find_matches(lost), [self.item])
+        self.claim(self.second)
+        self.assertEqual(match_engine.find_matches(lost), [])
+
+    def test_only_claimed_items_can_be_marked_returned(self):
+        self.client.force_login(self.poster)
+        url = reverse('items:mark_as_returned', args=[self.item.id])
+        self.client.post(url)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.status, 'active')
+
+        Item.objects.claim(self.item.id, self.first.id)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(Item.objects.mark_returned(self.item.id))
+        self.assertNotIn('claimed_by', queries[0]['sql'])
+        self.assertFalse(Item.objects.mark_returned(self.item.id))
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.status, 'returned')
+
+
+class DashboardTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.poster = User.objects.create_user(email='poster@example.com', password='pass12345')
+        self.claimer = User.objects.create_user(email='claimer@example.com', password='pass12345')
+        self.client.force_login(self.poster)
+
+    def dashboard(self):
+        response = self.client.get(reverse('items:dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_stats_are_one_query(self):
+        make_item(self.poster, item_type='lost')
+        claimed = make_item(self.poster)
+        make_item(self.claimer)
+        Item.objects.claim(claimed.id, self.claimer.id)
+        with CaptureQueriesContext(connection) as queries:
+            stats = dashboard_stats(self.poster.id)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(
+            {key: stats[key] for key in ('total', 'lost', 'found', 'active', 'claimed', 'returned', 'in_progress')},
+            {'total': 2, 'lost': 1, 'found': 1, 'active': 1, 'claimed': 1, 'returned': 0, 'in_progress': 2},
+        )
+
+    def test_query_count_does_not_grow_with_items(self):
+        # Session, user, stats (cold cache only), listings
+        for count in (1, 20):
+            for _ in range(count):
+                item = make_item(self.poster)
+            Item.objects.claim(item.id, self.claimer.id)
+            get_cache().clear()
+            with self.assertNumQueries(4):
+                self.dashboard()
+            with self.assertNumQueries(3):
+                self.dashboard()
+
+    def test_reviews_prompt_costs_one_more_query(self):
+        for _ in range(3):
+            item = make_item(self.claimer)
+            Item.objects.claim(item.id, self.poster.id)
+            Item.objects.mark_returned(item.id)
+        get_cache().clear()
+        with self.assertNumQueries(5):
+            response = self.dashboard()
+        self.assertContains(response, 'You have 3 items waiting for your review.')
+
+    def test_claim_return_and_review_invalidate_the_summary(self):
+        item = make_item(self.poster)
+        self.assertEqual(dashboard_stats(self.poster.id)['active'], 1)
+
+        self.client.force_login(self.claimer)
+        self.assertEqual(dashboard_stats(self.claimer.id)['to_review'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('items:claim_item', args=[item.id]))
+        self.assertEqual(dashboard_stats(self.poster.id)['claimed'], 1)
+
+        self.client.force_login(self.poster)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('items:mark_as_returned', args=[item.id]))
+        self.assertEqual(dashboard_stats(self.poster.id)['returned'], 1)
+        self.assertEqual(dashboard_stats(self.claimer.id)['to_review'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(item=item, reviewer=self.claimer, rating=5)
+        self.assertEqual(dashboard_stats(self.claimer.id)['to_review'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+        self.assertEqual(dashboard_stats(self.poster.id)['total'], 0)
+
+    def test_in_progress_counts_unreturned_items(self):
+        make_item(self.poster)
+        returned = make_item(self.poster)
+        Item.objects.claim(returned.id, self.claimer.id)
+        Item.objects.mark_returned(returned.id)
+        response = self.dashboard()
+        self.assertEqual(
+            [response.context['stats'][key] for key in ('total', 'returned', 'in_progress')], [2, 1, 1]
+        )
+
+
+class ItemDetailQueryTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.poster = User.objects.create_user(email='poster@example.com', password='pass12345')
+        self.claimer = User.objects.create_user(email='claimer@example.com', password='pass12345')
+        self.item = make_item(self.poster, title='Reviewed umbrella')
+        Item.objects.claim(self.item.id, self.claimer.id)
+        Item.objects.mark_returned(self.item.id)
+        self.url = reverse('items:item_detail', args=[self.item.id])
+
+    def add_reviews(self, count):
+        start = self.item.reviews.count()
+        reviewers = User.objects.bulk_create([
+            User(email=f'reviewer{i}@example.com', password='!') for i in range(start, start + count)
+        ])
+        Review.objects.bulk_create([
+            Review(item=self.item, reviewer=reviewer, rating=5, comment=f'Review {i}')
+            for i, reviewer in enumerate(reviewers)
+        ])
+
+    def test_query_count_does_not_grow_with_reviews(self):
+        # Session, user, item with its people, reviews with their reviewers
+        self.client.force_login(self.claimer)
+        for count in (0, 10, 90):
+            self.add_reviews(count)
+            get_cache().clear()
+            with self.assertNumQueries(4):
+                response = self.client.get(self.url)
+            self.assertContains(response, '<p class="text-gray-700">Review ', count=self.item.reviews.count())
+            # Warm, only the session and user
+            with self.assertNumQueries(2):
+                self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(self.item.reviews.count(), 100)
+
+    def test_review_prompt_uses_the_prefetched_reviews(self):
+        self.add_reviews(3)
+        self.client.force_login(self.claimer)
+        self.assertContains(self.client.get(self.url), 'Share Your Experience')
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(item=self.item, reviewer=self.claimer, rating=4, comment='Thanks')
+        self.assertNotContains(self.client.get(self.url), 'Share Your Experience')
+
+
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        self.shared = LocMemCache('tiered-cache-tests', {})
+        self.shared.clear()
+        self.cache = TieredCache(self.shared, local_max_entries=2, local_ttl=60, lock_wait=1.0)
+
+    def test_reads_go_local_then_shared(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', 1, 60)
+        self.assertEqual(self.cache.get('a'), 1)
+
+        other_process = TieredCache(self.shared)
+        self.assertEqual(other_process.get('a'), 1)
+        self.assertEqual(other_process.get('a'), 1)
+
+        self.assertEqual(self.cache.stats()['local_hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(
+            [other_process.stats()[key] for key in ('shared_hits', 'local_hits', 'hit_ratio')], [1, 1, 1.0]
+        )
+
+    def test_local_tier_evicts_least_recently_used(self):
+        for key in 'abc':
+            self.cache.set(key, key, 60)
+        self.assertEqual(self.cache.stats()['local_evictions'], 1)
+        self.assertEqual(len(self.cache.local), 2)
+        self.assertIsNone(self.cache.local.get('a'))
+        # Still in the shared tier
+        self.assertEqual(self.cache.get('a'), 'a')
+
+    def test_local_hits_are_copies(self):
+        value = {'titles': ['a']}
+        self.cache.set('a', value, 60)
+        value['titles'].append('set, then changed')
+        self.cache.get('a')['titles'].append('read, then changed')
+        self.assertEqual(self.cache.get('a'), {'titles': ['a']})
+        self.assertEqual(self.cache.stats()['local_hits'], 2)
+
+    def test_tests_have_a_cache_directory_of_their_own(self):
+        self.assertNotEqual(get_cache().shared._dir, os.path.join(tempfile.gettempdir(), 'campusfound-cache'))
+
+    # A median draw, so the head start is cost * beta * ln 2
+    @mock.patch('core.cache.random.random', return_value=0.5)
+    def test_expensive_values_are_recomputed_early(self, _random):
+        self.cache.set('a', 'old', 60, cost=0.001)
+        self.assertEqual(self.cache.get_or_set('a', lambda: 'new', 60), 'old')
+
+        # Ten seconds to expiry is nothing for a value that takes a minute to compute
+        self.cache.set('a', 'old', 10, cost=60)
+        self.assertEqual(self.cache.get_or_set('a', lambda: 'new', 60), 'new')
+        self.assertEqual(self.cache.stats()['early_recomputes'], 1)
+
+    def test_bulk_reads_respect_tags(self):
+        self.cache.set_many({'a': (1, ['x']), 'b': (2, ['y']), 'c': (3, [])}, 60)
+        self.cache.local.clear()
+        tagged_keys = {'a': ['x'], 'b': ['y'], 'c': [], 'd': []}
+        with mock.patch.object(self.shared, 'get_many', wraps=self.shared.get_many) as get_many:
+            self.assertEqual(self.cache.get_many(tagged_keys), {'a': 1, 'b': 2, 'c': 3})
+        # Tag versions, then the entries
+        self.assertEqual(get_many.call_count, 2)
+
+        self.cache.bump_tags(['y'])
+        self.assertEqual(self.cache.get_many(tagged_keys), {'a': 1, 'c': 3})
+
+    def test_hot_tagged_reads_stay_local(self):
+        cache = TieredCache(self.shared)
+        cache.set('a', 1, 60, tags=['x', 'y'])
+        with mock.patch.object(self.shared, 'get_many') as get_many, mock.patch.object(self.shared, 'get') as get:
+            self.assertEqual(cache.get('a', tags=['x', 'y']), 1)
+            self.assertEqual(cache.get_or_set('a', lambda: 2, 60, tags=['x', 'y']), 1)
+        get_many.assert_not_called()
+        get.assert_not_called()
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        barrier = threading.Barrier(8)
+        results = []
+
+        def reader():
+            barrier.wait()
+            results.append(self.cache.get_or_set('hot', compute, 60))
+
+        threads = [threading.Thread(target=reader) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(self.cache.stats()['lock_waits'], 7)
+
+    def test_expired_value_is_served_while_another_worker_recomputes(self):
+        self.shared.set('hot', Entry('stale', time.time() - 1, 0.0), 60)
+        self.shared.add('hot:recompute-lock', 1, 30)
+        self.assertEqual(self.cache.get_or_set('hot', lambda: 'fresh', 60), 'stale')
+        self.assertEqual(self.cache.stats()['stale_served'], 1)
+
+        self.shared.delete('hot:recompute-lock')
+        self.cache.local.clear()
+        self.assertEqual(self.cache.get_or_set('hot', lambda: 'fresh', 60), 'fresh')
+
+    def test_bumping_a_tag_invalidates_every_process(self):
+        other_process = TieredCache(self.shared, local_ttl=0.2)
+        for cache in (self.cache, other_process):
+            self.assertEqual(cache.get_or_set('item', lambda: 'v1', 60, tags=['item:1', 'feed:lost']), 'v1')
+        self.assertEqual(other_process.get('item', tags=['item:1', 'feed:lost']), 'v1')
+
+        self.cache.bump_tags(['feed:lost'])
+        self.assertIsNone(self.cache.get('item', tags=['item:1', 'feed:lost']))
+        # Other processes trust the versions they read for up to local_ttl
+        self.assertEqual(other_process.get('item', tags=['item:1', 'feed:lost']), 'v1')
+        time.sleep(0.25)
+        self.assertIsNone(other_process.get('item', tags=['item:1', 'feed:lost']))
+        self.assertEqual(other_process.get_or_set('item', lambda: 'v2', 60, tags=['item:1', 'feed:lost']), 'v2')
+        self.assertEqual(self.cache.get('item', tags=['item:1', 'feed:lost']), 'v2')
+        self.assertTrue(other_process.stats()['invalidated'])
+
+    def test_evicted_tag_versions_invalidate_rather_than_revive(self):
+        self.cache.set('item', 'v1', 60, tags=['item:1'])
+        self.shared.delete('tag-version:item:1')
+        self.cache.local.clear()
+        self.assertIsNone(self.cache.get('item', tags=['item:1']))
+
+    def test_stats_view_is_staff_only(self):
+        user = User.objects.create_user(email='user@example.com', password='pass12345')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('cache_stats')).status_code, 302)
+
+        user.is_staff = True
+        user.save()
+        response = self.client.get(reverse('cache_stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('local_evictions', response.json())
+
+
+class ItemCardTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.poster = User.objects.create_user(email='poster@example.com', password='pass12345')
+        self.item = make_item(self.poster, title='Carded umbrella', location='Library')
+        self.client.force_login(self.poster)
+
+    def test_cards_are_rendered_once(self):
+        first = render_cards([self.item])
+        with mock.patch('items.cards.render_to_string') as render_to_string:
+            self.assertEqual(render_cards([self.item]), first)
+        render_to_string.assert_not_called()
+        self.assertIn('Carded umbrella', first[0])
+        self.assertIn('Library', first[0])
+
+    def test_relative_time_and_snippet_are_filled_per_render(self):
+        render_cards([self.item])
+        self.item.created_at = timezone.now() - timedelta(days=3)
+        self.item.search_snippet = 'left by the <door>'
+        card = render_cards([self.item])[0]
+        self.assertIn('3\xa0days ago', card)
+        self.assertIn('left by the &lt;door&gt;', card)
+        self.assertNotIn('\x00', card)
+
+    def test_edits_rerender_the_card(self):
+        self.assertContains(self.client.get(reverse('items:home')), 'Carded umbrella')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.title = 'Carded parasol'
+            self.item.save()
+        self.assertNotIn('Carded umbrella', render_cards([self.item])[0])
+
+    def test_pages_and_dashboard_share_cards(self):
+        make_item(self.poster, title='Carded kettle')
+        self.client.get(reverse('items:home'))
+        get_cache().local.clear()
+        shared = get_cache().shared
+        with mock.patch.object(shared, 'get_many', wraps=shared.get_many) as get_many, \
+                mock.patch('items.cards.render_to_string') as render_to_string:
+            response = self.client.get(reverse('items:dashboard'))
+        self.assertContains(response, 'Carded kettle')
+        render_to_string.assert_not_called()
+        card_reads = [keys for (keys,), _ in get_many.call_args_list if any('items:card:' in k for k in keys)]
+        self.assertEqual(len(card_reads), 1)
+
+
+class FeedCacheTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(email='poster@example.com', password='pass12345')
+        make_item(self.user, title='Cached umbrella')
+        # Logged out, the whole page would come from the anonymous page cache
+        self.client.force_login(self.user)
+
+    def item_queries(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('items:home'), params or {})
+        self.assertContains(response, 'Cached umbrella')
+        return [q['sql'] for q in queries if '"items_item"' in q['sql']]
+
+    def test_first_page_is_cached(self):
+        self.assertTrue(self.item_queries())
+        self.assertEqual(self.item_queries(), [])
+        self.assertEqual(self.item_queries({'sort': 'newest', 'junk': 'x'}), [])
+        # A different filter is a different page
+        self.assertTrue(self.item_queries({'type': 'found'}))
+
+    def test_searches_are_not_cached(self):
+        self.item_queries({'q': 'umbrella'})
+        self.assertTrue(self.item_queries({'q': 'umbrella'}))
+
+
+class AnonymousPageCacheTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.poster = User.objects.create_user(email='poster@example.com', password='pass12345')
+        self.claimer = User.objects.create_user(email='claimer@example.com', password='pass12345')
+        self.item = make_item(self.poster, title='Cached umbrella')
+
+    def get(self, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('items:home'), params or {})
+        return response, len(queries)
+
+    def test_second_visit_runs_no_queries(self):
+        response, cold = self.get()
+        self.assertTrue(cold)
+        response, warm = self.get()
+        self.assertEqual(warm, 0)
+        self.assertContains(response, 'Cached umbrella')
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=30', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_equivalent_parameters_share_a_page(self):
+        self.get({'type': 'found', 'q': 'umbrella'})
+        for params in [
+            {'type': 'found', 'q': '  umbrella ', 'junk': 'x'},
+            {'type': 'found', 'q': 'umbrella', 'sort': 'bogus'},
+        ]:
+            self.assertEqual(self.get(params)[1], 0, params)
+        self.assertTrue(self.get({'type': 'lost', 'q': 'umbrella'})[1])
+        self.assertTrue(self.get({'type': 'found', 'q': 'umbrella', 'sort': 'oldest'})[1])
+
+    def test_logged_in_pages_are_private(self):
+        self.get()
+        self.client.force_login(self.poster)
+        response, queries = self.get()
+        self.assertTrue(queries)
+        self.assertContains(response, 'Logout')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_new_items_and_claims_show_up(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            make_item(self.poster, title='Red kettle')
+        self.assertContains(self.get()[0], 'Red kettle')
+
+        self.client.force_login(self.claimer)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('items:claim_item', args=[self.item.id]))
+        self.client.logout()
+        self.assertTrue(self.get()[1])
+
+    def test_errors_are_not_cached(self):
+        for _ in range(2):
+            response = self.get({'cursor': 'garbage'})[0]
+            self.assertEqual(response.status_code, 400)
+            self.assertNotIn('public', response.get('Cache-Control', ''))
+
+    def test_can_be_switched_off(self):
+        self.get()
+        with self.settings(CACHE_LAYER={'ANONYMOUS_PAGES': False}):
+            response = self.get()[0]
+        self.assertIn('private', response['Cache-Control'])
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.poster = User.objects.create_user(email='poster@example.com', password='pass12345')
+        self.visitor = User.objects.create_user(email='visitor@example.com', password='pass12345')
+        self.item = make_item(self.poster, title='Tagged umbrella')
+        self.detail_url = reverse('items:item_detail', args=[self.item.id])
+
+    def revalidate(self, url, response):
+        """Ask for ``url`` again with the ETag of an earlier ``response``"""
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_feed_is_not_rendered(self):
+        home = reverse('items:home')
+        first = self.client.get(home)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.revalidate(home, first).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_item(self.poster, title='Tagged kettle')
+        again = self.revalidate(home, first)
+        self.assertContains(again, 'Tagged kettle')
+        self.assertNotEqual(again['ETag'], first['ETag'])
+
+    def test_feed_etag_follows_its_filter(self):
+        lost = reverse('items:home') + '?type=lost'
+        first = self.client.get(lost)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_item(self.poster, item_type='found', title='Tagged scarf')
+        self.assertEqual(self.revalidate(lost, first).status_code, 304)
+
+    def test_item_detail_changes_with_reviews_and_other_items(self):
+        self.client.force_login(self.visitor)
+        # The first visit sets the CSRF cookie the page's forms rely on
+        self.client.get(self.detail_url)
+        first = self.client.get(self.detail_url)
+        self.assertEqual(self.revalidate(self.detail_url, first).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(item=self.item, reviewer=self.visitor, comment='Thanks!', rating=5)
+        second = self.revalidate(self.detail_url, first)
+        self.assertEqual(second.status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_item(self.poster, item_type='lost', title='Lost umbrella')
+        self.assertEqual(self.revalidate(self.detail_url, second).status_code, 200)
+
+    def test_etags_are_per_visitor(self):
+        first = self.client.get(self.detail_url)
+        self.client.force_login(self.visitor)
+        self.assertEqual(self.revalidate(self.detail_url, first).status_code, 200)
+
+    def test_missing_items_are_still_404(self):
+        self.assertEqual(self.client.get(reverse('items:item_detail', args=[self.item.id + 1])).status_code, 404)
+
+
+class CacheInvalidationTests(TestCase):
+    """Every cached item view shows a write on its next read"""
+
+    def setUp(self):
+        get_cache().clear()
+        self.poster = User.objects.create_user(email='poster@example.com', password='pass12345')
+        self.claimer = User.objects.create_user(email='claimer@example.com', password='pass12345')
+        self.item = make_item(self.poster, title='Green scarf')
+
+    def home(self, **params):
+        return self.client.get(reverse('items:home'), params).content.decode()
+
+    def detail(self):
+        return self.client.get(reverse('items:item_detail', args=[self.item.id])).content.decode()
+
+    def post(self, name, data=None):
+        """POST to an item view and run its after-commit invalidation"""
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse(name, args=[self.item.id]), data or {})
+
+    def test_feed_shows_new_edited_and_deleted_items(self):
+        self.assertIn('Green scarf', self.home())
+        self.assertNotIn('Green scarf', self.home(type='lost'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_item(self.poster, title='Red kettle')
+        self.assertIn('Red kettle', self.home())
+
+        self.client.force_login(self.poster)
+        self.post('items:edit_item', {'item_type': 'lost', 'title': 'Teal scarf', 'date_lost': '2026-10-01'})
+        self.assertIn('Teal scarf', self.home(type='lost'))
+        self.assertNotIn('scarf', self.home(type='found'))
+
+        self.post('items:delete_item')
+        self.assertNotIn('Teal scarf', self.home())
+        self.assertNotIn('Teal scarf', self.home(type='lost'))
+
+    def test_detail_shows_claims_returns_and_reviews(self):
+        self.client.force_login(self.poster)
+        self.assertNotIn('Claimed by', self.detail())
+
+        self.client.force_login(self.claimer)
+        self.post('items:claim_item')
+        self.client.force_login(self.poster)
+        self.assertIn('Claimed by', self.detail())
+
+        self.post('items:mark_as_returned')
+        self.assertNotIn('Claimed by', self.detail())
+
+        self.client.force_login(self.claimer)
+        self.post('items:add_review', {'rating': 5, 'comment': 'Spotless handover'})
+        self.assertIn('Spotless handover', self.detail())
+
+    def test_detail_of_a_deleted_item_is_gone(self):
+        url = reverse('items:item_detail', args=[self.item.id])
+        self.assertEqual(self.client.get(url).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_dashboard_shows_a_new_item(self):
+        self.client.force_login(self.poster)
+        self.assertEqual(self.client.get(reverse('items:dashboard')).context['stats']['total'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            make_item(self.poster)
+        self.assertEqual(self.client.get(reverse('items:dashboard')).context['stats']['total'], 2)
+
+
+@override_settings(REQUEST_TIMING={'SAMPLE_RATE': 1.0})
+class ServerTimingTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user(email='student@example.com', password='pass12345')
+        self.item = make_item(self.user)
+        self.client.force_login(self.user)
+
+    def metrics(self, response):
+        return {
+            name: dict(param.split('=', 1) for param in params)
+            for name, *params in (metric.split(';') for metric in response['Server-Timing'].split(', '))
+        }
+
+    def test_header_and_log_line(self):
+        url = reverse('items:item_detail', args=[self.item.id])
+        with self.assertLogs('core.timing', 'INFO') as logs, CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        metrics = self.metrics(response)
+        self.assertEqual(metrics['db']['desc'], f'"{len(queries)} queries"')
+        self.assertGreater(float(metrics['template']['dur']), 0)
+        self.assertGreaterEqual(float(metrics['total']['dur']), float(metrics['db']['dur']))
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(logs.records[0].timing, record)
+        self.assertEqual((record['view'], record['status'], record['queries']), ('items:item_detail', 200, len(queries)))
+
+    def test_cache_hits_are_counted_per_request(self):
+        url = reverse('items:item_detail', args=[self.item.id])
+        with self.assertLogs('core.timing', 'INFO'):
+            cold = self.metrics(self.client.get(url))['cache']['desc']
+            warm = self.metrics(self.client.get(url))['cache']['desc']
+        self.assertEqual(cold, '"0/1 hits"')
+        self.assertEqual(warm, '"1/1 hits"')
+
+    def test_nested_renders_are_timed_once(self):
+        [engine] = engines.all()
+        slow = engine.from_string('{{ wait }}')
+        page = engine.from_string('{{ card }}')
+        timer = RequestTimer()
+        with timer.activate():
+            start = time.perf_counter()
+            page.render({'card': lambda: slow.render({'wait': lambda: time.sleep(0.05) or 'card'})})
+            elapsed = time.perf_counter() - start
+        self.assertEqual(timer.template_depth, 0)
+        self.assertLessEqual(timer.durations['template'], elapsed)
+
+    @override_settings(REQUEST_TIMING={'SAMPLE_RATE': 0.0})
+    def test_unsampled_requests_are_left_alone(self):
+        with self.assertNoLogs('core.timing'):
+            response = self.client.get(reverse('items:home'))
+        self.assertNotIn('Server-Timing', response)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(PROFILING={'DIRECTORY': self.directory, 'SAMPLE_RATE': 0.0})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(email='student@example.com', password='pass12345')
+        self.item = make_item(self.user)
+        self.url = reverse('items:item_detail', args=[self.item.id])
+
+    def profiles(self, *args, **options):
+        out = io.StringIO()
+        call_command('profiles', *args, directory=self.directory, stdout=out, **options)
+        return out.getvalue()
+
+    def test_a_signed_header_profiles_the_view(self):
+        token = self.profiles('token').split(': ', 1)[1].strip()
+        response = self.client.get(self.url, HTTP_X_PROFILE=token)
+        [meta] = stored_profiles(self.directory)
+        self.assertEqual(response['X-Profile-Id'], meta['id'])
+        self.assertEqual((meta['view'], meta['status'], meta['reason']), ('items:item_detail', 200, 'token'))
+        functions = {function for _, _, function in pstats.Stats(meta['path']).stats}
+        self.assertIn('item_detail', functions)
+        self.assertIn('render', functions)
+
+        self.client.get(self.url, HTTP_X_PROFILE=token[:-1] + 'x')
+        self.assertEqual(len(stored_profiles(self.directory)), 1)
+
+    def test_staff_ask_with_a_parameter(self):
+        self.client.force_login(self.user)
+        self.client.get(self.url, {'profile': 1})
+        self.assertEqual(stored_profiles(self.directory), [])
+
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        self.assertIn('X-Profile-Id', self.client.get(self.url, {'profile': 1}))
+        self.assertNotIn('X-Profile-Id', self.client.get(self.url))
+
+    def test_one_profile_at_a_time(self):
+        token = self.profiles('token').split(': ', 1)[1].strip()
+        # Another request is being profiled
+        with core_middleware._profiling_lock:
+            response = self.client.get(self.url, HTTP_X_PROFILE=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+
+        # Another profiling tool is active (cProfile raises on Python 3.12+)
+        with mock.patch('cProfile.Profile.enable', side_effect=ValueError('Another profiling tool is already active')):
+            response = self.client.get(self.url, HTTP_X_PROFILE=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(stored_profiles(self.directory), [])
+
+        self.assertIn('X-Profile-Id', self.client.get(self.url, HTTP_X_PROFILE=token))
+
+    def test_sampling(self):
+        with override_settings(PROFILING={'DIRECTORY': self.directory, 'SAMPLE_RATE': 1.0}):
+            self.client.get(reverse('items:home'))
+        self.assertEqual(stored_profiles(self.directory)[0]['reason'], 'sampled')
+
+    def test_list_aggregate_and_prune(self):
+        with override_settings(PROFILING={'DIRECTORY': self.directory, 'SAMPLE_RATE': 1.0}):
+            for _ in range(3):
+                self.client.get(self.url)
+            self.client.get(reverse('items:home'))
+
+        listing = self.profiles('list', view='items:item_detail')
+        self.assertIn('3 profiles', listing)
+        self.assertNotIn('items:home', listing)
+
+        merged = os.path.join(self.directory, 'merged.out')
+        report = self.profiles('aggregate', view='items:item_detail', output=merged, limit=5)
+        self.assertIn('item_detail', report)
+        self.assertEqual(pstats.Stats(merged).total_calls, sum(
+            pstats.Stats(meta['path']).total_calls for meta in stored_profiles(self.directory)
+            if meta['view'] == 'items:item_detail'
+        ))
+
+        self.assertIn('Deleted 2 of 4', self.profiles('prune', keep=2))
+        self.assertEqual(len(os.listdir(self.directory)), 2 * 2 + 1)
+        self.assertIn('Deleted 2 of 2', self.profiles('prune', older_than=0))
+        with self.assertRaisesMessage(CommandError, '--keep'):
+            self.profiles('prune')
+
+
+class PhotoHashTests(TestCase):
+    @staticmethod
+    def image(size=(256, 256), seed=0):
+        rng = np.random.default_rng(seed)
+        pixels = rng.integers(0, 255, (8, 8, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).resize(size, Image.Resampling.BILINEAR).save(buffer, 'JPEG')
+        buffer.seek(0)
+        return buffer
+
+    def test_hash_survives_resizing(self):
+        self.assertLessEqual(hamming(phash(self.image()), phash(self.image(size=(640, 480)))), 6)
+        self.assertGreater(hamming(phash(self.image()), phash(self.image(seed=1))), 12)
+
+    def test_similar_items_uses_the_chunk_index(self):
+        user = User.objects.create_user(email='poster@example.com', password='pass12345')
+        original, near, far = (make_item(user, title=title) for title in ('Original', 'Near', 'Far'))
+        value = phash(self.image())
+        save_fingerprint(original, value)
+        save_fingerprint(near, value ^ 0b1011)             # 3 bits away
+        save_fingerprint(far, value ^ ((1 << 64) - 1))     # every bit flipped
+
+        original.refresh_from_db()
+        matches = similar_items(original)
+        self.assertEqual(matches, [near])
+        self.assertEqual(matches[0].photo_distance, 3)
+
+    def test_clearing_the_photo_drops_the_fingerprint(self):
+        user = User.objects.create_user(email='poster@example.com', password='pass12345')
+        original = make_item(user, title='Original', photo='campusfound/items/original')
+        near = make_item(user, title='Near', photo='campusfound/items/near')
+        value = phash(self.image())
+        save_fingerprint(original, value)
+        save_fingerprint(near, value ^ 0b1011)
+        self.assertEqual(similar_items(near), [original])
+
+        original.photo = None
+        original.save()
+        self.assertFalse(PhotoFingerprint.objects.filter(item=original).exists())
+        self.assertEqual(similar_items(near), [])
+
+
+class SeedDataTests(TestCase):
+    def seed(self, **options):
+        call_command('seed_data', users=30, items=400, batch_size=150, conversation_rate=0.5, seed=7,
+                     stdout=io.StringIO(), **options)
+        return Item.objects.filter(poster__email__endswith=f'@{SEED_EMAIL_DOMAIN}')
+
+    def test_rows_look_like_the_app_made_them(self):
+        items = self.seed()
+        self.assertEqual(items.count(), 400)
+        self.assertEqual(set(items.values_list('category', flat=True)), {c for c, _ in Item.CATEGORY_CHOICES})
+        self.assertEqual(
+            set(items.values_list('item_type', 'status')),
+            {('lost', 'active'), ('found', 'active'), ('found', 'claimed'), ('found', 'returned')},
+        )
+        self.assertFalse(items.filter(status='active', claimed_by__isnull=False).exists())
+        self.assertFalse(items.exclude(status='active').filter(claimed_by__isnull=True).exists())
+        self.assertFalse(items.filter(claimed_by=F('poster')).exists())
+        self.assertTrue(Review.objects.exists())
+        self.assertFalse(Review.objects.exclude(item__status='returned', reviewer=F('item__claimed_by')).exists())
+        # Spread out in time, not all stamped with now()
+        self.assertGreater(items.dates('created_at', 'day').count(), 100)
+
+    def test_same_seed_same_rows(self):
+        first = list(self.seed().order_by('id').values_list('title', 'item_type', 'status', 'poster__email'))
+        User.objects.filter(email__endswith=f'@{SEED_EMAIL_DOMAIN}').delete()
+        second = list(self.seed().order_by('id').values_list('title', 'item_type', 'status', 'poster__email'))
+        self.assertEqual(first, second)
+
+    def test_running_again_adds_more(self):
+        self.seed()
+        self.seed()
+        self.assertEqual(User.objects.filter(email__endswith=f'@{SEED_EMAIL_DOMAIN}').count(), 60)
+
+
+class BenchViewsTests(TestCase):
+    def setUp(self):
+        get_cache().clear()
+        call_command('seed_data', users=10, items=40, conversation_rate=1.0, seed=3, stdout=io.StringIO())
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.output = os.path.join(directory.name, 'bench.json')
+
+    def bench(self, **options):
+        call_command('bench_views', requests=3, warmup=1, output=self.output, stdout=io.StringIO(),
+                     stderr=io.StringIO(), **options)
+        with open(self.output) as f:
+            return json.load(f)
+
+    def test_every_page_is_measured(self):
+        report = self.bench()
+        self.assertEqual(list(report['results']), ['client'])
+        pages = report['results']['client']
+        self.assertEqual(set(pages), set(bench_views.SCENARIOS))
+        for result in pages.values():
+            self.assertEqual(result['requests'], 3)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['bytes'], 0)
+        self.assertGreater(pages['dashboard']['queries'], 0)
+        self.assertEqual(report['meta']['rows']['items'], 40)
+
+    def test_slower_or_chattier_pages_fail_against_a_baseline(self):
+        report = self.bench(scenarios='home,dashboard')
+        report['results']['client']['home']['p95_ms'] /= 10
+        report['results']['client']['dashboard']['queries'] -= 1
+        baseline = self.output + '.baseline'
+        with open(baseline, 'w') as f:
+            json.dump(report, f)
+        with self.assertRaisesMessage(CommandError, '2 regressions'):
+            self.bench(scenarios='home,dashboard', baseline=baseline, threshold=1.0)
+
+    def test_users_without_conversations_skip_the_conversation_page(self):
+        User.objects.create_user(email='quiet@example.com', password='pass12345')
+        report = self.bench(email='quiet@example.com')
+        self.assertEqual(set(report['results']['client']), set(bench_views.SCENARIOS) - {'conversation_detail'})
+
+    def test_http_transport_starts_the_deployed_server(self):
+        command = bench_views.server_command()
+        self.assertEqual(command[:2], ['gunicorn', 'core.asgi:application'])
+        self.assertIn('uvicorn.workers.UvicornWorker', command)
+
+    def test_compare_allows_the_threshold(self):
+        def report(p95, queries):
+            return {'results': {'client': {'home': {'p95_ms': p95, 'queries': queries}}}}
+
+        self.assertEqual(bench_views.compare(report(10, 3), report(11.9, 3), 0.2), [])
+        self.assertEqual(len(bench_views.compare(report(10, 3), report(12.1, 3), 0.2)), 1)
+        self.assertEqual(len(bench_views.compare(report(10, 3), report(10, 4), 0.2)), 1)
+        # Pages missing from the baseline are new, not regressions
+        self.assertEqual(bench_views.compare({'results': {}}, report(10, 3), 0.2), [])
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        get_cache().clear()
+        self.poster = User.objects.create_user(email='poster@example.com', password='pass12345')
+        self.claimer = User.objects.create_user(email='claimer@example.com', password='pass12345')
+        self.client.force_login(self.poster)
+
+    def add_items(self, poster, count, **fields):
+        for i in range(count):
+            item = make_item(poster, title=f'Black backpack {Item.objects.count()}', **fields)
+            if fields.get('status') != 'active':
+                Item.objects.filter(pk=item.pk).update(claimed_by=self.claimer)
+
+    def add_reviewed_items(self, count):
+        # Returned to the claimer and reviewed, so they render with a claimer and a review each
+        self.add_items(self.poster, count, status='returned')
+        for item in Item.objects.filter(reviews__isnull=True, status='returned'):
+            Review.objects.create(item=item, reviewer=self.claimer, rating=4, comment='Thanks')
+
+    def test_home(self):
+        self.assertConstantQueries(lambda n: self.add_items(self.claimer, n, status='active'),
+                                   lambda: self.client.get(reverse('items:home')), budget=6)
+        self.assertConstantQueries(lambda n: self.add_items(self.claimer, n, status='active'),
+                                   lambda: self.client.get(reverse('items:home'), {'q': 'backpack', 'type': 'found'}),
+                                   sizes=(25, 30, 60))
+
+    def test_home_feed(self):
+        self.assertConstantQueries(lambda n: self.add_items(self.claimer, n, status='active'),
+                                   lambda: self.client.get(reverse('items:home_feed'), {'type': 'found'}), budget=5)
+
+    def test_item_detail(self):
+        item = make_item(self.poster, item_type='lost', title='Black backpack')
+
+        def add_rows(count):
+            # Reviews on the item and found items the match panel lists
+            for _ in range(count):
+                reviewer = User.objects.create_user(email=f'reviewer{User.objects.count()}@example.com')
+                Review.objects.create(item=item, reviewer=reviewer, rating=5, comment='Found it')
+                make_item(reviewer, title='Black backpack')
+
+        url = reverse('items:item_detail', args=[item.id])
+        self.client.get(url)  # builds the match index
+        self.assertConstantQueries(add_rows, lambda: self.client.get(url), budget=5)
+
+    def test_dashboard(self):
+        def add_rows(count):
+            # The poster's own items and items they claimed that wait for a review
+            self.add_items(self.poster, count, status='claimed')
+            for _ in range(count):
+                item = make_item(self.claimer, status='returned')
+                Item.objects.filter(pk=item.pk).update(claimed_by=self.poster)
+
+        self.assertConstantQueries(add_rows, lambda: self.client.get(reverse('items:dashboard')), budget=5)
+
+    def test_post_and_edit_forms(self):
+        item = make_item(self.poster)
+        add_rows = lambda n: self.add_items(self.poster, n, status='active')
+        self.assertConstantQueries(add_rows, lambda: self.client.get(reverse('items:post_item')), budget=2)
+        self.assertConstantQueries(add_rows, lambda: self.client.get(reverse('items:edit_item', args=[item.id])),
+                                   sizes=(21, 25, 40), budget=3)
+
+    def test_claim_return_and_review(self):
+        # Each request acts on a new item; the rows that pile up are the claimer's earlier ones
+        def add_rows(count):
+            self.add_reviewed_items(count)
+            self.item = make_item(self.poster)
+
+        claimer = Client()
+        claimer.force_login(self.claimer)
+
+        def claim_return_and_review():
+            claimer.post(reverse('items:claim_item', args=[self.item.id]))
+            self.client.post(reverse('items:mark_as_returned', args=[self.item.id]))
+            return claimer.post(reverse('items:add_review', args=[self.item.id]), {'rating': 5, 'comment': 'Thanks'})
+
+        self.assertConstantQueries(add_rows, claim_return_and_review)
+        self.assertTrue(Review.objects.filter(item=self.item, reviewer=self.claimer).exists())
+
+    def test_delete_item(self):
+        # The rows are the conversations, messages and reviews that go with the deleted item
+        def add_rows(count):
+            self.total = getattr(self, 'total', 0) + count
+            self.item = make_item(self.poster, status='returned', claimed_by=self.claimer)
+            Review.objects.create(item=self.item, reviewer=self.claimer, rating=5, comment='Thanks')
+            for i in range(self.total):
+                asker = User.objects.create_user(email=f'asker{User.objects.count()}@example.com')
+                conversation = Conversation.objects.create(item=self.item, sender=asker, receiver=self.poster)
+                Message.objects.create(conversation=conversation, sender=asker, content='Is it mine?')
+                Message.objects.create(conversation=conversation, sender=self.poster, content='What colour?')
+
+        self.assertConstantQueries(add_rows, lambda: self.client.post(reverse('items:delete_item', args=[self.item.id])))
+        self.assertFalse(Conversation.objects.filter(item=self.item).exists())
@@ -5,6 +5,7 @@ app_name = 'items'
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('feed/', views.home_feed, name='home_feed'),
     path('post/', views.post_item, name='post_item'),
     path('item/<int:item_id>/', views.item_detail, name='item_detail'),
     path('dashboard/', views.dashboard, name='dashboard'),
@@ -1,58 +1,172 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
 from django.contrib import messages
+from django.db.models import Prefetch
+from django.views.decorators.http import etag
+import hashlib
+
+from core.cache import cache_anonymous_page, get_cache, invalidate_tags, tag_etag
 from .forms import ItemForm, ReviewForm
+from .matching import engine as match_engine
 from .models import Item, Review
+from .pagination import KeysetPage, paginate_keyset
+from .photohash import forget_fingerprint, hash_upload, save_fingerprint, similar_items
+from .search import get_search_backend
+from .stats import dashboard_stats
 
 
-def home(request):
-    """Display all items with filtering and search"""
+ITEMS_PER_PAGE = 24
+
+# The unfiltered first pages of the feed are what most visitors load.
+# Item writes invalidate them through the feed:<type> tags, so the
+# timeouts only bound how long an unused entry lingers.
+FEED_CACHE_SECONDS = 300
+ITEM_CACHE_SECONDS = 300
+
+# Whole feed pages for logged-out visitors, invalidated the same way;
+# browsers and proxies may reuse them for HOME_PAGE_MAX_AGE seconds
+HOME_PAGE_CACHE_SECONDS = 300
+HOME_PAGE_MAX_AGE = 30
+
+
+def _feed_params(request):
+    """The feed's type, search, sort and cursor parameters, normalised"""
     item_type = request.GET.get('type', 'all')
-    search_query = request.GET.get('q', '')
+    if item_type not in ['lost', 'found']:
+        item_type = 'all'
+    search_query = ' '.join(request.GET.get('q', '').split())
     sort_by = request.GET.get('sort', 'newest')
+    if sort_by not in ['newest', 'oldest', 'relevance'] or (sort_by == 'relevance' and not search_query):
+        sort_by = 'newest'
+    return item_type, search_query, sort_by, request.GET.get('cursor', '')
+
+
+def _feed_tags(item_type):
+    """Cache tags of a feed filtered to ``item_type`` (see Item.cache_tags)"""
+    return ['feed:lost', 'feed:found'] if item_type == 'all' else [f'feed:{item_type}']
+
+
+def _anonymous_feed_key(request):
+    """Page cache key and tags for a logged-out feed request (see cache_anonymous_page)"""
+    params = _feed_params(request)
+    digest = hashlib.md5('\n'.join(params).encode()).hexdigest()
+    return f'items:page:{request.resolver_match.url_name}:{digest}', _feed_tags(params[0])
+
+
+def _page_etag(request, tags):
+    """
+    ETag of a page showing what ``tags`` cover. A logged-in visitor's
+    pages also show their unread message count, which changes with their
+    conversations.
+    """
+    if request.user.is_authenticated:
+        tags = [*tags, f'user:{request.user.pk}:conversations']
+    return tag_etag(request, tags)
+
+
+def _feed_etag(request):
+    # The URL already tells the browser's copies of different filters apart
+    return _page_etag(request, _feed_tags(_feed_params(request)[0]))
+
+
+def _item_etag(request, item_id):
+    # Matches and similar photos come from the other items
+    return _page_etag(request, [f'item:{item_id}', 'feed:lost', 'feed:found'])
+
+
+def _feed_page(request):
+    """Build one keyset page of the home feed from the request's filters"""
+    item_type, search_query, sort_by, cursor = _feed_params(request)
     
     items = Item.objects.all()
     
     if item_type in ['lost', 'found']:
         items = items.filter(item_type=item_type)
     
-    if search_query:
-        items = items.filter(
-            Q(title__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(category__icontains=search_query) |
-            Q(location__icontains=search_query)
-        )
-    
-    if sort_by == 'oldest':
-        items = items.order_by('created_at')
+    search = get_search_backend()
+    if search_query and sort_by == 'relevance':
+        # Relevance order has no stable (created_at, id) position to resume
+        # from, so ranked results are a single page of the best matches
+        page = KeysetPage(search.ranked(items, search_query))
     else:
-        items = items.order_by('-created_at')
+        if search_query:
+            items = search.filter(items, search_query)
+        descending = sort_by != 'oldest'
+        
+        def load_page():
+            return paginate_keyset(items, cursor=cursor, per_page=ITEMS_PER_PAGE, descending=descending)
+        
+        if search_query or cursor:
+            page = load_page()
+        else:
+            page = get_cache().get_or_set(
+                f'items:feed:{item_type}:{sort_by}', load_page, FEED_CACHE_SECONDS, tags=_feed_tags(item_type)
+            )
+    
+    if search_query:
+        snippets = search.snippets(search_query, [item.id for item in page])
+        for item in page:
+            item.search_snippet = snippets.get(item.id)
     
-    return render(request, 'home.html', {
-        'title': 'CampusFound | Lost & Found for Students',
-        'items': items,
+    return {
+        'items': page,
+        'next_cursor': page.next_cursor,
         'current_filter': item_type,
         'search_query': search_query,
         'current_sort': sort_by,
-    })
+    }
+
+
+@etag(_feed_etag)
+@cache_anonymous_page(_anonymous_feed_key, HOME_PAGE_CACHE_SECONDS, HOME_PAGE_MAX_AGE)
+def home(request):
+    """Display all items with filtering and search"""
+    context = _feed_page(request)
+    context['title'] = 'CampusFound | Lost & Found for Students'
+    return render(request, 'home.html', context)
 
 
+@etag(_feed_etag)
+@cache_anonymous_page(_anonymous_feed_key, HOME_PAGE_CACHE_SECONDS, HOME_PAGE_MAX_AGE)
+def home_feed(request):
+    """Next page of the home feed as an HTML fragment (infinite scroll)"""
+    return render(request, 'home_feed.html', _feed_page(request))
+
+
+def _cached_item(item_id):
+    """
+    The item with its poster, claimer and reviews (with their reviewers)
+    loaded, cached under its item:<id> tag, which review writes bump too
+    """
+    def load_item():
+        items = Item.objects.select_related('poster', 'claimed_by').prefetch_related(
+            Prefetch('reviews', queryset=Review.objects.select_related('reviewer'))
+        )
+        # Raising keeps made-up ids out of the cache
+        return get_object_or_404(items, id=item_id)
+    
+    return get_cache().get_or_set(f'items:item:{item_id}', load_item, ITEM_CACHE_SECONDS, tags=[f'item:{item_id}'])
+
+
+@etag(_item_etag)
 def item_detail(request, item_id):
     """Display a single item's details"""
-    item = get_object_or_404(Item, id=item_id)
+    item = _cached_item(item_id)
     review_form = ReviewForm()
     
     # Check if user has already reviewed
-    user_has_reviewed = False
-    if request.user.is_authenticated:
-        user_has_reviewed = Review.objects.filter(item=item, reviewer=request.user).exists()
+    user_has_reviewed = any(review.reviewer_id == request.user.pk for review in item.reviews.all())
+    
+    # Suggest opposite-type items that look like this one
+    matches = match_engine.find_matches(item) if item.status == 'active' else []
+    similar_photos = similar_items(item) if item.photo else []
     
     return render(request, 'item_detail.html', {
         'item': item,
         'review_form': review_form,
         'user_has_reviewed': user_has_reviewed,
+        'matches': matches,
+        'similar_photos': similar_photos,
     })
 
 
@@ -65,7 +179,10 @@ def post_item(request):
             try:
                 item = form.save(commit=False)
                 item.poster = request.user
+                photo_hash = hash_upload(request.FILES['photo']) if 'photo' in request.FILES else None
                 item.save()
+                if photo_hash is not None:
+                    save_fingerprint(item, photo_hash)
                 messages.success(request, 'Item posted successfully!')
                 return redirect('items:item_detail', item_id=item.id)
             except Exception as e:
@@ -86,30 +203,28 @@ def dashboard(request):
     """User's personal dashboard"""
     filter_type = request.GET.get('filter', 'all')
     
-    my_items = Item.objects.filter(poster=request.user)
+    my_items = Item.objects.filter(poster=request.user).select_related('claimed_by')
     
     if filter_type in ['lost', 'found']:
         my_items = my_items.filter(item_type=filter_type)
     
-    total_items = Item.objects.filter(poster=request.user).count()
-    returned_items = Item.objects.filter(poster=request.user, status='returned').count()
-    active_chats = 0  # No chat system anymore
+    # Every number on the page comes from one cached aggregate
+    stats = dashboard_stats(request.user.id)
     
-    # Get items that need reviews (items claimed by user that are returned but not reviewed)
-    items_to_review = Item.objects.filter(
-        claimed_by=request.user,
-        status='returned'
-    ).exclude(
-        reviews__reviewer=request.user
-    )
+    # Items claimed by the user that were returned but not reviewed yet
+    items_to_review = []
+    if stats['to_review']:
+        items_to_review = list(
+            Item.objects.filter(claimed_by=request.user, status='returned')
+            .exclude(reviews__reviewer=request.user)
+            .select_related('poster')
+        )
     
     context = {
-        'my_items': my_items,
-        'total_items': total_items,
-        'returned_items': returned_items,
-        'active_chats': active_chats,
+        'my_items': list(my_items),
+        'stats': stats,
         'current_filter': filter_type,
-        'items_to_review': items_to_review,  # NEW
+        'items_to_review': items_to_review,
     }
     
     return render(request, 'dashboard.html', context)
@@ -124,7 +239,13 @@ def edit_item(request, item_id):
         form = ItemForm(request.POST, request.FILES, instance=item)
         if form.is_valid():
             try:
+                photo_hash = hash_upload(request.FILES['photo']) if 'photo' in request.FILES else None
                 form.save()
+                if photo_hash is not None:
+                    save_fingerprint(item, photo_hash)
+                elif 'photo' in request.FILES:
+                    # The new photo couldn't be read; don't match on the old one
+                    forget_fingerprint(item)
                 messages.success(request, 'Item updated successfully!')
                 return redirect('items:dashboard')
             except Exception as e:
@@ -155,9 +276,12 @@ def mark_as_returned(request, item_id):
     item = get_object_or_404(Item, id=item_id, poster=request.user)
     
     if request.method == 'POST':
-        item.status = 'returned'
-        item.save()
-        messages.success(request, 'Item marked as returned! The claimer will be prompted to leave a review.')
+        if Item.objects.mark_returned(item.id):
+            # .update() skips post_save, so invalidate the cached views here
+            invalidate_tags(*item.cache_tags())
+            messages.success(request, 'Item marked as returned! The claimer will be prompted to leave a review.')
+        else:
+            messages.error(request, 'Only claimed items can be marked as returned.')
     
     return redirect('items:dashboard')
 
@@ -168,16 +292,21 @@ def claim_item(request, item_id):
     item = get_object_or_404(Item, id=item_id)
     
     if request.method == 'POST':
-        if item.poster == request.user:
+        if item.poster_id == request.user.id:
             messages.error(request, "You can't claim your own item!")
-        elif item.status != 'active':
-            messages.error(request, 'This item has already been claimed.')
-        else:
-            item.status = 'claimed'
-            item.claimed_by = request.user
-            item.save()
+        elif Item.objects.claim(item.id, request.user.id):
+            # .update() skips post_save, so update the match index and caches here
+            item.status, item.claimed_by = 'claimed', request.user
+            match_engine.item_saved(item)
+            invalidate_tags(*item.cache_tags())
             messages.success(request, 'Item claimed! Please contact the poster to arrange pickup.')
-            return redirect('items:item_detail', item_id=item.id)
+        else:
+            # Someone got there first; say who from the row as it is now
+            item.refresh_from_db(fields=['status', 'claimed_by'])
+            if item.claimed_by_id == request.user.id:
+                messages.info(request, 'You have already claimed this item.')
+            else:
+                messages.error(request, 'This item has already been claimed.')
     
     return redirect('items:item_detail', item_id=item.id)
 